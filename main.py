@@ -2,9 +2,8 @@ from fastapi import FastAPI, Header, HTTPException
 import uvicorn
 from dotenv import load_dotenv
 import os
-import time
 import asyncio
-from typing import Dict
+from typing import Optional
 from contextlib import asynccontextmanager
 
 import sys
@@ -12,56 +11,93 @@ import sys
 # Get the parent directory of the current file and add it to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from websites_to_fetch_from.aliexpress_api import (
-    fetch_aliexpress_product_recommendations,
+from websites_to_fetch_from.fetch_from_all_websites import (
+    fetch_products_from_all_websites,
 )
-from websites_to_fetch_from.ishtari_api import fetch_ishtari_product_recommendations
-from websites_to_fetch_from.hicart_api import fetch_hicart_product_recommendations
 from models.fastapi_endpoints import SheetUpdate
 from utils.utils import remove_elements_with_whitespaces_and_empty_from_list
+from utils.keyword_scheduler import process_keywords_in_order
+from utils.job_manager import ProductFetchJob, ProductFetchJobManager
+from utils.product_ranking import TOP_K_PRODUCTS_PER_KEYWORD
 from utils.api_utils import (
     check_shared_secret_validity,
     ALIEXPRESS_COOKIE,
     ISHTARI_COOKIE,
 )
 from utils.sheet_utils import (
+    SheetWriteBuffer,
     signal_start_of_product_retrieval,
     signal_end_of_product_retrieval,
     update_spreadsheet_with_fetched_products,
 )
 from utils.logger import logger
-from utils.using_playwright import (
-    get_aliexpress_cookie_using_playwright,
-    get_ishtari_cookie_using_playwright,
-)
+from utils.using_playwright import SHARED_BROWSER
 
 load_dotenv()
 
 
-@asynccontextmanager
-async def lifespan(
-    app: FastAPI,
-):  # we can also do things with app here like initializing a database connection for example
+async def _load_or_harvest_cookie(cookie_object):
     try:
-        # on startup:
-        # We fetch the cookies and load them in memory on server startup so that we don't have to fetch
-        # them when needed and increase the wait time to get the products for the user. HiCart doesn't
-        # require a cookie
-        logger.info(
-            "Server has started successfully, Fetching the AliExpress and Ishtari Cookies"
-        )
-        ALIEXPRESS_COOKIE.cookie = await get_aliexpress_cookie_using_playwright()
-        ISHTARI_COOKIE.cookie = await get_ishtari_cookie_using_playwright()
-        logger.info("Got the cookies successfully")
+        if not cookie_object.load_from_disk():
+            await cookie_object.refresh()
+    finally:
+        # from now on the cookie is refreshed in the background before it expires, this also retries a
+        # harvest that failed
+        cookie_object.start_background_refresh()
+
+
+async def _warm_up_cookies():
+    # both sites are harvested at the same time, in their own contexts of the shared browser
+    results = await asyncio.gather(
+        _load_or_harvest_cookie(ALIEXPRESS_COOKIE),
+        _load_or_harvest_cookie(ISHTARI_COOKIE),
+        return_exceptions=True,
+    )
+    for cookie_object, result in zip((ALIEXPRESS_COOKIE, ISHTARI_COOKIE), results):
+        if isinstance(result, Exception):
+            logger.error(
+                f"Failed to get the {cookie_object.website_name} cookie, retrying in the background: {result}"
+            )
+    logger.info("Finished warming up the cookies")
 
-        yield
 
-        # on shutdown:
-        logger.info("Server shutting down")
+# The background task getting the cookies on startup. The jobs don't wait for it, they wait for the
+# cookie of each website they fetch from (see _fetch_website_products)
+cookie_warmup_task: Optional[asyncio.Task] = None
 
-    except Exception as e:
-        logger.error(f"Failed to initialize server: {e}")
-        raise
+
+def cookies_are_ready() -> bool:
+    return not ALIEXPRESS_COOKIE.is_expired() and not ISHTARI_COOKIE.is_expired()
+
+
+@asynccontextmanager
+async def lifespan(
+    app: FastAPI,
+):  # we can also do things with app here like initializing a database connection for example
+    global cookie_warmup_task
+    # on startup:
+    # We fetch the cookies and load them in memory on server startup so that we don't have to fetch
+    # them when needed and increase the wait time to get the products for the user. HiCart doesn't
+    # require a cookie. Cookies saved by a previous run are reused until they expire, Playwright only
+    # runs for the missing or expired ones.
+    # This runs in the background, the server accepts requests right away and /health reports when the
+    # cookies are ready
+    logger.info(
+        "Server has started successfully, Fetching the AliExpress and Ishtari Cookies in the background"
+    )
+    cookie_warmup_task = asyncio.create_task(_warm_up_cookies())
+    JOB_MANAGER.start()
+
+    yield
+
+    # on shutdown:
+    logger.info("Server shutting down")
+    await JOB_MANAGER.stop()
+    cookie_warmup_task.cancel()
+    await asyncio.gather(cookie_warmup_task, return_exceptions=True)
+    await ALIEXPRESS_COOKIE.stop_background_refresh()
+    await ISHTARI_COOKIE.stop_background_refresh()
+    await SHARED_BROWSER.close()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -71,122 +107,137 @@ SHARED_SECRET = os.getenv("SHARED_SECRET")
 
 @app.get("/health")
 async def read_root():
+    """The server is live as soon as it answers. It's ready once the cookies are, until then the jobs
+    wait for them"""
     logger.info("Health check endpoint was accessed")
-    return {"Hello": "World"}
-
+    return {"Hello": "World", "live": True, "ready": cookies_are_ready()}
 
-# Store active fetch tasks and cancellation flags for each task
-active_tasks: Dict[str, asyncio.Task] = {}
-cancel_flags: Dict[str, bool] = {}
 
-
-async def fetch_products_async(task_id: str, keywords: list):
+async def fetch_products_async(job: ProductFetchJob):
     """
-    A async wrapper on top of the fetch_aliexpress_product_recommendations() function so that
-    we can cancel the product fetch when we want by canceling the async task associated with it
+    Runs a product fetch job for the job manager's workers. The job is cancelled through its
+    cancellation flag, which is checked between the keywords
     """
     try:
-        cancel_flags[task_id] = False
-        keywords = remove_elements_with_whitespaces_and_empty_from_list(keywords)
+        keywords = remove_elements_with_whitespaces_and_empty_from_list(job.keywords)
         logger.info(f"filtered keywords: {keywords}")
+        job.keywords_total = len(keywords)
 
         # Update the status cells in sheet1
-        if not signal_start_of_product_retrieval():
+        if not await asyncio.to_thread(signal_start_of_product_retrieval):
             return False
 
-        for product_order_id, keyword in enumerate(keywords):
-            # Check if cancellation was requested
-            if cancel_flags[task_id]:
-                logger.info(f"Task {task_id} was cancelled")
-                return False
-            logger.info(f"This is the product ID: {product_order_id+1}")
-            ali_express_fetched_products = (
-                await fetch_aliexpress_product_recommendations(
-                    keyword, ALIEXPRESS_COOKIE
-                )
-            )
-            ishtari_fetched_products = await fetch_ishtari_product_recommendations(
-                keyword, ISHTARI_COOKIE
-            )
-            hicart_fetched_products = await fetch_hicart_product_recommendations(
-                keyword
+        # The finished keyword groups are collected in a write buffer and written to the sheet in batches.
+        # Every keyword gets its block of rows up front, so its products can be shown as soon as the
+        # first websites answer instead of after the slowest one
+        sheet_buffer = SheetWriteBuffer()
+        await asyncio.to_thread(
+            sheet_buffer.reserve_keyword_blocks,
+            len(keywords),
+            TOP_K_PRODUCTS_PER_KEYWORD,
+        )
+        # the buffer is flushed every few seconds in the background, so the first products of a keyword
+        # show up even while its slowest website is still being fetched
+        sheet_buffer.start_flusher()
+
+        # Several keywords are fetched at once, but their product groups are still written to the sheet
+        # in keyword order. The pacing per website is done by the rate limiters in utils/rate_limiting.py
+        async def fetch_keyword_products(keyword, product_order_id):
+            # AliExpress, Ishtari and HiCart are queried concurrently for each keyword
+            return await fetch_products_from_all_websites(
+                keyword,
+                ALIEXPRESS_COOKIE,
+                ISHTARI_COOKIE,
+                bypass_cache=job.bypass_cache,
+                result_depth=job.result_depth,
+                on_partial_products=lambda products: sheet_buffer.add_partial_products(
+                    products, product_order_id, keyword
+                ),
             )
+
+        def write_keyword_products(fetched_products, product_order_id, keyword):
             update_spreadsheet_with_fetched_products(
-                ali_express_fetched_products.concatenate(
-                    ishtari_fetched_products
-                ).concatenate(hicart_fetched_products),
-                product_order_id + 1,
+                fetched_products,
+                product_order_id,
                 keyword,
+                sheet_buffer=sheet_buffer,
             )
-            logger.info(
-                f"Successfully fetched products from AliExpress for keyword: {keyword}"
+            job.keywords_done += 1
+            logger.info(f"Successfully fetched products for keyword: {keyword}")
+
+        try:
+            finished = await process_keywords_in_order(
+                keywords,
+                fetch_keyword_products,
+                write_keyword_products,
+                is_cancelled=lambda: job.cancel_requested,
             )
-            await asyncio.sleep(
-                2
-            )  # Using asyncio.sleep instead of time.sleep since we are dealing with concurrency now
+        finally:
+            # writing the groups that are still in the buffer, also when the task was cancelled
+            await sheet_buffer.close()
+        if not finished:
+            logger.info(f"Job {job.job_id} was cancelled")
+            return False
 
         # signify end of product retrieval by updating the status cell in sheet 1
-        if not signal_end_of_product_retrieval():
+        if not await asyncio.to_thread(signal_end_of_product_retrieval):
             return False
         return True
 
     except Exception as e:
         logger.exception(f"Error in fetch_products_async: {e}")
         return False
-    finally:
-        # Cleanup. Without this the server could run out of memory over time
-        if task_id in active_tasks:
-            del active_tasks[task_id]
-        if task_id in cancel_flags:
-            del cancel_flags[task_id]
+
+
+# The triggers are queued and run by a fixed number of workers, see utils/job_manager.py
+JOB_MANAGER = ProductFetchJobManager(fetch_products_async)
 
 
 @app.post("/trigger_product_fetch")
 async def update_recommended_products(
     update: SheetUpdate, authorization: str = Header(None)
 ):
-    """This endpoint serves as a trigger to start the product fetch. It returns the async task ID instead
-    of it blocking the program and making the client wait for the product fetch to finish to get a response.
-    This task ID is used on the client side to trigger the cancellation endpoint if need be, and cancel the
-    particular task with this task ID"""
+    """This endpoint serves as a trigger to start the product fetch. It queues the job and returns its ID
+    instead of it blocking the program and making the client wait for the product fetch to finish to get a
+    response. This task ID can be passed to the cancellation endpoint to cancel this particular job. When too
+    many jobs are already waiting the trigger is turned down with a 429"""
     try:
         logger.info("Starting product fetch")
         # Validate the shared secret
         check_shared_secret_validity(authorization, SHARED_SECRET)
 
-        # Generates a unique task ID every time
-        task_id = str(int(time.time()))
-
-        # Create and store the task
-        task = asyncio.create_task(fetch_products_async(task_id, update.keywords))
-        active_tasks[task_id] = task
+        job = JOB_MANAGER.submit(
+            update.keywords, update.bypass_cache, update.result_depth
+        )
 
-        return {"message": "Product fetch started", "task_id": task_id}
+        return {
+            "message": "Product fetch started",
+            "task_id": job.job_id,
+            "queue_position": JOB_MANAGER.status()[job.job_id]["queue_position"],
+        }
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception(f"The exception printed: {e}")
         raise HTTPException(status_code=500, detail=f"This is the exception: {e}")
 
 
 @app.post("/cancel_product_fetch")
-async def cancel_fetching_recommended_products(authorization: str = Header(None)):
+async def cancel_fetching_recommended_products(
+    task_id: Optional[str] = None, authorization: str = Header(None)
+):
     try:
         # Validate the shared secret
         check_shared_secret_validity(authorization, SHARED_SECRET)
 
-        # Get the most recent task (if any)
-        if not active_tasks:
-            raise HTTPException(
-                status_code=404, detail="No active product fetch to cancel"
-            )
+        # the given job, or the most recent one (if any)
+        job = JOB_MANAGER.cancel(task_id)
 
-        task_id = list(active_tasks.keys())[-1]
-
-        # Set cancellation flag
-        cancel_flags[task_id] = True
-
-        logger.info(f"Cancelling task {task_id}")
-        return {"message": "Product fetch cancellation requested", "task_id": task_id}
+        return {
+            "message": "Product fetch cancellation requested",
+            "task_id": job.job_id,
+        }
 
     except HTTPException:
         raise
@@ -199,13 +250,9 @@ async def cancel_fetching_recommended_products(authorization: str = Header(None)
 async def get_fetch_status(authorization: str = Header(None)):
     check_shared_secret_validity(authorization, SHARED_SECRET)
 
-    return {
-        task_id: {
-            "running": not task.done(),
-            "cancelled": cancel_flags.get(task_id, False),
-        }
-        for task_id, task in active_tasks.items()
-    }
+    # The queued and running jobs with their progress. The Apps Script only triggers a fetch when this
+    # is empty
+    return JOB_MANAGER.status()
 
 
 logger.info("Launched the server")
@@ -1,7 +1,11 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List
 
 
 # for the incoming data in the trigger_product_fetch post endpoint
 class SheetUpdate(BaseModel):
     keywords: List[str]
+    # fetch every keyword from the websites even if its products are in the cache
+    bypass_cache: bool = False
+    # number of Ishtari products fetched per keyword, more than a page (10) is fetched page by page
+    result_depth: int = Field(10, ge=1, le=100)
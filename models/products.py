@@ -1,5 +1,6 @@
+import itertools
 from pydantic import BaseModel, model_validator
-from typing import List
+from typing import Iterator, List, NamedTuple, Optional, Tuple
 
 
 # For the output of functions that fetch products (for a single keyword) from websites (AliExpress, Ishtari, ...)
@@ -41,3 +42,129 @@ class InputFetchedProducts(BaseModel):
     product_urls: List[str]
     product_prices: List[str]
     website_source: List[str]
+
+
+class _ProductColumns(NamedTuple):
+    product_names: List[str]
+    product_urls: List[str]
+    product_prices: List[str]
+    website_source: List[str]
+    similarity_scores: Optional[List[float]]
+
+
+class ProductBatch:
+    """The products of a keyword stored column by column, for the ranking and the sheet writer. It's
+    validated once when it's built (or not at all when it comes from an already validated model), and
+    concatenate() doesn't copy any product: the batch only keeps references to the columns of the batches
+    it's made of, they are joined when a whole column is read.
+
+    iter_rows() gives the products one row at a time in the order of the sheet columns, so the sheet
+    writer doesn't have to transpose the columns"""
+
+    __slots__ = ("_chunks", "_length")
+
+    def __init__(
+        self,
+        product_names: List[str],
+        product_urls: List[str],
+        product_prices: List[str],
+        website_source: List[str],
+        similarity_scores: Optional[List[float]] = None,
+        validate: bool = True,
+    ):
+        chunk = _ProductColumns(
+            product_names,
+            product_urls,
+            product_prices,
+            website_source,
+            similarity_scores,
+        )
+        if validate:
+            lengths = {
+                name: len(column)
+                for name, column in chunk._asdict().items()
+                if column is not None
+            }
+            if len(set(lengths.values())) != 1:
+                raise ValueError(
+                    f"All lists must have the same length. Lengths found: {lengths}"
+                )
+        self._chunks = (chunk,)
+        self._length = len(product_names)
+
+    @classmethod
+    def _from_chunks(cls, chunks: Tuple[_ProductColumns, ...]) -> "ProductBatch":
+        batch = cls.__new__(cls)
+        batch._chunks = chunks
+        batch._length = sum(len(chunk.product_names) for chunk in chunks)
+        return batch
+
+    @classmethod
+    def from_fetched_products(
+        cls, products: "OutputFetchedProducts | InputFetchedProducts"
+    ) -> "ProductBatch":
+        # the model already checked the lengths
+        return cls(
+            products.product_names,
+            products.product_urls,
+            products.product_prices,
+            products.website_source,
+            validate=False,
+        )
+
+    def concatenate(self, other: "ProductBatch") -> "ProductBatch":
+        return ProductBatch._from_chunks(self._chunks + other._chunks)
+
+    def __len__(self):
+        return self._length
+
+    def _column(self, index: int) -> list:
+        if len(self._chunks) == 1:
+            return self._chunks[0][index]
+        return list(
+            itertools.chain.from_iterable(chunk[index] for chunk in self._chunks)
+        )
+
+    @property
+    def product_names(self) -> List[str]:
+        return self._column(0)
+
+    @property
+    def product_urls(self) -> List[str]:
+        return self._column(1)
+
+    @property
+    def product_prices(self) -> List[str]:
+        return self._column(2)
+
+    @property
+    def website_source(self) -> List[str]:
+        return self._column(3)
+
+    @property
+    def similarity_scores(self) -> Optional[List[float]]:
+        """None unless every product was scored"""
+        if any(chunk.similarity_scores is None for chunk in self._chunks):
+            return None
+        return self._column(4)
+
+    def iter_rows(self) -> Iterator[tuple]:
+        """(name, price, url, website, similarity score) of every product, the score is None if the
+        product wasn't scored"""
+        for chunk in self._chunks:
+            scores = chunk.similarity_scores or itertools.repeat(None)
+            yield from zip(
+                chunk.product_names,
+                chunk.product_prices,
+                chunk.product_urls,
+                chunk.website_source,
+                scores,
+            )
+
+    def __eq__(self, other):
+        if not isinstance(other, ProductBatch):
+            return NotImplemented
+        return list(self.iter_rows()) == list(other.iter_rows())
+
+    def __repr__(self):
+        return f"ProductBatch({len(self)} products)"
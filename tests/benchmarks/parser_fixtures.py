@@ -0,0 +1,155 @@
+# Builds synthetic search result documents of different sizes out of the markup templates in fixtures/
+# (written after the structure of the websites' search pages), so that the parsers can be benchmarked
+# offline on pages with 10, 60, 240... products
+import copy
+import json
+import os
+from string import Template
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# number of products in each generated page
+PAGE_SIZES = [10, 60, 240]
+
+TITLE_WORDS = [
+    "Black",
+    "Leather",
+    "Running",
+    "Shoes",
+    "Breathable",
+    "Men",
+    "Women",
+    "Casual",
+    "Sneakers",
+    "Lightweight",
+    "Mesh",
+    "Outdoor",
+]
+
+
+def _read_fixture(file_name):
+    with open(os.path.join(FIXTURES_DIRECTORY, file_name), encoding="utf-8") as file:
+        return file.read()
+
+
+def _title(index):
+    """A deterministic product title that changes with the index"""
+    words = [TITLE_WORDS[(index * 7 + i * 3) % len(TITLE_WORDS)] for i in range(6)]
+    return f"{' '.join(words)} {index}"
+
+
+def _price(index):
+    return 5 + (index * 37) % 9000 / 100
+
+
+def _page_chrome(number_of_blocks):
+    """Inline scripts and styles like the ones surrounding the product list on the real pages. The parsers
+    have to go through them even though they don't hold any product data"""
+    blocks = []
+    for i in range(number_of_blocks):
+        blocks.append(
+            f"<style>.c{i}{{margin:{i % 8}px;padding:{i % 5}px}}.c{i}:hover{{color:#{i % 999:03d}}}</style>\n"
+            f'<script>window.__track_{i}={json.dumps({"id": i, "spm": f"a2g0o.{i}", "keys": TITLE_WORDS})};</script>'
+        )
+    return "\n".join(blocks)
+
+
+def _aliexpress_embedded_data(number_of_products):
+    """The product list AliExpress embeds in a script tag of the search page"""
+    template_item = json.loads(_read_fixture("aliexpress_embedded_item.json"))
+    items = []
+    for i in range(number_of_products):
+        item = copy.deepcopy(template_item)
+        price = _price(i)
+        item["productId"] = str(1005006000000 + i)
+        item["title"]["displayTitle"] = _title(i)
+        item["prices"]["salePrice"]["minPrice"] = price
+        item["prices"]["salePrice"]["formattedPrice"] = f"US ${price:.2f}"
+        items.append(item)
+    return Template(_read_fixture("aliexpress_embedded_data.html")).substitute(
+        items=json.dumps(items), number_of_products=number_of_products
+    )
+
+
+def build_aliexpress_search_page(number_of_products, with_embedded_data=True):
+    card_template = Template(_read_fixture("aliexpress_product_card.html"))
+    cards = []
+    for i in range(number_of_products):
+        price = _price(i)
+        cards.append(
+            card_template.substitute(
+                product_id=1005006000000 + i,
+                index=i,
+                title=_title(i),
+                price_dollars=int(price),
+                price_cents=f"{round(price * 100) % 100:02d}",
+                original_price=f"{price * 1.6:.2f}",
+                sold=(i * 13) % 5000,
+            )
+        )
+    return Template(_read_fixture("aliexpress_search_page.html")).substitute(
+        page_chrome=_page_chrome(number_of_products // 2),
+        product_cards="\n".join(cards),
+        embedded_data=(
+            _aliexpress_embedded_data(number_of_products) if with_embedded_data else ""
+        ),
+    )
+
+
+def _hicart_price_box(index):
+    """HiCart shows the price in one of three ways: a regular price, a discounted price or a minimal price"""
+    price = _price(index)
+    if index % 3 == 0:
+        return (
+            '<div class="price-box"><span class="regular-price" id="product-price-{0}">'
+            '<span class="price">${1:.2f}</span></span></div>'
+        ).format(index, price)
+    if index % 3 == 1:
+        return (
+            '<div class="price-box"><p class="old-price"><span class="price-label">Regular Price:</span>'
+            '<span class="price" id="old-price-{0}">${2:.2f}</span></p>'
+            '<p class="special-price"><span class="price-label">Special Price</span>'
+            '<span class="price" id="product-price-{0}">${1:.2f}</span></p></div>'
+        ).format(index, price, price * 1.25)
+    return (
+        '<div class="price-box-min"><p class="minimal-price">${0:.2f}</p></div>'
+    ).format(price)
+
+
+def build_hicart_search_page(number_of_products):
+    card_template = Template(_read_fixture("hicart_product_card.html"))
+    cards = []
+    for i in range(number_of_products):
+        title = _title(i)
+        cards.append(
+            card_template.substitute(
+                product_id=40000 + i,
+                title=title,
+                slug=title.lower().replace(" ", "-"),
+                price_box=_hicart_price_box(i),
+            )
+        )
+    return Template(_read_fixture("hicart_search_page.html")).substitute(
+        page_chrome=_page_chrome(number_of_products // 2),
+        number_of_products=number_of_products,
+        product_cards="\n".join(cards),
+    )
+
+
+def build_ishtari_search_response(number_of_products):
+    """Returns the response body as json text, like the one the fetcher gets from the Ishtari api"""
+    response = json.loads(_read_fixture("ishtari_search_response.json"))
+    template_products = response["data"]["products"]
+    products = []
+    for i in range(number_of_products):
+        product = copy.deepcopy(template_products[i % len(template_products)])
+        title = _title(i)
+        product["product_id"] = str(100000 + i)
+        product["full_name"] = title
+        # the name always comes with two trailing characters on Ishtari
+        product["name"] = f" {title}  "
+        product["special"] = f"${_price(i):.2f}"
+        products.append(product)
+    response["data"]["products"] = products
+    response["data"]["products_count"] = str(number_of_products)
+    return json.dumps(response)
@@ -0,0 +1,191 @@
+import pytest
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from html.parser import HTMLParser
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.join(os.path.dirname(__file__), ".."), ".."))
+)
+
+from utils.logger import logger
+from websites_to_fetch_from.aliexpress_api import _parse_aliexpress_search_page
+from websites_to_fetch_from.hicart_api import _parse_hicart_search_page
+from websites_to_fetch_from.ishtari_api import _process_product_data
+from parser_fixtures import (
+    PAGE_SIZES,
+    build_aliexpress_search_page,
+    build_hicart_search_page,
+    build_ishtari_search_response,
+)
+
+# The benchmarks are wall-clock measurements, so they're left out of the default pytest run (see pytest.ini)
+# and run on their own on a quiet machine:
+#   pytest -m benchmark tests/benchmarks
+# Run with UPDATE_PARSER_BASELINES=1 to record new baselines, e.g. after a parser optimization:
+#   UPDATE_PARSER_BASELINES=1 pytest -m benchmark tests/benchmarks
+BASELINES_FILE = os.path.join(os.path.dirname(__file__), "parser_baselines.json")
+UPDATE_BASELINES = os.getenv("UPDATE_PARSER_BASELINES", "") == "1"
+
+# how much slower (or bigger) than the baseline a parser can get before the benchmark fails. Time is noisier
+# than memory so it gets more room
+TIME_TOLERANCE = float(os.getenv("PARSER_BENCHMARK_TOLERANCE", "1.5"))
+MEMORY_TOLERANCE = float(os.getenv("PARSER_BENCHMARK_MEMORY_TOLERANCE", "1.25"))
+REPEATS = int(os.getenv("PARSER_BENCHMARK_REPEATS", "7"))
+
+# (parser name, parse function, document builder, expected number of parsed products for a page size)
+PARSERS = [
+    (
+        "aliexpress",
+        _parse_aliexpress_search_page,
+        build_aliexpress_search_page,
+        lambda page_size: page_size,
+    ),
+    # AliExpress pages without the embedded product json, parsed from the product cards
+    (
+        "aliexpress_dom",
+        _parse_aliexpress_search_page,
+        lambda page_size: build_aliexpress_search_page(
+            page_size, with_embedded_data=False
+        ),
+        lambda page_size: page_size,
+    ),
+    # the Ishtari fetcher decodes the json response before processing it, so that's part of the parse
+    (
+        "ishtari",
+        lambda response_text: _process_product_data(json.loads(response_text)),
+        build_ishtari_search_response,
+        lambda page_size: page_size,
+    ),
+    # the HiCart parser only keeps the first 10 products
+    (
+        "hicart",
+        _parse_hicart_search_page,
+        build_hicart_search_page,
+        lambda page_size: min(page_size, 10),
+    ),
+]
+
+
+@contextmanager
+def _quiet_logger():
+    """The parsers log every product they find, we don't want to measure the logging"""
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        yield
+    finally:
+        logger.setLevel(level)
+
+
+def _timed(function, *args):
+    start_time = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start_time
+
+
+# A fixed document read by the standard library html parser. Its parse time tracks how fast the machine is
+# right now without depending on any of our parsers
+CALIBRATION_DOCUMENT = build_aliexpress_search_page(20, with_embedded_data=False)
+
+
+def _calibration_workload():
+    parser = HTMLParser()
+    parser.feed(CALIBRATION_DOCUMENT)
+    parser.close()
+
+
+def _measure_parse_time(parse, document):
+    """Returns the best parse time in seconds and the parse time in calibration units. Each parse is paired
+    with a calibration run right before it and we keep the median of the ratios, so a busy machine slows
+    both down and the normalized time stays comparable across runs and machines"""
+    parse_times = []
+    ratios = []
+    for _ in range(REPEATS):
+        calibration_time = _timed(_calibration_workload)
+        parse_time = _timed(parse, document)
+        parse_times.append(parse_time)
+        ratios.append(parse_time / calibration_time)
+    return min(parse_times), statistics.median(ratios)
+
+
+def _load_baselines():
+    if not os.path.exists(BASELINES_FILE):
+        return {}
+    with open(BASELINES_FILE) as file:
+        return json.load(file)
+
+
+def _save_baseline(name, result):
+    baselines = _load_baselines()
+    baselines[name] = result
+    with open(BASELINES_FILE, "w") as file:
+        json.dump(dict(sorted(baselines.items())), file, indent=4)
+        file.write("\n")
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("page_size", PAGE_SIZES)
+@pytest.mark.parametrize(
+    "parser_name, parse, build_document, expected_number_of_products",
+    PARSERS,
+    ids=[parser[0] for parser in PARSERS],
+)
+def test_parser_benchmark(
+    parser_name,
+    parse,
+    build_document,
+    expected_number_of_products,
+    page_size,
+):
+    document = build_document(page_size)
+    benchmark_name = f"{parser_name}-{page_size}"
+
+    with _quiet_logger():
+        # the first parse also checks that the parser still understands the template markup
+        products = parse(document)
+        assert len(products.product_names) == expected_number_of_products(page_size)
+        assert len(products.product_prices) == len(products.product_names)
+        assert not any(name.startswith("No matched") for name in products.product_names)
+
+        parse_time, normalized_time = _measure_parse_time(parse, document)
+
+        tracemalloc.start()
+        try:
+            parse(document)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    result = {
+        "normalized_time": round(normalized_time, 4),
+        "peak_memory_bytes": peak_memory,
+    }
+    logger.info(
+        f"{benchmark_name}: {parse_time * 1000:.2f} ms per document ({result['normalized_time']} calibration units), "
+        f"peak memory {peak_memory / 1024:.1f} KiB"
+    )
+
+    if UPDATE_BASELINES:
+        _save_baseline(benchmark_name, result)
+        return
+
+    baseline = _load_baselines().get(benchmark_name)
+    if baseline is None:
+        pytest.skip(
+            f"No baseline for {benchmark_name}, record one with UPDATE_PARSER_BASELINES=1"
+        )
+
+    assert (
+        result["normalized_time"] <= baseline["normalized_time"] * TIME_TOLERANCE
+    ), f"{benchmark_name} parse time regressed: {result['normalized_time']} vs baseline {baseline['normalized_time']}"
+    assert (
+        result["peak_memory_bytes"] <= baseline["peak_memory_bytes"] * MEMORY_TOLERANCE
+    ), f"{benchmark_name} peak memory regressed: {result['peak_memory_bytes']} vs baseline {baseline['peak_memory_bytes']}"
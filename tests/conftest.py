@@ -1,6 +1,7 @@
 # No need to import the functions of this file, pytest recognizes the name conftest.py by default and loads it
 # in the test files
 
+import pytest
 import pytest_asyncio
 import os
 import sys
@@ -13,15 +14,33 @@ from utils.using_playwright import (
     get_ishtari_cookie_using_playwright,
 )
 from utils.api_utils import AliexpressCookie, IshtariCookie
+from utils import sheet_utils
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from fake_google_sheets_api import FakeGoogleSheetsAPI
 
 
 @pytest_asyncio.fixture
 async def mock_aliexpress_cookie():
-    cookie_value = await get_aliexpress_cookie_using_playwright()
-    return AliexpressCookie(cookie=cookie_value)
+    cookie_value, expires_at = await get_aliexpress_cookie_using_playwright()
+    return AliexpressCookie(cookie=cookie_value, expires_at=expires_at)
 
 
 @pytest_asyncio.fixture
 async def mock_ishtari_cookie():
-    cookie_value = await get_ishtari_cookie_using_playwright()
-    return IshtariCookie(cookie=cookie_value)
+    cookie_value, expires_at = await get_ishtari_cookie_using_playwright()
+    return IshtariCookie(cookie=cookie_value, expires_at=expires_at)
+
+
+@pytest.fixture
+def fake_sheets_api(monkeypatch):
+    """Points the sheet functions in utils/sheet_utils.py to an in-memory Google Sheets API, see
+    tests/fake_google_sheets_api.py"""
+    api = FakeGoogleSheetsAPI()
+    monkeypatch.setenv("GOOGLE_SHEET_ID", api.spreadsheet_id)
+    monkeypatch.setattr(
+        sheet_utils,
+        "GOOGLE_SHEET_CLIENT",
+        sheet_utils.GoogleSheetClient(client_factory=api.client),
+    )
+    return api
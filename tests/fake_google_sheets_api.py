@@ -0,0 +1,421 @@
+# A local stand-in for the Google Sheets v4 endpoints that gspread uses, so that utils/sheet_utils.py can be
+# tested and benchmarked without a live spreadsheet. It's a requests transport adapter: gspread is given a
+# requests.Session with this adapter mounted on https://sheets.googleapis.com, and every call it makes is
+# answered from an in-memory grid instead of going over the network.
+#
+# Supported endpoints: spreadsheet metadata, values get/update/clear/batchClear and batchUpdate with the
+# updateCells, repeatCell, mergeCells, unmergeCells, appendDimension, insertDimension, deleteDimension and
+# updateSheetProperties requests. Every call is counted, and latency and 429 responses can be injected.
+
+import copy
+import json
+import time
+from collections import Counter
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import gspread
+import requests
+from gspread.utils import a1_range_to_grid_range
+
+SHEETS_API_URL = "https://sheets.googleapis.com/"
+
+
+class FakeSheetsAPIError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+class FakeSheet:
+    def __init__(self, sheet_id, title, index, row_count, column_count):
+        self.sheet_id = sheet_id
+        self.title = title
+        self.index = index
+        self.row_count = row_count
+        self.column_count = column_count
+        self.cells = {}  # (row, col) -> value, 0-based
+        self.formats = {}  # (row, col) -> userEnteredFormat
+        self.merges = []  # GridRanges
+
+    def properties(self):
+        return {
+            "sheetId": self.sheet_id,
+            "title": self.title,
+            "index": self.index,
+            "sheetType": "GRID",
+            "gridProperties": {
+                "rowCount": self.row_count,
+                "columnCount": self.column_count,
+            },
+        }
+
+    def bounds(self, grid_range):
+        """The 0-based half-open bounds of a GridRange, unbounded sides are filled with the grid size"""
+        bounds = (
+            grid_range.get("startRowIndex", 0),
+            grid_range.get("endRowIndex", self.row_count),
+            grid_range.get("startColumnIndex", 0),
+            grid_range.get("endColumnIndex", self.column_count),
+        )
+        if bounds[1] > self.row_count or bounds[3] > self.column_count:
+            raise FakeSheetsAPIError(
+                400,
+                f"Range {grid_range} exceeds grid limits of {self.title}: "
+                f"{self.row_count} rows, {self.column_count} columns",
+            )
+        return bounds
+
+    def value(self, row, col):
+        """1-based, like in A1 notation"""
+        return self.cells.get((row - 1, col - 1))
+
+    def column_values(self, col):
+        """1-based, trailing empty cells are dropped like the Sheets API does"""
+        values = [self.cells.get((row, col - 1), "") for row in range(self.row_count)]
+        while values and values[-1] in ("", None):
+            values.pop()
+        return values
+
+    def clear(self, bounds):
+        start_row, end_row, start_col, end_col = bounds
+        for row in range(start_row, end_row):
+            for col in range(start_col, end_col):
+                self.cells.pop((row, col), None)
+
+    def shift_rows(self, start_row, offset):
+        """Moves the rows from start_row down by offset (or up when negative), with their merges"""
+        for store in (self.cells, self.formats):
+            moved = {
+                (row + offset if row >= start_row else row, col): value
+                for (row, col), value in store.items()
+            }
+            store.clear()
+            store.update(moved)
+        for merge in self.merges:
+            if merge["startRowIndex"] >= start_row:
+                merge["startRowIndex"] += offset
+                merge["endRowIndex"] += offset
+
+
+class FakeGoogleSheetsAPI(requests.adapters.BaseAdapter):
+    """In-memory Google Sheets API. Use client() to get a gspread client that talks to it.
+
+    latency_seconds is added to every call and rate_limit_every=n answers every n-th call with a
+    429 RESOURCE_EXHAUSTED error. calls counts the calls per endpoint and batch_update_requests the
+    requests per type sent in batchUpdate calls"""
+
+    def __init__(
+        self,
+        spreadsheet_id="fake-spreadsheet-id",
+        sheet_titles=("User Input", "Product Recommendations", "YouTube Videos"),
+        row_count=1000,
+        column_count=26,
+        latency_seconds=0.0,
+        rate_limit_every=0,
+    ):
+        super().__init__()
+        self.spreadsheet_id = spreadsheet_id
+        self.sheets = {
+            title: FakeSheet(index, title, index, row_count, column_count)
+            for index, title in enumerate(sheet_titles)
+        }
+        self.latency_seconds = latency_seconds
+        self.rate_limit_every = rate_limit_every
+        self.calls = Counter()
+        self.batch_update_requests = Counter()
+        self._number_of_calls = 0
+
+    # ----- helpers for the tests -----
+
+    def client(self) -> gspread.Client:
+        session = requests.Session()
+        session.mount(SHEETS_API_URL, self)
+        return gspread.Client(auth=None, session=session)
+
+    def sheet(self, title) -> FakeSheet:
+        return self.sheets[title]
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def reset_counters(self):
+        self.calls.clear()
+        self.batch_update_requests.clear()
+
+    # ----- requests adapter interface -----
+
+    def send(self, request, **kwargs):
+        self._number_of_calls += 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+        try:
+            endpoint, handler, arguments = self._route(request)
+            self.calls[endpoint] += 1
+            if (
+                self.rate_limit_every
+                and self._number_of_calls % self.rate_limit_every == 0
+            ):
+                raise FakeSheetsAPIError(
+                    429, "Quota exceeded for quota metric 'Write requests'"
+                )
+            status_code, body = 200, handler(*arguments)
+        except FakeSheetsAPIError as e:
+            status_code = e.status_code
+            body = {
+                "error": {
+                    "code": e.status_code,
+                    "message": e.message,
+                    "status": (
+                        "RESOURCE_EXHAUSTED"
+                        if e.status_code == 429
+                        else "INVALID_ARGUMENT"
+                    ),
+                }
+            }
+        return self._response(request, status_code, body)
+
+    def close(self):
+        pass
+
+    def _response(self, request, status_code, body):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps(body).encode("utf-8")
+        response.headers["Content-Type"] = "application/json; charset=UTF-8"
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def _route(self, request):
+        url = urlsplit(request.url)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        path = url.path.split("/v4/spreadsheets/", 1)[1]
+        body = json.loads(request.body) if request.body else {}
+        method = request.method.upper()
+
+        if path == self.spreadsheet_id and method == "GET":
+            return "metadata", self._metadata, ()
+        if path == f"{self.spreadsheet_id}:batchUpdate" and method == "POST":
+            return "batchUpdate", self._batch_update, (body,)
+        if path == f"{self.spreadsheet_id}/values:batchClear" and method == "POST":
+            return "values.batchClear", self._values_batch_clear, (body,)
+
+        values_prefix = f"{self.spreadsheet_id}/values/"
+        if path.startswith(values_prefix):
+            range_name = unquote(path[len(values_prefix) :])
+            if range_name.endswith(":clear") and method == "POST":
+                return (
+                    "values.clear",
+                    self._values_clear,
+                    (range_name[: -len(":clear")],),
+                )
+            if method == "GET":
+                return "values.get", self._values_get, (range_name, params)
+            if method == "PUT":
+                return "values.update", self._values_update, (range_name, body)
+
+        raise FakeSheetsAPIError(404, f"Unsupported endpoint: {method} {request.url}")
+
+    # ----- endpoints -----
+
+    def _metadata(self):
+        return {
+            "spreadsheetId": self.spreadsheet_id,
+            "properties": {"title": "Fake Spreadsheet", "locale": "en_US"},
+            "sheets": [
+                {"properties": sheet.properties()} for sheet in self.sheets.values()
+            ],
+        }
+
+    def _parse_range(self, range_name):
+        title, _, a1_range = range_name.rpartition("!")
+        title = title.strip("'").replace("''", "'")
+        if title not in self.sheets:
+            raise FakeSheetsAPIError(400, f"Unable to parse range: {range_name}")
+        sheet = self.sheets[title]
+        return sheet, sheet.bounds(a1_range_to_grid_range(a1_range))
+
+    def _values_get(self, range_name, params):
+        sheet, (start_row, end_row, start_col, end_col) = self._parse_range(range_name)
+        if params.get("majorDimension") == "COLUMNS":
+            lines = [
+                [sheet.cells.get((row, col), "") for row in range(start_row, end_row)]
+                for col in range(start_col, end_col)
+            ]
+        else:
+            lines = [
+                [sheet.cells.get((row, col), "") for col in range(start_col, end_col)]
+                for row in range(start_row, end_row)
+            ]
+        # trailing empty cells and lines are not returned by the Sheets API
+        for line in lines:
+            while line and line[-1] in ("", None):
+                line.pop()
+        while lines and not lines[-1]:
+            lines.pop()
+
+        response = {
+            "range": range_name,
+            "majorDimension": params.get("majorDimension", "ROWS"),
+        }
+        if lines:
+            response["values"] = lines
+        return response
+
+    def _values_update(self, range_name, body):
+        sheet, (start_row, end_row, start_col, end_col) = self._parse_range(range_name)
+        values = body.get("values", [])
+        if body.get("majorDimension") == "COLUMNS":
+            values = [list(row) for row in zip(*values)]
+        if start_row + len(values) > sheet.row_count or any(
+            start_col + len(row) > sheet.column_count for row in values
+        ):
+            raise FakeSheetsAPIError(400, f"Range {range_name} exceeds grid limits")
+        for row_offset, row in enumerate(values):
+            for col_offset, value in enumerate(row):
+                sheet.cells[(start_row + row_offset, start_col + col_offset)] = value
+        return {
+            "spreadsheetId": self.spreadsheet_id,
+            "updatedRange": range_name,
+            "updatedRows": len(values),
+        }
+
+    def _values_clear(self, range_name):
+        sheet, bounds = self._parse_range(range_name)
+        sheet.clear(bounds)
+        return {"spreadsheetId": self.spreadsheet_id, "clearedRange": range_name}
+
+    def _values_batch_clear(self, body):
+        for range_name in body.get("ranges", []):
+            sheet, bounds = self._parse_range(range_name)
+            sheet.clear(bounds)
+        return {
+            "spreadsheetId": self.spreadsheet_id,
+            "clearedRanges": body.get("ranges", []),
+        }
+
+    def _sheet_by_id(self, sheet_id):
+        for sheet in self.sheets.values():
+            if sheet.sheet_id == sheet_id:
+                return sheet
+        raise FakeSheetsAPIError(400, f"No grid with id: {sheet_id}")
+
+    def _batch_update(self, body):
+        # batchUpdate is atomic, if one of the requests fails none of them is applied
+        snapshot = copy.deepcopy(self.sheets)
+        replies = []
+        try:
+            for request in body.get("requests", []):
+                ((request_type, arguments),) = request.items()
+                self.batch_update_requests[request_type] += 1
+                handler = getattr(self, f"_request_{request_type}", None)
+                if handler is None:
+                    raise FakeSheetsAPIError(
+                        400, f"Unsupported request: {request_type}"
+                    )
+                handler(arguments)
+                replies.append({})
+        except FakeSheetsAPIError:
+            self.sheets = snapshot
+            raise
+        return {"spreadsheetId": self.spreadsheet_id, "replies": replies}
+
+    # ----- batchUpdate requests -----
+
+    def _request_updateCells(self, arguments):
+        sheet = self._sheet_by_id(arguments["range"]["sheetId"])
+        start_row, end_row, start_col, end_col = sheet.bounds(arguments["range"])
+        fields = arguments["fields"]
+        updates_values = "userEnteredValue" in fields or fields == "*"
+        rows = arguments.get("rows")
+        if not rows:
+            if updates_values:
+                sheet.clear((start_row, end_row, start_col, end_col))
+            return
+
+        for row_offset, row_data in enumerate(rows):
+            for col_offset, cell in enumerate(row_data.get("values", [])):
+                position = (start_row + row_offset, start_col + col_offset)
+                if updates_values:
+                    value = cell.get("userEnteredValue", {})
+                    if value:
+                        sheet.cells[position] = next(iter(value.values()))
+                    else:
+                        sheet.cells.pop(position, None)
+                if "userEnteredFormat" in cell:
+                    sheet.formats[position] = cell["userEnteredFormat"]
+
+    def _request_repeatCell(self, arguments):
+        sheet = self._sheet_by_id(arguments["range"]["sheetId"])
+        start_row, end_row, start_col, end_col = sheet.bounds(arguments["range"])
+        cell_format = arguments["cell"].get("userEnteredFormat", {})
+        for row in range(start_row, end_row):
+            for col in range(start_col, end_col):
+                sheet.formats[(row, col)] = {
+                    **sheet.formats.get((row, col), {}),
+                    **cell_format,
+                }
+
+    def _request_mergeCells(self, arguments):
+        sheet = self._sheet_by_id(arguments["range"]["sheetId"])
+        sheet.bounds(arguments["range"])
+        sheet.merges.append(arguments["range"])
+
+    def _request_unmergeCells(self, arguments):
+        sheet = self._sheet_by_id(arguments["range"]["sheetId"])
+        start_row, end_row, _, _ = sheet.bounds(arguments["range"])
+        sheet.merges = [
+            merge
+            for merge in sheet.merges
+            if not (
+                start_row <= merge["startRowIndex"] and merge["endRowIndex"] <= end_row
+            )
+        ]
+
+    def _request_appendDimension(self, arguments):
+        sheet = self._sheet_by_id(arguments["sheetId"])
+        if arguments["dimension"] == "ROWS":
+            sheet.row_count += arguments["length"]
+        else:
+            sheet.column_count += arguments["length"]
+
+    def _request_insertDimension(self, arguments):
+        dimension_range = arguments["range"]
+        sheet = self._sheet_by_id(dimension_range["sheetId"])
+        if dimension_range["dimension"] != "ROWS":
+            raise FakeSheetsAPIError(400, "Only row insertions are supported")
+        number_of_rows = dimension_range["endIndex"] - dimension_range["startIndex"]
+        sheet.shift_rows(dimension_range["startIndex"], number_of_rows)
+        sheet.row_count += number_of_rows
+
+    def _request_deleteDimension(self, arguments):
+        dimension_range = arguments["range"]
+        sheet = self._sheet_by_id(dimension_range["sheetId"])
+        if dimension_range["dimension"] != "ROWS":
+            raise FakeSheetsAPIError(400, "Only row deletions are supported")
+        start_row, end_row = dimension_range["startIndex"], dimension_range["endIndex"]
+        if end_row > sheet.row_count:
+            raise FakeSheetsAPIError(
+                400, f"Invalid deleteDimension range: {dimension_range}"
+            )
+        if end_row - start_row >= sheet.row_count:
+            raise FakeSheetsAPIError(400, "You can't delete all the rows on the sheet.")
+        sheet.clear((start_row, end_row, 0, sheet.column_count))
+        sheet.merges = [
+            merge
+            for merge in sheet.merges
+            if not (start_row <= merge["startRowIndex"] < end_row)
+        ]
+        sheet.shift_rows(end_row, start_row - end_row)
+        sheet.row_count -= end_row - start_row
+
+    def _request_updateSheetProperties(self, arguments):
+        properties = arguments["properties"]
+        sheet = self._sheet_by_id(properties["sheetId"])
+        grid_properties = properties.get("gridProperties", {})
+        sheet.row_count = grid_properties.get("rowCount", sheet.row_count)
+        sheet.column_count = grid_properties.get("columnCount", sheet.column_count)
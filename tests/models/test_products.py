@@ -0,0 +1,66 @@
+import pytest
+import os
+import sys
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.join(os.path.dirname(__file__), ".."), ".."))
+)
+
+from models.products import OutputFetchedProducts, ProductBatch
+
+
+def _batch(website_name, names, similarity_scores=None):
+    return ProductBatch(
+        names,
+        [f"https://{website_name}/{name}" for name in names],
+        ["US $1" for _ in names],
+        [website_name for _ in names],
+        similarity_scores=similarity_scores,
+    )
+
+
+def test_product_batch_checks_the_column_lengths():
+    with pytest.raises(ValueError):
+        ProductBatch(["Black Shoes"], [], ["US $1"], ["AliExpress"])
+    with pytest.raises(ValueError):
+        _batch("AliExpress", ["Black Shoes"], similarity_scores=[0.5, 0.2])
+
+
+def test_concatenated_batches_share_their_columns():
+    names = ["Black Shoes", "Red Hat"]
+    aliexpress = _batch("AliExpress", names, similarity_scores=[1.0, 0.0])
+    hicart = _batch("HiCart", ["Blue Shirt"], similarity_scores=[0.0])
+
+    batch = aliexpress.concatenate(hicart)
+
+    assert len(batch) == 3
+    assert aliexpress.product_names is names
+    assert batch.product_names == ["Black Shoes", "Red Hat", "Blue Shirt"]
+    assert batch.similarity_scores == [1.0, 0.0, 0.0]
+    assert list(batch.iter_rows())[2] == (
+        "Blue Shirt",
+        "US $1",
+        "https://HiCart/Blue Shirt",
+        "HiCart",
+        0.0,
+    )
+    # one of the batches wasn't scored
+    assert batch.concatenate(_batch("Ishtari", ["Pink Hat"])).similarity_scores is None
+
+
+def test_product_batch_from_fetched_products():
+    products = OutputFetchedProducts(
+        product_names=["Black Shoes"],
+        product_urls=["https://ishtari/1"],
+        product_prices=["US $3"],
+        website_source=["Ishtari"],
+    )
+
+    batch = ProductBatch.from_fetched_products(products)
+
+    assert batch.product_names == products.product_names
+    assert list(batch.iter_rows()) == [
+        ("Black Shoes", "US $3", "https://ishtari/1", "Ishtari", None)
+    ]
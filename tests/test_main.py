@@ -0,0 +1,75 @@
+import pytest
+import asyncio
+import os
+import sys
+import time
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import main
+from utils import api_utils
+from utils.persistent_cache import PersistentLRUCache
+
+
+@pytest.fixture
+def cookie_harvests(tmp_path, monkeypatch):
+    """Replaces the Playwright harvests with fakes taking 0.3 seconds, and starts without saved cookies.
+    Set the "failing" entry to make a website's harvest fail"""
+    monkeypatch.setattr(
+        api_utils,
+        "COOKIE_JAR",
+        PersistentLRUCache(str(tmp_path / "cookie_jar.sqlite3"), table="cookies"),
+    )
+    harvests = {"AliExpress": 0, "Ishtari": 0, "failing": ()}
+
+    for cookie_object in (main.ALIEXPRESS_COOKIE, main.ISHTARI_COOKIE):
+        website_name = cookie_object.website_name
+
+        async def harvest_cookie(website_name=website_name):
+            harvests[website_name] += 1
+            await asyncio.sleep(0.3)
+            if website_name in harvests["failing"]:
+                raise TimeoutError("page.goto timed out")
+            return f"api-token={website_name}", time.time() + 3600
+
+        monkeypatch.setattr(cookie_object, "cookie", None)
+        monkeypatch.setattr(cookie_object, "expires_at", None)
+        monkeypatch.setattr(cookie_object, "_last_harvest_at", None)
+        monkeypatch.setattr(cookie_object, "harvest_cookie", harvest_cookie)
+    return harvests
+
+
+@pytest.mark.asyncio
+async def test_server_is_live_before_the_cookies_are_ready(cookie_harvests):
+    start_time = time.perf_counter()
+    async with main.lifespan(main.app):
+        # the server doesn't wait for the cookies to start
+        assert time.perf_counter() - start_time < 0.1
+        health = await main.read_root()
+        assert health["live"] and not health["ready"]
+
+        # a job waits for the cookies instead of harvesting them itself
+        assert await main.ALIEXPRESS_COOKIE.wait_until_ready(timeout=1)
+        assert await main.ISHTARI_COOKIE.wait_until_ready(timeout=1)
+        assert main.ALIEXPRESS_COOKIE.cookie == "api-token=AliExpress"
+        assert main.ISHTARI_COOKIE.get_api_token() == "Ishtari"
+        assert (await main.read_root())["ready"]
+
+    assert cookie_harvests["AliExpress"] == 1
+    assert cookie_harvests["Ishtari"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_cookie_harvest_does_not_stop_the_server(cookie_harvests):
+    cookie_harvests["failing"] = ("Ishtari",)
+
+    async with main.lifespan(main.app):
+        assert await main.ALIEXPRESS_COOKIE.wait_until_ready(timeout=1)
+        # the jobs don't go on with a missing cookie, they give up on Ishtari after the timeout
+        assert not await main.ISHTARI_COOKIE.wait_until_ready(timeout=0.5)
+
+        assert main.ALIEXPRESS_COOKIE.cookie == "api-token=AliExpress"
+        assert main.ISHTARI_COOKIE.cookie is None
+        health = await main.read_root()
+        assert health["live"] and not health["ready"]
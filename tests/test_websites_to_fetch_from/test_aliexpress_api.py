@@ -0,0 +1,100 @@
+import pytest
+import json
+import os
+import sys
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.join(os.path.dirname(__file__), ".."), ".."))
+)
+
+from utils import html_parsing
+from websites_to_fetch_from.aliexpress_api import _parse_aliexpress_search_page
+
+
+def _product_card(product_id, title, price):
+    price_div = (
+        f'<div class="multi--price-sale--U-S0jtj"><span>US $</span><span>{price}</span></div>'
+        if price
+        else ""
+    )
+    return f"""
+    <a class="multi--container--1UZxxHY cards--card--3PJxwBm search-card-item" href="//www.aliexpress.com/item/{product_id}.html">
+        <div class="multi--title--G7dOCj3"><h3>{title}</h3></div>
+        <div class="multi--price--1okBCly">{price_div}</div>
+    </a>"""
+
+
+SEARCH_PAGE = f"""<html><head><script>var a = "<div class='multi--title--G7dOCj3'>not a product</div>";</script></head>
+<body>
+<div class="multi--title--G7dOCj3">Outside of a product card</div>
+{_product_card(1, "Black Sneakers", "12.99")}
+{_product_card(2, "Product without a price", None)}
+{_product_card(3, "Leather Boots", "30.50")}
+<a href="//www.aliexpress.com/help">Help Center</a>
+</body></html>"""
+
+
+@pytest.mark.parametrize("html_parser", ["lxml", "html.parser"])
+def test_parse_aliexpress_search_page_keeps_products_aligned(monkeypatch, html_parser):
+    """Cards without a price are skipped instead of shifting the prices of the next products"""
+    monkeypatch.setattr(html_parsing, "HTML_PARSER", html_parser)
+
+    products = _parse_aliexpress_search_page(SEARCH_PAGE)
+
+    assert products.product_names == ["Black Sneakers", "Leather Boots"]
+    assert products.product_urls == [
+        "https://www.aliexpress.com/item/1.html",
+        "https://www.aliexpress.com/item/3.html",
+    ]
+    assert products.product_prices == ["US $12.99", "US $30.50"]
+    assert products.website_source == ["AliExpress", "AliExpress"]
+
+
+def test_parse_aliexpress_search_page_prefers_the_embedded_data():
+    embedded_items = [
+        {
+            "productId": "1005001",
+            "title": {"displayTitle": "Black Sneakers"},
+            "prices": {"salePrice": {"formattedPrice": "US $12.99"}},
+        },
+        # an ad without a product id, skipped
+        {"title": {"displayTitle": "Sponsored"}},
+        {
+            "productId": "1005003",
+            "title": {"displayTitle": "Leather Boots "},
+            "prices": {"salePrice": {"formattedPrice": "US $30.50"}},
+        },
+    ]
+    embedded_data = {
+        "success": True,
+        "data": {
+            "root": {"fields": {"mods": {"itemList": {"content": embedded_items}}}}
+        },
+    }
+    html = SEARCH_PAGE.replace(
+        "</body>",
+        f"<script>window._dida_config_._init_data_= {{ data: {json.dumps(embedded_data)} }}</script></body>",
+    )
+
+    products = _parse_aliexpress_search_page(html)
+
+    assert products.product_names == ["Black Sneakers", "Leather Boots"]
+    assert products.product_urls == [
+        "https://www.aliexpress.com/item/1005001.html",
+        "https://www.aliexpress.com/item/1005003.html",
+    ]
+    assert products.product_prices == ["US $12.99", "US $30.50"]
+
+
+def test_parse_aliexpress_search_page_falls_back_to_the_product_cards():
+    # the embedded data got cut off
+    html = SEARCH_PAGE.replace(
+        "</body>",
+        '<script>window._dida_config_._init_data_= { data: {"success":true,"data":{"ro</script></body>',
+    )
+
+    products = _parse_aliexpress_search_page(html)
+
+    assert products.product_names == ["Black Sneakers", "Leather Boots"]
@@ -0,0 +1,258 @@
+import pytest
+import asyncio
+import time
+import os
+import sys
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.join(os.path.dirname(__file__), ".."), ".."))
+)
+
+from models.products import OutputFetchedProducts
+from utils import api_utils
+from utils.api_utils import AliexpressCookie, IshtariCookie
+from utils.persistent_cache import PersistentLRUCache
+from websites_to_fetch_from import fetch_from_all_websites
+
+
+@pytest.fixture(autouse=True)
+def product_cache(tmp_path, monkeypatch):
+    """An empty product cache for every test instead of the one in the project directory"""
+    cache = PersistentLRUCache(str(tmp_path / "product_cache.sqlite3"))
+    monkeypatch.setattr(fetch_from_all_websites, "PRODUCT_CACHE", cache)
+    return cache
+
+
+PRODUCT_TITLES = ["leather boots", "running sneakers", "canvas loafers"]
+
+
+def _products(website_name, number_of_products=2):
+    # distinct titles, near-duplicates would be collapsed by the ranking
+    return OutputFetchedProducts(
+        product_names=[
+            f"{website_name} {PRODUCT_TITLES[i]}" for i in range(number_of_products)
+        ],
+        product_urls=[f"https://{website_name}/{i}" for i in range(number_of_products)],
+        product_prices=["US $1" for _ in range(number_of_products)],
+        website_source=[website_name for _ in range(number_of_products)],
+    )
+
+
+def _patch_fetchers(monkeypatch, delays, failing=()):
+    """Replaces the three website fetchers with fakes that sleep for the given delay. Returns the
+    number of calls made to each website"""
+    calls = {"AliExpress": 0, "Ishtari": 0, "HiCart": 0}
+
+    def make_fake(website_name):
+        async def fake_fetch(search_keyword, *args):
+            calls[website_name] += 1
+            await asyncio.sleep(delays[website_name])
+            if website_name in failing:
+                return None
+            return _products(website_name)
+
+        return fake_fetch
+
+    monkeypatch.setattr(
+        fetch_from_all_websites,
+        "fetch_aliexpress_product_recommendations",
+        make_fake("AliExpress"),
+    )
+    monkeypatch.setattr(
+        fetch_from_all_websites,
+        "fetch_ishtari_product_recommendations",
+        make_fake("Ishtari"),
+    )
+    monkeypatch.setattr(
+        fetch_from_all_websites,
+        "fetch_hicart_product_recommendations",
+        make_fake("HiCart"),
+    )
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_websites_are_fetched_concurrently(monkeypatch):
+    """The time spent on a keyword should be bounded by the slowest website, not the sum"""
+    _patch_fetchers(monkeypatch, {"AliExpress": 0.3, "Ishtari": 0.3, "HiCart": 0.3})
+
+    start_time = time.perf_counter()
+    result = await fetch_from_all_websites.fetch_products_from_all_websites(
+        "black shoes", None, None
+    )
+    elapsed_time = time.perf_counter() - start_time
+
+    assert elapsed_time < 0.6
+    # the merged group keeps the AliExpress, Ishtari, HiCart order
+    assert (
+        result.website_source == ["AliExpress"] * 2 + ["Ishtari"] * 2 + ["HiCart"] * 2
+    )
+
+
+@pytest.mark.asyncio
+async def test_slow_or_failing_website_is_replaced_by_placeholder(monkeypatch):
+    monkeypatch.setattr(fetch_from_all_websites, "WEBSITE_FETCH_DEADLINE_SECONDS", 0.2)
+    _patch_fetchers(
+        monkeypatch,
+        {"AliExpress": 5, "Ishtari": 0, "HiCart": 0},
+        failing=("HiCart",),
+    )
+
+    result = await fetch_from_all_websites.fetch_products_from_all_websites(
+        "black shoes", None, None
+    )
+
+    # the placeholders are left out of the ranking when another website found products
+    assert result.product_names == ["Ishtari leather boots", "Ishtari running sneakers"]
+
+    _patch_fetchers(
+        monkeypatch,
+        {"AliExpress": 5, "Ishtari": 0, "HiCart": 0},
+        failing=("Ishtari", "HiCart"),
+    )
+    result = await fetch_from_all_websites.fetch_products_from_all_websites(
+        "black shoes", None, None, bypass_cache=True
+    )
+
+    assert result.product_names == [
+        "No matched products from AliExpress.com",
+        "No matched products from Ishtari.com",
+        "No matched products from HiCart.com",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_best_products_across_websites_are_kept(monkeypatch):
+    _patch_fetchers(monkeypatch, {"AliExpress": 0.1, "Ishtari": 0, "HiCart": 0})
+    # the third website to answer has the best match
+    monkeypatch.setattr(
+        fetch_from_all_websites,
+        "fetch_aliexpress_product_recommendations",
+        lambda *args: asyncio.sleep(
+            0.1,
+            OutputFetchedProducts(
+                product_names=["Red Hat", "Black Shoes"],
+                product_urls=["https://aliexpress/0", "https://aliexpress/1"],
+                product_prices=["US $1", "US $2"],
+                website_source=["AliExpress", "AliExpress"],
+            ),
+        ),
+    )
+
+    result = await fetch_from_all_websites.fetch_products_from_all_websites(
+        "black shoes", None, None, top_k=3
+    )
+
+    assert result.product_names == ["Black Shoes", "Red Hat", "Ishtari leather boots"]
+    assert result.product_urls[0] == "https://aliexpress/1"
+    assert result.similarity_scores[0] == 1.0
+
+
+@pytest.mark.asyncio
+async def test_repeated_keywords_are_served_from_the_cache(monkeypatch):
+    calls = _patch_fetchers(
+        monkeypatch, {"AliExpress": 0, "Ishtari": 0, "HiCart": 0}, failing=("HiCart",)
+    )
+
+    first_result = await fetch_from_all_websites.fetch_products_from_all_websites(
+        "Black Shoes", None, None
+    )
+    # same keyword, different case and spacing
+    second_result = await fetch_from_all_websites.fetch_products_from_all_websites(
+        " black  shoes", None, None
+    )
+
+    assert second_result == first_result
+    # the HiCart placeholder was not cached, so only HiCart was fetched again
+    assert calls == {"AliExpress": 1, "Ishtari": 1, "HiCart": 2}
+
+    await fetch_from_all_websites.fetch_products_from_all_websites(
+        "black shoes", None, None, bypass_cache=True
+    )
+    assert calls == {"AliExpress": 2, "Ishtari": 2, "HiCart": 3}
+
+
+@pytest.mark.asyncio
+async def test_partial_products_are_handed_over_before_the_slowest_website(
+    monkeypatch,
+):
+    _patch_fetchers(
+        monkeypatch,
+        {"AliExpress": 0.3, "Ishtari": 0, "HiCart": 0.1},
+        failing=("Ishtari",),
+    )
+    partial_products = []
+
+    def on_partial_products(products):
+        # a failing callback doesn't stop the fetch
+        partial_products.append(products.website_source)
+        raise RuntimeError("sheet unavailable")
+
+    result = await fetch_from_all_websites.fetch_products_from_all_websites(
+        "black shoes", None, None, on_partial_products=on_partial_products
+    )
+
+    # Ishtari found nothing, HiCart was handed over and AliExpress only comes with the result
+    assert partial_products == [["HiCart", "HiCart"]]
+    assert result.website_source == ["AliExpress"] * 2 + ["HiCart"] * 2
+
+
+@pytest.mark.asyncio
+async def test_empty_results_count_as_nothing_found(monkeypatch, product_cache):
+    calls = _patch_fetchers(monkeypatch, {"AliExpress": 0, "Ishtari": 0, "HiCart": 0})
+
+    async def empty_results(*args):
+        # what the AliExpress parser returns on a captcha page
+        calls["AliExpress"] += 1
+        return OutputFetchedProducts(
+            product_names=[], product_urls=[], product_prices=[], website_source=[]
+        )
+
+    monkeypatch.setattr(
+        fetch_from_all_websites,
+        "fetch_aliexpress_product_recommendations",
+        empty_results,
+    )
+
+    result = await fetch_from_all_websites.fetch_products_from_all_websites(
+        "black shoes", None, None
+    )
+
+    assert result.website_source == ["Ishtari"] * 2 + ["HiCart"] * 2
+    # the empty result wasn't cached, AliExpress is asked again for the next job
+    assert product_cache.get("AliExpress:black shoes") is None
+    await fetch_from_all_websites.fetch_products_from_all_websites(
+        "black shoes", None, None
+    )
+    assert calls == {"AliExpress": 2, "Ishtari": 1, "HiCart": 1}
+
+
+@pytest.mark.asyncio
+async def test_websites_wait_for_their_cookie(monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        api_utils,
+        "COOKIE_JAR",
+        PersistentLRUCache(str(tmp_path / "cookie_jar.sqlite3"), table="cookies"),
+    )
+    monkeypatch.setattr(api_utils, "COOKIE_READY_TIMEOUT_SECONDS", 0.3)
+    calls = _patch_fetchers(monkeypatch, {"AliExpress": 0, "Ishtari": 0, "HiCart": 0})
+    # the Ishtari harvest finishes 0.1 seconds into the job, the AliExpress one failed
+    ishtari_cookie = IshtariCookie(cookie=None)
+    aliexpress_cookie = AliexpressCookie(cookie=None)
+
+    async def harvest_ishtari_cookie():
+        await asyncio.sleep(0.1)
+        ishtari_cookie.set_cookie("api-token=abc", time.time() + 3600)
+
+    asyncio.get_running_loop().create_task(harvest_ishtari_cookie())
+    start_time = time.perf_counter()
+    result = await fetch_from_all_websites.fetch_products_from_all_websites(
+        "black shoes", aliexpress_cookie, ishtari_cookie
+    )
+
+    # Ishtari was fetched once its cookie was there, AliExpress was skipped after the timeout
+    assert 0.3 <= time.perf_counter() - start_time < 0.6
+    assert calls == {"AliExpress": 0, "Ishtari": 1, "HiCart": 1}
+    assert result.website_source == ["Ishtari"] * 2 + ["HiCart"] * 2
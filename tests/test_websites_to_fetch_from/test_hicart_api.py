@@ -1,4 +1,6 @@
 import pytest
+import asyncio
+import time
 import os
 import sys
 
@@ -9,10 +11,24 @@ sys.path.append(
 )
 
 from models.products import OutputFetchedProducts
+from websites_to_fetch_from import hicart_api
 from websites_to_fetch_from.hicart_api import fetch_hicart_product_recommendations
 from utils.logger import logger
 
 
+@pytest.fixture(autouse=True)
+def hicart_scraper(monkeypatch):
+    """Every test starts with its own session, without any clearance"""
+    scraper = hicart_api.HiCartScraper()
+    monkeypatch.setattr(hicart_api, "HICART_SCRAPER", scraper)
+    return scraper
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
 # Testing the fetch_aliexpress_product_recommendations and fetch_ishtari_product_recommendations
 # functions require a valid cookie. And We already have a test for the validity of the fetched
 # cookies using playwright that also calls the above methods. So there's no need for seperate
@@ -34,3 +50,117 @@ async def test_hicart_product_fetch():
     )
 
     assert len(result.product_names) > 0
+
+
+@pytest.mark.asyncio
+async def test_hicart_fetch_does_not_block_the_event_loop(monkeypatch):
+    """A slow HiCart response should not freeze the other coroutines running on the event loop"""
+
+    class SlowScraper:
+        def get(self, url, **kwargs):
+            time.sleep(0.5)  # a blocking network call
+            raise ConnectionError("HiCart is unreachable")
+
+    monkeypatch.setattr(hicart_api, "USE_ROTATING_IPS_WITH_SCRAPERAPI", False)
+    monkeypatch.setattr(hicart_api.cloudscraper, "create_scraper", SlowScraper)
+
+    heartbeats = 0
+
+    async def heartbeat():
+        nonlocal heartbeats
+        while True:
+            heartbeats += 1
+            await asyncio.sleep(0.05)
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    result = await fetch_hicart_product_recommendations("black shoes")
+    heartbeat_task.cancel()
+
+    # the heartbeat kept running while the blocking request was in flight
+    assert heartbeats >= 5
+    assert result.product_names == ["No matched products from HiCart.com"]
+
+
+def test_hicart_scraper_is_reused_across_requests(monkeypatch, hicart_scraper):
+    created_scrapers = []
+
+    class FakeScraper:
+        def __init__(self):
+            created_scrapers.append(self)
+
+        def get(self, url, **kwargs):
+            return FakeResponse(200)
+
+    monkeypatch.setattr(hicart_api.cloudscraper, "create_scraper", FakeScraper)
+
+    for _ in range(3):
+        assert hicart_scraper.get("https://www.hicart.com").status_code == 200
+
+    assert len(created_scrapers) == 1
+
+
+def test_hicart_scraper_gets_a_new_clearance_when_challenged(
+    monkeypatch, hicart_scraper
+):
+    created_scrapers = []
+
+    class FakeScraper:
+        def __init__(self):
+            created_scrapers.append(self)
+            self.requests_sent = 0
+            self.closed = False
+
+        def get(self, url, **kwargs):
+            self.requests_sent += 1
+            # the clearance of the first session expires after its first request
+            if self is created_scrapers[0] and self.requests_sent > 1:
+                return FakeResponse(503)
+            return FakeResponse(200)
+
+        def close(self):
+            self.closed = True
+
+    monkeypatch.setattr(hicart_api.cloudscraper, "create_scraper", FakeScraper)
+
+    assert hicart_scraper.get("https://www.hicart.com").status_code == 200
+    assert hicart_scraper.get("https://www.hicart.com").status_code == 200
+
+    assert len(created_scrapers) == 2
+    assert created_scrapers[0].closed
+
+
+@pytest.mark.asyncio
+async def test_hicart_scraper_solves_the_first_challenge_once(
+    monkeypatch, hicart_scraper
+):
+    """Concurrent first requests wait for the one solving the challenge instead of each solving it"""
+    in_flight = 0
+    max_in_flight = 0
+
+    class FakeScraper:
+        def get(self, url, **kwargs):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            time.sleep(0.1)  # solving the challenge
+            in_flight -= 1
+            return FakeResponse(200)
+
+    monkeypatch.setattr(hicart_api.cloudscraper, "create_scraper", FakeScraper)
+
+    await asyncio.gather(
+        *(
+            asyncio.to_thread(hicart_scraper.get, "https://www.hicart.com")
+            for _ in range(3)
+        )
+    )
+    assert max_in_flight == 1
+
+    # once cleared, the requests go out at the same time
+    await asyncio.gather(
+        *(
+            asyncio.to_thread(hicart_scraper.get, "https://www.hicart.com")
+            for _ in range(3)
+        )
+    )
+    assert max_in_flight > 1
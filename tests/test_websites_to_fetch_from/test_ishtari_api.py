@@ -0,0 +1,192 @@
+import pytest
+import asyncio
+import os
+import socket
+import sys
+import time
+import requests
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.join(os.path.dirname(__file__), ".."), ".."))
+)
+
+from utils.api_utils import IshtariCookie
+from utils.persistent_cache import PersistentLRUCache
+from websites_to_fetch_from import ishtari_api
+
+REDIRECT = {
+    "success": True,
+    "data": {"redirect": "1", "type": "category", "type_id": "4006"},
+}
+
+
+def _category_products(*names):
+    return {
+        "success": True,
+        "data": {
+            "products": [
+                {"product_id": name, "full_name": name, "name": f" {name}  "}
+                for name in names
+            ]
+        },
+    }
+
+
+def _numbered_pages(number_of_products):
+    """A catalog of products 0, 1, 2... served 10 per page"""
+
+    def page_products(page):
+        first = (page - 1) * 10
+        return _category_products(
+            *(str(i) for i in range(first, min(first + 10, number_of_products)))
+        )
+
+    return page_products
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+        self.text = str(data)
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def ishtari(tmp_path, monkeypatch):
+    """Answers the Ishtari api from a dict of route -> response, and returns the requested urls"""
+    monkeypatch.setattr(
+        ishtari_api,
+        "ISHTARI_CATEGORY_CACHE",
+        PersistentLRUCache(str(tmp_path / "ishtari_categories.sqlite3")),
+    )
+    monkeypatch.setattr(ishtari_api, "REDIRECT_DELAY_SECONDS", 0)
+
+    class FakeIshtari:
+        responses = {}
+        requested_urls = []
+
+    async def fake_send_request(url, headers):
+        FakeIshtari.requested_urls.append(url)
+        route = "catalog/category" if "catalog/category" in url else "catalog/search"
+        response = FakeIshtari.responses[route]
+        # a function of the page number for the paged responses
+        if callable(response):
+            response = response(int(url.split("&page=")[1]))
+        return FakeResponse(response)
+
+    monkeypatch.setattr(ishtari_api, "_send_request", fake_send_request)
+    return FakeIshtari
+
+
+def _cookie():
+    return IshtariCookie(cookie="api-token=abc", expires_at=None)
+
+
+@pytest.mark.asyncio
+async def test_known_keywords_go_straight_to_the_category(ishtari):
+    ishtari.responses = {
+        "catalog/search": REDIRECT,
+        "catalog/category": _category_products("Black Sneakers"),
+    }
+
+    first = await ishtari_api._fetch_products("black shoes", _cookie())
+    second = await ishtari_api._fetch_products("Black  Shoes", _cookie())
+
+    assert first == second == _category_products("Black Sneakers")
+    routes = [url.split("route=")[1].split("&")[0] for url in ishtari.requested_urls]
+    assert routes == ["catalog/search", "catalog/category", "catalog/category"]
+    assert "path=4006" in ishtari.requested_urls[-1]
+
+
+@pytest.mark.asyncio
+async def test_empty_category_is_forgotten(ishtari):
+    ishtari_api.ISHTARI_CATEGORY_CACHE.set("black shoes", "4006", ttl_seconds=60)
+    ishtari.responses = {
+        "catalog/search": _category_products("Black Sneakers"),
+        "catalog/category": _category_products(),
+    }
+
+    product_data = await ishtari_api._fetch_products("black shoes", _cookie())
+
+    # the empty category was skipped for the search, which didn't redirect this time
+    assert product_data == _category_products("Black Sneakers")
+    assert ishtari_api.ISHTARI_CATEGORY_CACHE.get("black shoes") is None
+
+
+@pytest.mark.asyncio
+async def test_deeper_results_are_fetched_page_by_page(ishtari):
+    ishtari.responses = {"catalog/search": _numbered_pages(100)}
+
+    product_data = await ishtari_api._fetch_products(
+        "black shoes", _cookie(), result_depth=25
+    )
+
+    product_ids = [
+        product["product_id"] for product in product_data["data"]["products"]
+    ]
+    assert product_ids == [str(i) for i in range(25)]
+    assert sorted(url.split("&page=")[1] for url in ishtari.requested_urls) == [
+        "1",
+        "2",
+        "3",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_pages_of_a_category_are_merged_in_order(ishtari, monkeypatch):
+    """The pages are requested at the same time, their products stay in page order whichever answers first"""
+    ishtari_api.ISHTARI_CATEGORY_CACHE.set("black shoes", "4006", ttl_seconds=60)
+    pages = _numbered_pages(25)
+    in_flight = 0
+    max_in_flight = 0
+
+    async def slow_send_request(url, headers):
+        nonlocal in_flight, max_in_flight
+        page = int(url.split("&page=")[1])
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        # the last pages answer first
+        await asyncio.sleep(0.05 * (4 - page))
+        in_flight -= 1
+        return FakeResponse(pages(page))
+
+    monkeypatch.setattr(ishtari_api, "_send_request", slow_send_request)
+
+    product_data = await ishtari_api._fetch_products(
+        "black shoes", _cookie(), result_depth=40
+    )
+
+    # the fourth page is empty, the catalog only has 25 products
+    product_ids = [
+        product["product_id"] for product in product_data["data"]["products"]
+    ]
+    assert product_ids == [str(i) for i in range(25)]
+    assert max_in_flight == 4
+
+
+@pytest.mark.asyncio
+async def test_hung_request_times_out_before_the_deadline(monkeypatch):
+    monkeypatch.setattr(ishtari_api, "USE_ROTATING_IPS_WITH_SCRAPERAPI", False)
+    monkeypatch.setattr(ishtari_api, "WEBSITE_REQUEST_TIMEOUT_SECONDS", 0.2)
+    # accepts the connection and never answers
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    try:
+        start_time = time.perf_counter()
+        with pytest.raises(requests.exceptions.Timeout):
+            await ishtari_api._send_request(
+                f"http://127.0.0.1:{server.getsockname()[1]}/search", {}
+            )
+        # the worker thread is free again, it doesn't wait for the website forever
+        assert time.perf_counter() - start_time < 1
+    finally:
+        server.close()
@@ -0,0 +1,137 @@
+import pytest
+import asyncio
+import os
+import sys
+import time
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.join(os.path.dirname(__file__), ".."), ".."))
+)
+
+from utils import api_utils
+from utils.api_utils import AliexpressCookie, IshtariCookie
+from utils.persistent_cache import PersistentLRUCache
+
+
+@pytest.fixture(autouse=True)
+def cookie_jar(tmp_path, monkeypatch):
+    cookie_jar = PersistentLRUCache(
+        str(tmp_path / "cookie_jar.sqlite3"), table="cookies"
+    )
+    monkeypatch.setattr(api_utils, "COOKIE_JAR", cookie_jar)
+    return cookie_jar
+
+
+def test_saved_cookie_is_loaded_after_a_restart():
+    IshtariCookie(cookie=None).set_cookie(
+        "api-token=abc; session=1", time.time() + 3600
+    )
+
+    # a fresh cookie object, like the one the server starts with
+    ishtari_cookie = IshtariCookie(cookie=None)
+    assert ishtari_cookie.load_from_disk()
+    assert ishtari_cookie.cookie == "api-token=abc; session=1"
+    assert ishtari_cookie.get_api_token() == "abc"
+    assert not ishtari_cookie.is_expired()
+
+    # the cookies of the other website are saved separately
+    assert not AliexpressCookie(cookie=None).load_from_disk()
+
+
+def test_cookie_about_to_expire_is_not_loaded(monkeypatch):
+    monkeypatch.setattr(api_utils, "COOKIE_EXPIRY_MARGIN_SECONDS", 300)
+    # still valid for a minute, but that's within the margin
+    AliexpressCookie(cookie=None).set_cookie("session=1", time.time() + 60)
+
+    aliexpress_cookie = AliexpressCookie(cookie=None)
+    assert not aliexpress_cookie.load_from_disk()
+    assert aliexpress_cookie.cookie is None
+    assert aliexpress_cookie.is_expired()
+
+
+def _fake_harvester(harvest_seconds=0.1, cookie_lifetime_seconds=3600):
+    """A stand-in for the Playwright functions, returns cookie-1, cookie-2... and counts the harvests"""
+    harvests = []
+
+    async def harvest_cookie():
+        harvests.append(time.time())
+        await asyncio.sleep(harvest_seconds)
+        return f"cookie-{len(harvests)}", time.time() + cookie_lifetime_seconds
+
+    return harvest_cookie, harvests
+
+
+@pytest.mark.asyncio
+async def test_concurrent_refreshes_share_one_harvest(monkeypatch):
+    monkeypatch.setattr(api_utils, "COOKIE_REFRESH_RETRY_SECONDS", 0)
+    harvest_cookie, harvests = _fake_harvester()
+    ishtari_cookie = IshtariCookie(cookie=None, harvest_cookie=harvest_cookie)
+
+    cookies = await asyncio.gather(
+        *(ishtari_cookie.get_fresh_cookie() for _ in range(5))
+    )
+
+    assert len(harvests) == 1
+    assert cookies == ["cookie-1"] * 5
+
+    # several keywords got a 401 with the same cookie, the first refresh replaces it and the others reuse it
+    await asyncio.gather(
+        *(ishtari_cookie.refresh(rejected_cookie="cookie-1") for _ in range(3))
+    )
+    assert len(harvests) == 2
+    await ishtari_cookie.refresh(rejected_cookie="cookie-1")
+    assert len(harvests) == 2
+    assert ishtari_cookie.cookie == "cookie-2"
+
+
+@pytest.mark.asyncio
+async def test_cookie_is_refreshed_in_the_background_before_it_expires(monkeypatch):
+    monkeypatch.setattr(api_utils, "COOKIE_REFRESH_AHEAD_SECONDS", 3600)
+    monkeypatch.setattr(api_utils, "COOKIE_REFRESH_RETRY_SECONDS", 0.05)
+    harvest_cookie, harvests = _fake_harvester(
+        harvest_seconds=0, cookie_lifetime_seconds=7200
+    )
+    aliexpress_cookie = AliexpressCookie(
+        cookie="cookie-0",
+        expires_at=time.time() + 3600.2,
+        harvest_cookie=harvest_cookie,
+    )
+
+    aliexpress_cookie.start_background_refresh()
+    try:
+        # due for a refresh 0.2 seconds from now
+        await asyncio.sleep(0.4)
+        # the requests get the new cookie without waiting on a harvest
+        assert await aliexpress_cookie.get_fresh_cookie() == "cookie-1"
+        assert len(harvests) == 1
+    finally:
+        await aliexpress_cookie.stop_background_refresh()
+
+
+@pytest.mark.asyncio
+async def test_cookie_that_is_expired_when_harvested_is_not_harvested_again(
+    monkeypatch,
+):
+    monkeypatch.setattr(api_utils, "COOKIE_EXPIRY_MARGIN_SECONDS", 300)
+    monkeypatch.setattr(api_utils, "COOKIE_REFRESH_RETRY_SECONDS", 0.2)
+    # the jar expires within the margin, so the new cookie already counts as expired
+    harvest_cookie, harvests = _fake_harvester(
+        harvest_seconds=0, cookie_lifetime_seconds=60
+    )
+    ishtari_cookie = IshtariCookie(cookie=None, harvest_cookie=harvest_cookie)
+
+    ishtari_cookie.start_background_refresh()
+    try:
+        await asyncio.sleep(0.1)
+        # the requests use it instead of running Playwright each
+        for _ in range(5):
+            assert await ishtari_cookie.get_fresh_cookie() == "cookie-1"
+        assert len(harvests) == 1
+
+        await asyncio.sleep(0.2)
+        assert len(harvests) == 2
+        assert harvests[1] - harvests[0] >= 0.2
+    finally:
+        await ishtari_cookie.stop_background_refresh()
@@ -0,0 +1,63 @@
+import pytest
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.join(os.path.dirname(__file__), ".."), ".."))
+)
+
+from utils.http_sessions import create_pooled_session
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keeps the connection open between requests
+    connections = 0
+    received_cookies = []
+
+    def setup(self):
+        # one handler per TCP connection
+        KeepAliveHandler.connections += 1
+        super().setup()
+
+    def do_GET(self):
+        KeepAliveHandler.received_cookies.append(self.headers.get("Cookie"))
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Set-Cookie", "tracking=1; Path=/")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def local_server():
+    KeepAliveHandler.connections = 0
+    KeepAliveHandler.received_cookies = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_pooled_session_reuses_its_connection(local_server):
+    session = create_pooled_session("Test")
+
+    for i in range(5):
+        response = session.get(
+            f"{local_server}/search?q={i}", headers={"Cookie": "a=1"}
+        )
+        assert response.text == "ok"
+
+    assert KeepAliveHandler.connections == 1
+    # the cookies set by the server are not kept, only the ones we send explicitly
+    assert KeepAliveHandler.received_cookies == ["a=1"] * 5
+    assert len(session.cookies) == 0
@@ -0,0 +1,119 @@
+import pytest
+import asyncio
+import os
+import sys
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.join(os.path.dirname(__file__), ".."), ".."))
+)
+
+from fastapi import HTTPException
+from utils.job_manager import ProductFetchJobManager
+
+
+class FakeJobs:
+    """Jobs that write one keyword every 0.05 seconds, and stop between keywords when cancelled"""
+
+    def __init__(self):
+        self.started = []
+        self.running = 0
+        self.max_running = 0
+
+    async def run_job(self, job):
+        self.started.append(job.keywords[0])
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            for _ in job.keywords:
+                if job.cancel_requested:
+                    return False
+                await asyncio.sleep(0.05)
+                job.keywords_done += 1
+            return True
+        finally:
+            self.running -= 1
+
+
+@pytest.mark.asyncio
+async def test_jobs_run_in_order_with_their_progress():
+    jobs = FakeJobs()
+    job_manager = ProductFetchJobManager(
+        jobs.run_job, number_of_workers=1, max_queued_jobs=5
+    )
+    try:
+        # triggered in the same second
+        first = job_manager.submit(["first 1", "first 2", "first 3", "first 4"])
+        second = job_manager.submit(["second"])
+        assert first.job_id != second.job_id
+
+        await asyncio.sleep(0.12)
+        status = job_manager.status()
+        assert list(status) == [first.job_id, second.job_id]
+        assert status[first.job_id]["running"]
+        assert status[first.job_id]["keywords_done"] == 2
+        assert status[first.job_id]["keywords_total"] == 4
+        assert status[second.job_id]["state"] == "queued"
+        assert status[second.job_id]["queue_position"] == 1
+
+        await asyncio.sleep(0.3)
+        # the Apps Script only triggers a fetch when the status is {}
+        assert job_manager.status() == {}
+        assert jobs.started == ["first 1", "second"]
+    finally:
+        await job_manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_burst_of_triggers_is_bounded():
+    jobs = FakeJobs()
+    job_manager = ProductFetchJobManager(
+        jobs.run_job, number_of_workers=2, max_queued_jobs=3
+    )
+    try:
+        job_manager.submit(["keyword 0"])
+        job_manager.submit(["keyword 1"])
+        # picked up by the two workers
+        await asyncio.sleep(0)
+        for i in range(2, 5):
+            job_manager.submit([f"keyword {i}"])
+        with pytest.raises(HTTPException) as exc_info:
+            job_manager.submit(["one too many"])
+        assert exc_info.value.status_code == 429
+
+        while job_manager.status():
+            await asyncio.sleep(0.01)
+        assert jobs.max_running == 2
+        assert len(jobs.started) == 5
+    finally:
+        await job_manager.stop()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_jobs():
+    jobs = FakeJobs()
+    job_manager = ProductFetchJobManager(
+        jobs.run_job, number_of_workers=1, max_queued_jobs=5
+    )
+    try:
+        running = job_manager.submit(["running 1", "running 2", "running 3"])
+        queued = job_manager.submit(["queued"])
+        await asyncio.sleep(0.01)
+
+        # the most recent job by default
+        assert job_manager.cancel() is queued
+        assert list(job_manager.status()) == [running.job_id]
+        assert job_manager.cancel(running.job_id) is running
+        assert job_manager.status()[running.job_id]["cancelled"]
+
+        await asyncio.sleep(0.1)
+        assert job_manager.status() == {}
+        assert running.state == "cancelled"
+        assert running.keywords_done == 1
+        assert jobs.started == ["running 1"]
+        with pytest.raises(HTTPException) as exc_info:
+            job_manager.cancel()
+        assert exc_info.value.status_code == 404
+    finally:
+        await job_manager.stop()
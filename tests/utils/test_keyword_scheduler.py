@@ -0,0 +1,74 @@
+import pytest
+import asyncio
+import os
+import sys
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.join(os.path.dirname(__file__), ".."), ".."))
+)
+
+from utils.keyword_scheduler import process_keywords_in_order
+
+
+@pytest.mark.asyncio
+async def test_keywords_are_fetched_concurrently_and_written_in_order():
+    keywords = ["slow", "fast", "medium", "fastest"]
+    delays = {"slow": 0.3, "fast": 0.05, "medium": 0.1, "fastest": 0.0}
+    currently_running = 0
+    max_running = 0
+    written = []
+
+    async def fetch_keyword_products(keyword, product_order_id):
+        nonlocal currently_running, max_running
+        currently_running += 1
+        max_running = max(max_running, currently_running)
+        await asyncio.sleep(delays[keyword])
+        currently_running -= 1
+        return f"products for {keyword}"
+
+    def write_keyword_products(products, product_order_id, keyword):
+        written.append((product_order_id, keyword, products))
+
+    finished = await process_keywords_in_order(
+        keywords,
+        fetch_keyword_products,
+        write_keyword_products,
+        is_cancelled=lambda: False,
+        max_concurrent_keywords=2,
+    )
+
+    assert finished
+    assert max_running == 2
+    assert written == [
+        (1, "slow", "products for slow"),
+        (2, "fast", "products for fast"),
+        (3, "medium", "products for medium"),
+        (4, "fastest", "products for fastest"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_cancellation_stops_the_remaining_keywords():
+    written = []
+    cancel_flag = {"cancelled": False}
+
+    async def fetch_keyword_products(keyword, product_order_id):
+        await asyncio.sleep(0.1)
+        return keyword
+
+    def write_keyword_products(products, product_order_id, keyword):
+        written.append(keyword)
+        cancel_flag["cancelled"] = True  # the user cancels after the first keyword
+
+    finished = await process_keywords_in_order(
+        ["a", "b", "c"],
+        fetch_keyword_products,
+        write_keyword_products,
+        is_cancelled=lambda: cancel_flag["cancelled"],
+        max_concurrent_keywords=1,
+    )
+
+    assert not finished
+    assert written == ["a"]
@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.join(os.path.dirname(__file__), ".."), ".."))
+)
+
+from utils.persistent_cache import PersistentLRUCache
+
+
+def test_cache_persists_across_instances(tmp_path):
+    cache_path = str(tmp_path / "cache.sqlite3")
+    PersistentLRUCache(cache_path).set("AliExpress:black shoes", {"a": [1, 2]}, 60)
+
+    # a new instance on the same file, like after a server restart
+    assert PersistentLRUCache(cache_path).get("AliExpress:black shoes") == {"a": [1, 2]}
+    assert PersistentLRUCache(cache_path).get("AliExpress:red shoes") is None
+
+
+def test_expired_entries_are_not_returned(tmp_path):
+    cache = PersistentLRUCache(str(tmp_path / "cache.sqlite3"))
+    cache.set("short", "value", 0.05)
+    cache.set("long", "value", 60)
+
+    time.sleep(0.1)
+
+    assert cache.get("short") is None
+    assert cache.get("long") == "value"
+    assert len(cache) == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = PersistentLRUCache(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    cache.set("first", 1, 60)
+    cache.set("second", 2, 60)
+    # reading the first entry makes the second one the least recently used
+    assert cache.get("first") == 1
+
+    cache.set("third", 3, 60)
+
+    assert len(cache) == 2
+    assert cache.get("second") is None
+    assert cache.get("first") == 1
+    assert cache.get("third") == 3
@@ -0,0 +1,122 @@
+import os
+import sys
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.join(os.path.dirname(__file__), ".."), ".."))
+)
+
+from models.products import OutputFetchedProducts
+from utils.product_deduplication import parse_price
+from utils.product_ranking import TopKProductRanker
+
+SNEAKERS = "Men Casual Sport Shoes Light Sneakers White Outdoor Breathable Mesh"
+
+
+def _products(website_name, names_and_prices):
+    return OutputFetchedProducts(
+        product_names=[name for name, _ in names_and_prices],
+        product_urls=[
+            f"https://{website_name}/{i}" for i in range(len(names_and_prices))
+        ],
+        product_prices=[price for _, price in names_and_prices],
+        website_source=[website_name for _ in names_and_prices],
+    )
+
+
+def test_parse_price():
+    assert parse_price("US $1,299.99") == 1299.99
+    assert parse_price("US $12") == 12
+    assert parse_price("US") is None
+
+
+def test_near_duplicates_collapse_into_the_cheapest_offer():
+    ranker = TopKProductRanker("sneakers", k=5)
+    ranker.add(
+        _products(
+            "AliExpress",
+            [
+                (SNEAKERS, "US $20.00"),
+                ("Black Leather Boots", "US $35.00"),
+                (SNEAKERS.upper() + "!", "US $18.50"),
+                (SNEAKERS + "!!", "US"),
+                ("Black Leather Belt", "US $9.00"),
+            ],
+        )
+    )
+
+    ranked = ranker.ranked_products()
+
+    assert sorted(zip(ranked.product_names, ranked.product_prices)) == sorted(
+        [
+            (SNEAKERS.upper() + "!", "US $18.50"),
+            ("Black Leather Boots", "US $35.00"),
+            ("Black Leather Belt", "US $9.00"),
+        ]
+    )
+    assert ranked.product_urls[ranked.product_names.index(SNEAKERS.upper() + "!")] == (
+        "https://AliExpress/2"
+    )
+
+
+def test_different_models_and_sizes_are_not_collapsed():
+    ranker = TopKProductRanker("phone case shoes", k=10)
+    ranker.add(
+        _products(
+            "AliExpress",
+            [
+                ("Apple iPhone 14 Pro Max Silicone Case Black", "US $4.00"),
+                ("Apple iPhone 13 Pro Max Silicone Case Black", "US $6.00"),
+                ("Nike Air Force 1 Men Size 44 White", "US $80.00"),
+                ("Nike Air Force 1 Men Size 42 White", "US $90.00"),
+            ],
+        )
+    )
+
+    # the titles share most of their shingles, but they're different products
+    assert sorted(ranker.ranked_products().product_names) == [
+        "Apple iPhone 13 Pro Max Silicone Case Black",
+        "Apple iPhone 14 Pro Max Silicone Case Black",
+        "Nike Air Force 1 Men Size 42 White",
+        "Nike Air Force 1 Men Size 44 White",
+    ]
+
+
+def test_ranker_replaces_a_listing_with_a_cheaper_copy_from_another_website():
+    ranker = TopKProductRanker("sport shoes", k=2)
+    ranker.add(
+        _products("AliExpress", [(SNEAKERS, "US $20.00"), ("Red Hat", "US $5.00")]),
+        website_rank=0,
+    )
+    ranker.add(
+        _products(
+            "HiCart", [(SNEAKERS + ".", "US $15.00"), ("Blue Sport Shoes", "US $9.00")]
+        ),
+        website_rank=2,
+    )
+
+    ranked = ranker.ranked_products()
+
+    # the AliExpress copy was in the top 2 before the cheaper one arrived
+    assert ranked.product_names == [SNEAKERS + ".", "Blue Sport Shoes"]
+    assert ranked.website_source == ["HiCart", "HiCart"]
+    assert ranked.product_prices == ["US $15.00", "US $9.00"]
+
+
+def test_ranker_collapses_copies_within_a_website():
+    ranker = TopKProductRanker("running shoes", k=5)
+    products = _products(
+        "AliExpress",
+        [
+            ("Black Leather Running Shoes for Men", "US $10.00"),
+            ("Red Hat", "US $3.00"),
+            ("Black Leather Running Shoes for Men!", "US $5.00"),
+        ],
+    )
+    ranker.add(products, website_rank=0)
+
+    ranked = ranker.ranked_products()
+
+    assert ranked.product_names == ["Black Leather Running Shoes for Men!", "Red Hat"]
+    assert ranked.product_prices == ["US $5.00", "US $3.00"]
@@ -0,0 +1,61 @@
+import os
+import sys
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.join(os.path.dirname(__file__), ".."), ".."))
+)
+
+from models.products import OutputFetchedProducts
+from utils.product_ranking import TopKProductRanker
+from utils.similarity_calculation import analyze_product_similarities
+
+
+def _products(website_name, names):
+    return OutputFetchedProducts(
+        product_names=names,
+        product_urls=[f"https://{website_name}/{name}" for name in names],
+        product_prices=["US $1" for _ in names],
+        website_source=[website_name for _ in names],
+    )
+
+
+def test_ranker_keeps_the_best_k_products_in_order():
+    ranker = TopKProductRanker("black shoes", k=4)
+    # HiCart answers first
+    ranker.add(_products("HiCart", ["Blue Shirt", "Black Shoes"]), website_rank=2)
+    ranker.add(
+        _products("AliExpress", ["Black Running Shoes", "Red Hat", "Green Hat"]),
+        website_rank=0,
+    )
+    ranker.add(_products("Ishtari", ["Shoes Black", "Black Cat"]), website_rank=1)
+
+    ranked = ranker.ranked_products()
+
+    # both full matches score 1, the Ishtari one comes first
+    assert ranked.product_names == [
+        "Shoes Black",
+        "Black Shoes",
+        "Black Running Shoes",
+        "Black Cat",
+    ]
+    assert ranked.website_source == ["Ishtari", "HiCart", "AliExpress", "Ishtari"]
+    assert ranked.product_urls[1] == "https://HiCart/Black Shoes"
+    # the same scores the sheet would have computed
+    assert [
+        "%" + str(round(score, 3) * 100) for score in ranked.similarity_scores
+    ] == analyze_product_similarities("black shoes", ranked.product_names)
+
+
+def test_ranker_ties_keep_the_website_order():
+    ranker = TopKProductRanker("black shoes", k=3)
+    ranker.add(_products("HiCart", ["Red Hat"]), website_rank=2)
+    ranker.add(_products("AliExpress", ["Blue Hat", "Green Hat"]), website_rank=0)
+    ranker.add(_products("Ishtari", ["Pink Hat"]), website_rank=1)
+
+    assert ranker.ranked_products().product_names == [
+        "Blue Hat",
+        "Green Hat",
+        "Pink Hat",
+    ]
@@ -0,0 +1,75 @@
+import pytest
+import asyncio
+import threading
+import time
+import os
+import sys
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.join(os.path.dirname(__file__), ".."), ".."))
+)
+
+from utils.rate_limiting import TokenBucket, WebsiteLimiter
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_paces_requests_after_the_burst():
+    bucket = TokenBucket(rate=20, capacity=2)
+
+    start_time = time.perf_counter()
+    for _ in range(6):
+        await bucket.acquire()
+    elapsed_time = time.perf_counter() - start_time
+
+    # 2 tokens are available right away, the other 4 are refilled at 20 per second
+    assert 0.15 <= elapsed_time < 0.5
+
+
+@pytest.mark.asyncio
+async def test_website_limiter_caps_concurrent_requests():
+    limiter = WebsiteLimiter("Test", max_concurrent_requests=2, requests_per_second=0)
+    currently_running = 0
+    max_running = 0
+
+    async def request():
+        nonlocal currently_running, max_running
+        async with limiter:
+            currently_running += 1
+            max_running = max(max_running, currently_running)
+            await asyncio.sleep(0.05)
+            currently_running -= 1
+
+    await asyncio.gather(*(request() for _ in range(6)))
+
+    assert max_running == 2
+
+
+@pytest.mark.asyncio
+async def test_cancelled_request_keeps_its_slot_until_its_thread_returns():
+    limiter = WebsiteLimiter("Test", max_concurrent_requests=1, requests_per_second=0)
+    website_answered = threading.Event()
+    finished_requests = []
+
+    def hanging_request():
+        website_answered.wait(timeout=5)
+        finished_requests.append("hanging")
+
+    def next_request():
+        finished_requests.append("next")
+
+    # the website deadline gives up on the first request, its thread is still waiting on the website
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(
+            limiter.run(asyncio.to_thread(hanging_request)), timeout=0.05
+        )
+    next_request_task = asyncio.create_task(
+        limiter.run(asyncio.to_thread(next_request))
+    )
+    await asyncio.sleep(0.1)
+    assert finished_requests == []
+
+    website_answered.set()
+    await next_request_task
+    assert finished_requests == ["hanging", "next"]
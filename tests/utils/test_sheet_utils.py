@@ -0,0 +1,502 @@
+import pytest
+import asyncio
+import time
+import os
+import sys
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.join(os.path.dirname(__file__), ".."), ".."))
+)
+
+from models.products import InputFetchedProducts, ProductBatch
+from utils import sheet_utils
+from utils.logger import logger
+from utils.sheet_utils import (
+    GoogleSheetClient,
+    SheetWriteBuffer,
+    signal_end_of_product_retrieval,
+    signal_start_of_product_retrieval,
+    update_spreadsheet_with_fetched_products,
+)
+from fastapi import HTTPException
+
+
+class FakeWorksheet:
+    def __init__(self, sheet_id, column_a_values, row_count):
+        self.id = sheet_id
+        self._column_a_values = column_a_values
+        self._properties = {"gridProperties": {"rowCount": row_count}}
+        self.col_values_calls = 0
+
+    @property
+    def row_count(self):
+        return self._properties["gridProperties"]["rowCount"]
+
+    def col_values(self, col):
+        self.col_values_calls += 1
+        return self._column_a_values
+
+
+class FakeWorkbook:
+    def __init__(self):
+        self.worksheet_calls = 0
+        self.batch_update_bodies = []
+        self.worksheets = {
+            "User Input": FakeWorksheet(0, ["Keywords"], 100),
+            "Product Recommendations": FakeWorksheet(
+                1, ["Products"] + ["old product"] * 9, 12
+            ),
+        }
+
+    def worksheet(self, title):
+        self.worksheet_calls += 1
+        return self.worksheets.get(title, f"worksheet {title}")
+
+    def batch_update(self, body):
+        self.batch_update_bodies.append(body)
+
+
+class FakeGspreadClient:
+    def __init__(self):
+        self.workbook = FakeWorkbook()
+
+    def open_by_key(self, key):
+        return self.workbook
+
+
+def test_google_sheet_client_authorizes_once_and_caches_worksheets():
+    authorizations = []
+
+    def client_factory():
+        client = FakeGspreadClient()
+        authorizations.append(client)
+        return client
+
+    sheet_client = GoogleSheetClient(client_factory=client_factory)
+    for _ in range(5):
+        assert sheet_client.worksheet("Other Sheet") == "worksheet Other Sheet"
+        sheet_client.worksheet("Product Recommendations")
+
+    assert len(authorizations) == 1
+    # one metadata fetch per worksheet, no matter how many keywords were written
+    assert authorizations[0].workbook.worksheet_calls == 2
+
+    # after a reset the handles are rebuilt
+    sheet_client.reset()
+    sheet_client.worksheet("Other Sheet")
+    assert len(authorizations) == 2
+
+
+def _use_fake_client(monkeypatch):
+    fake_client = FakeGspreadClient()
+    monkeypatch.setattr(
+        sheet_utils,
+        "GOOGLE_SHEET_CLIENT",
+        GoogleSheetClient(client_factory=lambda: fake_client),
+    )
+    return fake_client
+
+
+def _product_group():
+    return InputFetchedProducts(
+        product_names=["Black Shoes", "Black Shirt"],
+        product_urls=["https://example.com/shoes", "https://example.com/shirt"],
+        product_prices=["US $10", "US $12"],
+        website_source=["AliExpress", "Ishtari"],
+    )
+
+
+def test_product_group_is_written_in_a_single_batch_update(monkeypatch):
+    fake_client = _use_fake_client(monkeypatch)
+
+    update_spreadsheet_with_fetched_products(
+        _product_group(),
+        product_order_id=1,
+        keyword="black shoes",
+    )
+
+    assert len(fake_client.workbook.batch_update_bodies) == 1
+    requests = fake_client.workbook.batch_update_bodies[0]["requests"]
+    request_types = [next(iter(request)) for request in requests]
+    # the old results are deleted, a missing row is added, then the values and formats, the merge
+    # and the status cell
+    assert request_types == [
+        "deleteDimension",
+        "appendDimension",
+        "updateCells",
+        "mergeCells",
+        "updateCells",
+    ]
+    assert requests[0]["deleteDimension"]["range"]["endIndex"] == 10
+
+    rows = requests[2]["updateCells"]["rows"]
+    assert len(rows) == 3  # the keyword row and the two products
+    assert rows[0]["values"][0]["userEnteredValue"] == {
+        "stringValue": "Products for keyword: black shoes"
+    }
+    # the URL is written once, directly as a hyperlink formula
+    assert rows[1]["values"][2]["userEnteredValue"] == {
+        "formulaValue": '=HYPERLINK("https://example.com/shoes", "https://example.com/shoes")'
+    }
+    assert requests[4]["updateCells"]["range"]["sheetId"] == 0
+    # 12 rows - 9 deleted old product rows + 1 added row for the 3 rows of the new group
+    assert requests[1]["appendDimension"]["length"] == 1
+    assert fake_client.workbook.worksheets["Product Recommendations"].row_count == 4
+
+
+def test_write_buffer_coalesces_groups_without_reading_the_sheet(monkeypatch):
+    fake_client = _use_fake_client(monkeypatch)
+    sheet_buffer = SheetWriteBuffer(max_pending_groups=5, flush_interval_seconds=60)
+
+    for product_order_id in range(1, 8):
+        update_spreadsheet_with_fetched_products(
+            _product_group(),
+            product_order_id,
+            f"keyword {product_order_id}",
+            sheet_buffer=sheet_buffer,
+        )
+    # 5 groups were flushed together, the other 2 are still pending
+    assert len(fake_client.workbook.batch_update_bodies) == 1
+    sheet_buffer.flush()
+    assert len(fake_client.workbook.batch_update_bodies) == 2
+
+    product_recommendations = fake_client.workbook.worksheets["Product Recommendations"]
+    assert product_recommendations.col_values_calls == 0
+
+    # the row cursor is tracked locally: 7 groups of 3 rows with an empty row between them
+    written_ranges = [
+        request["updateCells"]["range"]
+        for body in fake_client.workbook.batch_update_bodies
+        for request in body["requests"]
+        if "updateCells" in request
+        and request["updateCells"]["range"]["sheetId"] == 1
+        and "rows" in request["updateCells"]
+    ]
+    assert [grid_range["startRowIndex"] + 1 for grid_range in written_ranges] == [
+        2,
+        6,
+        10,
+        14,
+        18,
+        22,
+        26,
+    ]
+    assert product_recommendations.row_count == 28
+
+
+def test_write_buffer_flushes_on_the_time_threshold(monkeypatch):
+    fake_client = _use_fake_client(monkeypatch)
+    sheet_buffer = SheetWriteBuffer(max_pending_groups=100, flush_interval_seconds=0)
+
+    update_spreadsheet_with_fetched_products(
+        _product_group(), 1, "black shoes", sheet_buffer=sheet_buffer
+    )
+
+    assert len(fake_client.workbook.batch_update_bodies) == 1
+
+
+# The tests below run against the in-memory Sheets API from tests/fake_google_sheets_api.py (the
+# fake_sheets_api fixture in conftest.py). They guard the number of API calls per keyword
+
+
+def _run_job(keywords, sheet_buffer=None):
+    assert signal_start_of_product_retrieval()
+    for product_order_id, keyword in enumerate(keywords, start=1):
+        update_spreadsheet_with_fetched_products(
+            _product_group(), product_order_id, keyword, sheet_buffer=sheet_buffer
+        )
+    if sheet_buffer is not None:
+        sheet_buffer.flush()
+    assert signal_end_of_product_retrieval()
+
+
+def _fill_user_input(fake_sheets_api, keywords):
+    user_input = fake_sheets_api.sheet("User Input")
+    user_input.cells[(0, 0)] = "Keywords"
+    for row, keyword in enumerate(keywords, start=1):
+        user_input.cells[(row, 0)] = keyword
+
+
+def test_sheet_contents_after_a_job(fake_sheets_api):
+    keywords = ["black shoes", "white shirt"]
+    _fill_user_input(fake_sheets_api, keywords)
+    # leftovers of a previous job that should be cleared
+    product_recommendations = fake_sheets_api.sheet("Product Recommendations")
+    for row in range(1, 30):
+        product_recommendations.cells[(row, 0)] = "old product"
+
+    _run_job(keywords, sheet_buffer=SheetWriteBuffer())
+
+    assert product_recommendations.column_values(1)[1:] == [
+        "Products for keyword: black shoes",
+        "Black Shoes",
+        "Black Shirt",
+        "",
+        "Products for keyword: white shirt",
+        "Black Shoes",
+        "Black Shirt",
+    ]
+    assert product_recommendations.value(3, 3) == (
+        '=HYPERLINK("https://example.com/shoes", "https://example.com/shoes")'
+    )
+    assert len(product_recommendations.merges) == 2
+    user_input = fake_sheets_api.sheet("User Input")
+    assert user_input.column_values(2)[1:] == ["Fetched Products Successfully"] * 2
+    assert user_input.value(2, 3) == "Retrieved the Products, See Sheet 2 and Sheet 3"
+
+
+def test_api_calls_per_keyword_without_a_buffer(fake_sheets_api):
+    keywords = [f"keyword {i}" for i in range(10)]
+    _fill_user_input(fake_sheets_api, keywords)
+
+    update_spreadsheet_with_fetched_products(_product_group(), 1, keywords[0])
+    fake_sheets_api.reset_counters()
+    for product_order_id, keyword in enumerate(keywords[1:], start=2):
+        update_spreadsheet_with_fetched_products(
+            _product_group(), product_order_id, keyword
+        )
+
+    # one read for the next free row and one batchUpdate, the spreadsheet metadata is cached
+    assert fake_sheets_api.calls == {"values.get": 9, "batchUpdate": 9}
+
+
+def test_api_calls_per_job_with_a_write_buffer(fake_sheets_api):
+    keywords = [f"keyword {i}" for i in range(40)]
+    _fill_user_input(fake_sheets_api, keywords)
+
+    _run_job(keywords, sheet_buffer=SheetWriteBuffer(max_pending_groups=5))
+    calls_first_job = fake_sheets_api.total_calls
+    fake_sheets_api.reset_counters()
+    _run_job(keywords, sheet_buffer=SheetWriteBuffer(max_pending_groups=5))
+    logger.info(f"Sheets API calls for a 40 keyword job: {fake_sheets_api.calls}")
+
+    # 8 batchUpdates for the 40 keywords, the rest is the fixed cost of the job (the status cells
+    # in User Input and one metadata refresh)
+    assert fake_sheets_api.calls["batchUpdate"] == 2 + 8
+    assert fake_sheets_api.calls["metadata"] == 1
+    assert fake_sheets_api.total_calls <= 16
+    # authorizing and opening the spreadsheet only happens in the first job
+    assert calls_first_job - fake_sheets_api.total_calls == 2
+
+
+def test_buffered_job_with_latency(fake_sheets_api):
+    """Offline load test, with 20ms per call a 40 keyword job should spend well under a second on the sheet"""
+    keywords = [f"keyword {i}" for i in range(40)]
+    _fill_user_input(fake_sheets_api, keywords)
+    fake_sheets_api.latency_seconds = 0.02
+
+    start_time = time.perf_counter()
+    _run_job(keywords, sheet_buffer=SheetWriteBuffer(max_pending_groups=5))
+    elapsed_time = time.perf_counter() - start_time
+    logger.info(f"Writing a 40 keyword job took {elapsed_time:.3f} seconds")
+
+    assert elapsed_time < fake_sheets_api.total_calls * 0.02 + 0.5
+
+
+def test_rate_limited_sheet_update_raises(fake_sheets_api):
+    _fill_user_input(fake_sheets_api, ["black shoes"])
+    fake_sheets_api.rate_limit_every = 1
+
+    with pytest.raises(HTTPException):
+        update_spreadsheet_with_fetched_products(_product_group(), 1, "black shoes")
+
+
+def test_partial_products_are_replaced_in_the_reserved_block(fake_sheets_api):
+    keywords = ["black shoes", "white shirt"]
+    _fill_user_input(fake_sheets_api, keywords)
+    sheet_buffer = SheetWriteBuffer(max_pending_groups=5)
+
+    assert signal_start_of_product_retrieval()
+    sheet_buffer.reserve_keyword_blocks(len(keywords), products_per_keyword=3)
+    # AliExpress answered first for both keywords, then Ishtari for the first one
+    sheet_buffer.add_partial_products(
+        ProductBatch(["AliExpress Shoes"], ["https://a/1"], ["US $9"], ["AliExpress"]),
+        1,
+        "black shoes",
+    )
+    sheet_buffer.add_partial_products(
+        ProductBatch(["AliExpress Shirt"], ["https://a/2"], ["US $5"], ["AliExpress"]),
+        2,
+        "white shirt",
+    )
+    sheet_buffer.add_partial_products(
+        ProductBatch(
+            ["Ishtari Shoes", "AliExpress Shoes"],
+            ["https://i/1", "https://a/1"],
+            ["US $8", "US $9"],
+            ["Ishtari", "AliExpress"],
+        ),
+        1,
+        "black shoes",
+    )
+    fake_sheets_api.reset_counters()
+    sheet_buffer.flush()
+    # only the latest partial write of each keyword is sent, in a single batchUpdate
+    assert fake_sheets_api.calls == {"batchUpdate": 1}
+    product_recommendations = fake_sheets_api.sheet("Product Recommendations")
+    assert product_recommendations.column_values(1)[1:4] == [
+        "Products for keyword: black shoes",
+        "Ishtari Shoes",
+        "AliExpress Shoes",
+    ]
+
+    # the final products of the first keyword are fewer than the partial ones
+    update_spreadsheet_with_fetched_products(
+        ProductBatch(["Ishtari Shoes"], ["https://i/1"], ["US $8"], ["Ishtari"]),
+        1,
+        "black shoes",
+        sheet_buffer=sheet_buffer,
+    )
+    sheet_buffer.flush()
+    assert signal_end_of_product_retrieval()
+
+    # the rows left over from the partial write are emptied
+    assert product_recommendations.column_values(1)[1:] == [
+        "Products for keyword: black shoes",
+        "Ishtari Shoes",
+        "",
+        "",
+        "",
+        "Products for keyword: white shirt",
+        "AliExpress Shirt",
+    ]
+    assert len(product_recommendations.merges) == 2
+    user_input = fake_sheets_api.sheet("User Input")
+    assert user_input.column_values(2)[1:] == [
+        "Fetched Products Successfully",
+        "Fetching Product Recommendations",
+    ]
+
+
+def test_failed_flush_keeps_the_finished_groups(fake_sheets_api):
+    keywords = ["black shoes", "white shirt"]
+    _fill_user_input(fake_sheets_api, keywords)
+    sheet_buffer = SheetWriteBuffer(max_pending_groups=5)
+
+    assert signal_start_of_product_retrieval()
+    # the blocks don't fit in the 1000 rows of the sheet
+    sheet_buffer.reserve_keyword_blocks(len(keywords), products_per_keyword=600)
+    update_spreadsheet_with_fetched_products(
+        ProductBatch(["Ishtari Shoes"], ["https://i/1"], ["US $8"], ["Ishtari"]),
+        1,
+        "black shoes",
+        sheet_buffer=sheet_buffer,
+    )
+    # the partial write of the second keyword triggers a flush, which is rate limited
+    sheet_buffer.flush_interval_seconds = 0
+    fake_sheets_api.rate_limit_every = 1
+    with pytest.raises(HTTPException):
+        sheet_buffer.add_partial_products(
+            ProductBatch(
+                ["AliExpress Shirt"], ["https://a/2"], ["US $5"], ["AliExpress"]
+            ),
+            2,
+            "white shirt",
+        )
+
+    fake_sheets_api.rate_limit_every = 0
+    sheet_buffer.flush()
+    assert signal_end_of_product_retrieval()
+
+    product_recommendations = fake_sheets_api.sheet("Product Recommendations")
+    assert product_recommendations.row_count == 1 + 601 + 1 + 601
+    # the partial write was dropped, nothing was written to the second block yet
+    assert product_recommendations.column_values(1)[1:] == [
+        "Products for keyword: black shoes",
+        "Ishtari Shoes",
+    ]
+    assert len(product_recommendations.merges) == 2
+    user_input = fake_sheets_api.sheet("User Input")
+    assert user_input.column_values(2)[1:] == [
+        "Fetched Products Successfully",
+        "Fetching Product Recommendations",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_flusher_writes_partial_products_without_blocking(fake_sheets_api):
+    _fill_user_input(fake_sheets_api, ["black shoes"])
+    sheet_buffer = SheetWriteBuffer(flush_interval_seconds=0.2)
+    assert signal_start_of_product_retrieval()
+    sheet_buffer.reserve_keyword_blocks(1, products_per_keyword=3)
+    sheet_buffer.start_flusher()
+    fake_sheets_api.latency_seconds = 0.3
+
+    # no other write comes in, the flusher sends the partial products on its own
+    sheet_buffer.add_partial_products(
+        ProductBatch(["AliExpress Shoes"], ["https://a/1"], ["US $9"], ["AliExpress"]),
+        1,
+        "black shoes",
+    )
+    ticks = 0
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < 0.7:
+        await asyncio.sleep(0.01)
+        ticks += 1
+
+    product_recommendations = fake_sheets_api.sheet("Product Recommendations")
+    assert product_recommendations.column_values(1)[1:] == [
+        "Products for keyword: black shoes",
+        "AliExpress Shoes",
+    ]
+    # the event loop kept running while the batchUpdate waited on the sheet
+    assert ticks > 30
+
+    update_spreadsheet_with_fetched_products(
+        ProductBatch(["Ishtari Shoes"], ["https://i/1"], ["US $8"], ["Ishtari"]),
+        1,
+        "black shoes",
+        sheet_buffer=sheet_buffer,
+    )
+    await sheet_buffer.close()
+    assert product_recommendations.column_values(1)[1:] == [
+        "Products for keyword: black shoes",
+        "Ishtari Shoes",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_flusher_keeps_going_after_a_connection_error(
+    fake_sheets_api, monkeypatch
+):
+    _fill_user_input(fake_sheets_api, ["black shoes"])
+    sheet_buffer = SheetWriteBuffer(flush_interval_seconds=0.1)
+    assert signal_start_of_product_retrieval()
+    sheet_buffer.reserve_keyword_blocks(1, products_per_keyword=3)
+    sheet_buffer.start_flusher()
+
+    set_row_count = sheet_utils._set_row_count
+    failures = []
+
+    def flaky_set_row_count(worksheet, row_count):
+        # the worksheet lookup after the first batchUpdate loses the connection
+        if not failures:
+            failures.append(row_count)
+            raise ConnectionError("Connection aborted")
+        set_row_count(worksheet, row_count)
+
+    monkeypatch.setattr(sheet_utils, "_set_row_count", flaky_set_row_count)
+    sheet_buffer.add_partial_products(
+        ProductBatch(["AliExpress Shoes"], ["https://a/1"], ["US $9"], ["AliExpress"]),
+        1,
+        "black shoes",
+    )
+    await asyncio.sleep(0.3)
+    assert failures
+
+    update_spreadsheet_with_fetched_products(
+        ProductBatch(["Ishtari Shoes"], ["https://i/1"], ["US $8"], ["Ishtari"]),
+        1,
+        "black shoes",
+        sheet_buffer=sheet_buffer,
+    )
+    # written by the flusher, which is still running
+    await asyncio.sleep(0.3)
+    product_recommendations = fake_sheets_api.sheet("Product Recommendations")
+    assert product_recommendations.column_values(1)[1:] == [
+        "Products for keyword: black shoes",
+        "Ishtari Shoes",
+    ]
+    await sheet_buffer.close()
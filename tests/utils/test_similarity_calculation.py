@@ -0,0 +1,100 @@
+import pytest
+import random
+import re
+import os
+import sys
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.join(os.path.dirname(__file__), ".."), ".."))
+)
+
+from utils.similarity_calculation import (
+    analyze_product_similarities,
+    format_similarity_score,
+    score_keywords_against_products,
+)
+
+
+def legacy_analyze_product_similarities(keyword, products):
+    """The per title scoring the batch scores have to match"""
+
+    def preprocess_text(text):
+        return re.sub(r"[^\w\s]", "", str(text).lower())
+
+    proc_keyword = preprocess_text(keyword)
+    scores = []
+    for product in [preprocess_text(p) for p in products]:
+        keyword_words = proc_keyword.split()
+        product_words = product.split()
+        base_score = sum(1 for w in keyword_words if w in product_words) / len(
+            keyword_words
+        )
+        phrase_bonus = 1.5 if proc_keyword in product else 1.0
+        position_score = 0
+        for i, word in enumerate(product_words):
+            if word in keyword_words:
+                position_score += 1 / (i + 1)
+        final_score = (
+            base_score * phrase_bonus * (1 + (position_score / len(product_words)))
+        ) / 1.5
+        if final_score > 1:
+            final_score = 1.0
+        scores.append("%" + str(round(final_score, 3) * 100))
+    return scores
+
+
+WORDS = ["black", "shoes", "shoe", "men's", "Running", "LEATHER", "white", "sneakers"]
+WORDS += ["café", "2024", "t-shirt", "slim", "fit", "!!", "shoes,", "a", "black-shoes"]
+
+KEYWORDS = [
+    "black shoes",
+    "Black  Shoes!",
+    "shoe",
+    "shoes shoes",
+    "men's running sneakers",
+    "café",
+    "t-shirt slim fit",
+    "black",
+]
+
+
+def _random_titles(number_of_titles, seed=7):
+    generator = random.Random(seed)
+    # the first word makes sure no title is only punctuation
+    return [
+        generator.choice(WORDS[:8])
+        + " "
+        + " ".join(generator.choice(WORDS) for _ in range(generator.randint(0, 25)))
+        for _ in range(number_of_titles)
+    ]
+
+
+@pytest.mark.parametrize("keyword", KEYWORDS)
+def test_scores_match_the_per_title_scoring(keyword):
+    titles = _random_titles(500) + ["black shoes", "Black Shoes", "blackshoes"]
+
+    assert analyze_product_similarities(
+        keyword, titles
+    ) == legacy_analyze_product_similarities(keyword, titles)
+
+
+def test_batch_scores_every_keyword_at_once():
+    titles = _random_titles(300, seed=11)
+
+    scores = score_keywords_against_products(KEYWORDS, titles)
+
+    assert scores.shape == (len(KEYWORDS), len(titles))
+    for keyword, keyword_scores in zip(KEYWORDS, scores.tolist()):
+        assert [
+            format_similarity_score(score) for score in keyword_scores
+        ] == legacy_analyze_product_similarities(keyword, titles)
+
+
+def test_unscorable_keywords_and_titles_raise_like_before():
+    with pytest.raises(ZeroDivisionError):
+        analyze_product_similarities("!!", ["black shoes"])
+    with pytest.raises(ZeroDivisionError):
+        analyze_product_similarities("black shoes", ["black shoes", "!!"])
+    assert analyze_product_similarities("!!", []) == []
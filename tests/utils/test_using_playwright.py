@@ -1,6 +1,8 @@
 import pytest
+import asyncio
 import os
 import sys
+import time
 
 # Get the parent directory of the current file and add it to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -13,6 +15,7 @@ from websites_to_fetch_from.aliexpress_api import (
 )
 from websites_to_fetch_from.ishtari_api import fetch_ishtari_product_recommendations
 from models.products import OutputFetchedProducts
+from utils import using_playwright
 from utils.logger import logger
 
 # pytest by default loads the conftest.py fixtures when the test files are being run. so there's no
@@ -58,3 +61,129 @@ async def test_expired_Ishtari_cookie_scenario(mock_ishtari_cookie):
         f"This is the number of products fetched in the test: {len(result.product_names)}"
     )
     assert len(result.product_names) > 0
+
+
+def test_cookie_jar_expires_with_its_first_cookie(monkeypatch):
+    monkeypatch.setattr(using_playwright, "COOKIE_MAX_AGE_SECONDS", 3600)
+    now = time.time()
+    cookies = [
+        {"name": "session", "value": "1", "expires": -1},
+        {"name": "api-token", "value": "abc", "expires": now + 600},
+        {"name": "locale", "value": "en_US", "expires": now + 86400},
+    ]
+
+    assert using_playwright._cookie_jar_expiry(cookies) == pytest.approx(
+        now + 600, abs=1
+    )
+    # session cookies only, capped by COOKIE_MAX_AGE_SECONDS
+    assert using_playwright._cookie_jar_expiry(cookies[:1]) == pytest.approx(
+        now + 3600, abs=1
+    )
+
+
+def test_short_lived_cookies_dont_expire_the_jar(monkeypatch):
+    monkeypatch.setattr(using_playwright, "COOKIE_MAX_AGE_SECONDS", 3600)
+    monkeypatch.setattr(using_playwright, "COOKIE_EXPIRY_MARGIN_SECONDS", 300)
+    now = time.time()
+    cookies = [
+        {"name": "_ga_tracking", "value": "1", "expires": now + 60},
+        {"name": "api-token", "value": "abc", "expires": now + 1800},
+        {"name": "locale", "value": "en_US", "expires": now + 900},
+    ]
+
+    assert using_playwright._cookie_jar_expiry(cookies) == pytest.approx(
+        now + 900, abs=1
+    )
+    # Ishtari only needs the api-token
+    assert using_playwright._cookie_jar_expiry(
+        cookies, ("api-token",)
+    ) == pytest.approx(now + 1800, abs=1)
+
+
+class FakePlaywright:
+    """Stands in for the object returned by async_playwright(), counts the browser launches and contexts"""
+
+    def __init__(self, page_load_seconds):
+        self.page_load_seconds = page_load_seconds
+        self.launches = 0
+        self.open_contexts = 0
+        self.stopped = False
+        self.chromium = self
+
+    async def start(self):
+        return self
+
+    async def stop(self):
+        self.stopped = True
+
+    async def launch(self, headless):
+        self.launches += 1
+        return FakeBrowser(self)
+
+
+class FakeBrowser:
+    def __init__(self, playwright):
+        self.playwright = playwright
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    async def new_context(self, **kwargs):
+        self.playwright.open_contexts += 1
+        return FakeContext(self.playwright)
+
+    async def close(self):
+        self.connected = False
+
+
+class FakeContext:
+    def __init__(self, playwright):
+        self.playwright = playwright
+        self.url = None
+
+    async def new_page(self):
+        return self
+
+    async def goto(self, url, timeout):
+        self.url = url
+        await asyncio.sleep(self.playwright.page_load_seconds)
+
+    async def wait_for_load_state(self, state, timeout):
+        pass
+
+    async def cookies(self, url):
+        return [{"name": "site", "value": url, "expires": -1}]
+
+    async def close(self):
+        self.playwright.open_contexts -= 1
+
+
+@pytest.mark.asyncio
+async def test_cookies_are_harvested_in_parallel_in_one_browser(monkeypatch):
+    fake_playwright = FakePlaywright(page_load_seconds=0.3)
+    monkeypatch.setattr(using_playwright, "async_playwright", lambda: fake_playwright)
+    shared_browser = using_playwright.SharedBrowser()
+    monkeypatch.setattr(using_playwright, "SHARED_BROWSER", shared_browser)
+
+    start_time = time.perf_counter()
+    (aliexpress_cookie, _), (ishtari_cookie, _) = await asyncio.gather(
+        using_playwright.get_aliexpress_cookie_using_playwright(),
+        using_playwright.get_ishtari_cookie_using_playwright(),
+    )
+    elapsed_time = time.perf_counter() - start_time
+
+    # bounded by the slower site, and a single browser for both
+    assert elapsed_time < 0.5
+    assert fake_playwright.launches == 1
+    # each site got its own context, closed after the harvest
+    assert aliexpress_cookie == "site=https://aliexpress.com"
+    assert ishtari_cookie == "site=https://www.ishtari.com"
+    assert fake_playwright.open_contexts == 0
+
+    # a later refresh reuses the running browser
+    await using_playwright.get_ishtari_cookie_using_playwright()
+    assert fake_playwright.launches == 1
+
+    await shared_browser.close()
+    assert fake_playwright.stopped
@@ -1,16 +1,28 @@
 from dotenv import load_dotenv
 import os
+import asyncio
 import requests
 import cloudscraper
 
+from utils.http_sessions import WEBSITE_REQUEST_TIMEOUT_SECONDS, create_pooled_session
+
 load_dotenv()
 
 SCRAPERAPI_KEY = os.getenv("SCRAPERAPI_KEY")
 
+# every request through ScraperAPI goes to api.scraperapi.com, this session keeps those connections open
+SCRAPERAPI_SESSION = create_pooled_session("ScraperAPI")
+
 # with scraperAPI, on every new call a new IP address is used
 
+# requests and cloudscraper are blocking libraries, so every call below is run in a worker thread with
+# asyncio.to_thread. Otherwise a single slow ScraperAPI request would freeze the whole event loop,
+# including the /health, /fetch_status and /cancel_product_fetch endpoints. The calls get
+# WEBSITE_REQUEST_TIMEOUT_SECONDS unless the caller gives its own timeout, so that a hung request doesn't
+# hold its worker thread forever
+
 
-def get_request_using_scraperapi(
+async def get_request_using_scraperapi(
     url: str, test_ip=False, country_code: str = None, **kwargs
 ) -> requests.Response:
 
@@ -24,12 +36,15 @@ def get_request_using_scraperapi(
     if country_code:
         payload.update({"country_code": country_code})
     print(f"This the payload from the get_requests_using_scraperapi: {payload}")
-    response = requests.get("https://api.scraperapi.com", params=payload, **kwargs)
+    kwargs.setdefault("timeout", WEBSITE_REQUEST_TIMEOUT_SECONDS)
+    response = await asyncio.to_thread(
+        SCRAPERAPI_SESSION.get, "https://api.scraperapi.com", params=payload, **kwargs
+    )
 
     return response
 
 
-def get_request_from_session_with_scraperapi(
+async def get_request_from_session_with_scraperapi(
     session: requests.Session,
     url: str,
     test_ip=False,
@@ -46,13 +61,16 @@ def get_request_from_session_with_scraperapi(
     }
     if country_code:
         payload.update({"country_code": country_code})
+    kwargs.setdefault("timeout", WEBSITE_REQUEST_TIMEOUT_SECONDS)
 
-    response = session.get("https://api.scraperapi.com", params=payload, **kwargs)
+    response = await asyncio.to_thread(
+        session.get, "https://api.scraperapi.com", params=payload, **kwargs
+    )
 
     return response
 
 
-def get_request_using_cloudscraper_with_scraperapi(
+async def get_request_using_cloudscraper_with_scraperapi(
     cloudscraper: cloudscraper.CloudScraper,
     url: str,
     test_ip=False,
@@ -69,7 +87,10 @@ def get_request_using_cloudscraper_with_scraperapi(
     }
     if country_code:
         payload.update({"country_code": country_code})
-    response = cloudscraper.get("https://api.scraperapi.com", params=payload, **kwargs)
+    kwargs.setdefault("timeout", WEBSITE_REQUEST_TIMEOUT_SECONDS)
+    response = await asyncio.to_thread(
+        cloudscraper.get, "https://api.scraperapi.com", params=payload, **kwargs
+    )
 
     return response
 
@@ -78,5 +99,7 @@ if __name__ == "__main__":
     # scraper = cloudscraper.create_scraper()
     # response = get_request_using_cloudscraper_with_scraperapi(scraper, "", test_ip=True)
     session = requests.Session()
-    response = get_request_from_session_with_scraperapi(session, "", test_ip=True)
+    response = asyncio.run(
+        get_request_from_session_with_scraperapi(session, "", test_ip=True)
+    )
     print(response.text)
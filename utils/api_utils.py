@@ -1,7 +1,38 @@
 from fastapi import HTTPException
+import asyncio
+import os
 import re
+import time
+from typing import Optional
 
 from utils.logger import logger
+from utils.persistent_cache import CACHE_DIRECTORY, PersistentLRUCache
+from utils.using_playwright import (
+    get_aliexpress_cookie_using_playwright,
+    get_ishtari_cookie_using_playwright,
+)
+
+# A cookie is treated as expired this many seconds before its actual expiry, so that it doesn't run out
+# in the middle of a job
+COOKIE_EXPIRY_MARGIN_SECONDS = float(os.getenv("COOKIE_EXPIRY_MARGIN_SECONDS", "300"))
+
+# The background refresher harvests a new cookie this many seconds before the current one expires, it
+# has to be more than the margin above so that the requests never wait on Playwright themselves
+COOKIE_REFRESH_AHEAD_SECONDS = float(os.getenv("COOKIE_REFRESH_AHEAD_SECONDS", "900"))
+# How long the background refresher waits before trying again after a failed harvest, and how often it
+# checks a cookie without a known expiry. It's also the minimum time between two harvests of a website,
+# so a cookie that is already expired when it's harvested doesn't start Playwright on every request
+COOKIE_REFRESH_RETRY_SECONDS = float(os.getenv("COOKIE_REFRESH_RETRY_SECONDS", "60"))
+
+# How long a job waits for the cookie of a website (the first harvest after a restart, or the retries of a
+# failed one) before it skips the website for the keyword
+COOKIE_READY_TIMEOUT_SECONDS = float(os.getenv("COOKIE_READY_TIMEOUT_SECONDS", "120"))
+
+# The harvested cookies are saved here with their expiry so that a server restart doesn't have to run
+# Playwright again
+COOKIE_JAR = PersistentLRUCache(
+    os.path.join(CACHE_DIRECTORY, "cookie_jar.sqlite3"), table="cookies"
+)
 
 
 def check_shared_secret_validity(authorization, SHARED_SECRET):
@@ -12,9 +43,183 @@ def check_shared_secret_validity(authorization, SHARED_SECRET):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
 
-class IshtariCookie:
-    def __init__(self, cookie):
+class WebsiteCookie:
+    """The cookie header we send to a website, and when it expires. refresh() harvests a new one with
+    harvest_cookie (the Playwright function of the website), only one harvest runs at a time per website
+    and the other callers wait for its result. The jobs wait with wait_until_ready() until there's a
+    valid cookie at all"""
+
+    website_name = None
+    # async function returning a new cookie header and the timestamp at which it expires
+    harvest_cookie = None
+
+    def __init__(self, cookie, expires_at=None, harvest_cookie=None):
+        self.cookie = cookie
+        self.expires_at = expires_at
+        if harvest_cookie is not None:
+            self.harvest_cookie = harvest_cookie
+        self._refresh_task = None
+        self._background_refresh_task = None
+        self._last_harvest_at = None
+        # set once there's a valid cookie, created in the running event loop (the tests run one per test)
+        self._ready = None
+        self._ready_loop = None
+
+    def is_expired(self) -> bool:
+        if self.cookie is None:
+            return True
+        # we don't know when it expires, keep using it until the website rejects it
+        if self.expires_at is None:
+            return False
+        return time.time() >= self.expires_at - COOKIE_EXPIRY_MARGIN_SECONDS
+
+    def _is_usable(self) -> bool:
+        # unlike is_expired, a cookie within the expiry margin still counts, the website still takes it
+        return self.cookie is not None and (
+            self.expires_at is None or self.expires_at > time.time()
+        )
+
+    def _ready_event(self) -> asyncio.Event:
+        loop = asyncio.get_running_loop()
+        if self._ready_loop is not loop:
+            self._ready = asyncio.Event()
+            self._ready_loop = loop
+        if self._is_usable():
+            self._ready.set()
+        return self._ready
+
+    async def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """Waits until there's a valid cookie, returns False if there's still none after timeout seconds
+        (COOKIE_READY_TIMEOUT_SECONDS by default)"""
+        if timeout is None:
+            timeout = COOKIE_READY_TIMEOUT_SECONDS
+        ready = self._ready_event()
+        if ready.is_set():
+            return True
+        logger.info(f"Waiting for the {self.website_name} cookie to be ready")
+        try:
+            await asyncio.wait_for(ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.error(
+                f"The {self.website_name} cookie is still not ready after {timeout} seconds"
+            )
+            return False
+
+    async def refresh(self, rejected_cookie=None):
+        """Harvests a new cookie, or waits for the harvest that is already running. With rejected_cookie
+        (the cookie a website just refused), nothing is harvested if it was already replaced meanwhile
+        """
+        if (
+            rejected_cookie is not None
+            and self.cookie != rejected_cookie
+            and not self.is_expired()
+        ):
+            logger.info(f"The {self.website_name} cookie was already refreshed")
+            return
+        if self._refresh_task is None or self._refresh_task.done():
+            if self._seconds_until_next_harvest() > 0:
+                logger.warning(
+                    f"Not refreshing the {self.website_name} cookie, it was harvested less than {COOKIE_REFRESH_RETRY_SECONDS} seconds ago"
+                )
+                return
+            logger.info(f"Refreshing the {self.website_name} cookie")
+            self._refresh_task = asyncio.create_task(self._harvest())
+        # shielded so that a cancelled caller doesn't cancel the harvest the other callers are waiting on
+        await asyncio.shield(self._refresh_task)
+
+    async def _harvest(self):
+        self._last_harvest_at = time.time()
+        cookie, expires_at = await self.harvest_cookie()
+        self.set_cookie(cookie, expires_at)
+        if self.is_expired():
+            logger.error(
+                f"The new {self.website_name} cookie already counts as expired (it expires in {expires_at - time.time():.0f} seconds), using it anyway"
+            )
+
+    def _seconds_until_next_harvest(self) -> float:
+        if self._last_harvest_at is None:
+            return 0
+        return max(
+            self._last_harvest_at + COOKIE_REFRESH_RETRY_SECONDS - time.time(), 0
+        )
+
+    async def get_fresh_cookie(self) -> str:
+        """Returns the cookie, refreshing it first if it's missing or about to expire"""
+        if self.is_expired():
+            await self.refresh()
+        return self.cookie
+
+    def start_background_refresh(self):
+        if (
+            self._background_refresh_task is None
+            or self._background_refresh_task.done()
+        ):
+            self._background_refresh_task = asyncio.create_task(
+                self._refresh_ahead_of_expiry()
+            )
+
+    async def stop_background_refresh(self):
+        if self._background_refresh_task is not None:
+            self._background_refresh_task.cancel()
+            await asyncio.gather(self._background_refresh_task, return_exceptions=True)
+            self._background_refresh_task = None
+
+    async def _refresh_ahead_of_expiry(self):
+        while True:
+            if self.cookie is None:
+                delay = self._seconds_until_next_harvest()
+            elif self.expires_at is None:
+                # we don't know when it expires, the fetchers refresh it when the website rejects it
+                await asyncio.sleep(COOKIE_REFRESH_RETRY_SECONDS)
+                continue
+            else:
+                # a short lived cookie is still not refreshed more than once per COOKIE_REFRESH_RETRY_SECONDS
+                delay = max(
+                    self.expires_at - COOKIE_REFRESH_AHEAD_SECONDS - time.time(),
+                    self._seconds_until_next_harvest(),
+                )
+            await asyncio.sleep(delay)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Failed to refresh the {self.website_name} cookie: {e}")
+                await asyncio.sleep(COOKIE_REFRESH_RETRY_SECONDS)
+
+    def set_cookie(self, cookie, expires_at):
+        """Sets a freshly harvested cookie and saves it to disk"""
         self.cookie = cookie
+        self.expires_at = expires_at
+        if self._ready is not None and self._is_usable():
+            self._ready.set()
+        ttl_seconds = expires_at - time.time()
+        if ttl_seconds > 0:
+            COOKIE_JAR.set(
+                self.website_name,
+                {"cookie": cookie, "expires_at": expires_at},
+                ttl_seconds,
+            )
+
+    def load_from_disk(self) -> bool:
+        """Loads the saved cookie, returns False if there's none or it has expired"""
+        saved_cookie = COOKIE_JAR.get(self.website_name)
+        if saved_cookie is None:
+            return False
+        self.cookie = saved_cookie["cookie"]
+        self.expires_at = saved_cookie["expires_at"]
+        if self.is_expired():
+            self.cookie = None
+            self.expires_at = None
+            return False
+        if self._ready is not None:
+            self._ready.set()
+        logger.info(f"Loaded the saved {self.website_name} cookie")
+        return True
+
+
+class IshtariCookie(WebsiteCookie):
+    website_name = "Ishtari"
+    harvest_cookie = staticmethod(get_ishtari_cookie_using_playwright)
 
     def get_api_token(self):
         # extracting the api_token parameter from the cookie, it's needed as a seperate auth header
@@ -36,9 +241,9 @@ class IshtariCookie:
             return None
 
 
-class AliexpressCookie:
-    def __init__(self, cookie):
-        self.cookie = cookie
+class AliexpressCookie(WebsiteCookie):
+    website_name = "AliExpress"
+    harvest_cookie = staticmethod(get_aliexpress_cookie_using_playwright)
 
 
 # Setting the cookies to be none at the start of the server
@@ -0,0 +1,30 @@
+import os
+import sys
+from bs4 import BeautifulSoup, SoupStrainer
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.logger import logger
+
+# lxml is a lot faster than python's html.parser on the big search pages. We fall back to html.parser if it
+# isn't installed, and HTML_PARSER in the .env can force either one
+try:
+    import lxml  # noqa: F401
+
+    _DEFAULT_HTML_PARSER = "lxml"
+except ImportError:
+    _DEFAULT_HTML_PARSER = "html.parser"
+
+HTML_PARSER = os.getenv("HTML_PARSER", "").strip() or _DEFAULT_HTML_PARSER
+
+logger.debug(f"Using the {HTML_PARSER} parser for the search pages")
+
+
+def parse_html(html: str, parse_only: SoupStrainer = None) -> BeautifulSoup:
+    """Builds the soup of a page. With parse_only, only the tags matched by the strainer (and everything
+    inside them) end up in the tree, the rest of the page is skipped while parsing"""
+    return BeautifulSoup(html, HTML_PARSER, parse_only=parse_only)
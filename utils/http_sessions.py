@@ -0,0 +1,50 @@
+import os
+import sys
+from http.cookiejar import DefaultCookiePolicy
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.logger import logger
+
+# Every request to a website (and through ScraperAPI) gets this timeout in seconds, for connecting and for
+# each read. It has to stay under WEBSITE_FETCH_DEADLINE_SECONDS: the deadline only cancels the coroutine,
+# the worker thread running the request keeps going until the request returns or times out
+WEBSITE_REQUEST_TIMEOUT_SECONDS = float(
+    os.getenv("WEBSITE_REQUEST_TIMEOUT_SECONDS", "70")
+)
+
+
+def create_pooled_session(
+    name: str, default_pool_maxsize: int = 10
+) -> requests.Session:
+    """A long lived session that keeps its connections open (keep-alive) so that the next request to the
+    same host skips the TCP and TLS handshakes. The pool size is read from <NAME>_HTTP_POOL_MAXSIZE, it
+    should be at least the number of requests sent at the same time through the session, otherwise the
+    extra connections are closed after each request.
+
+    The session is shared by worker threads (the requests run in asyncio.to_thread), so it doesn't store
+    any cookies: we send the website cookies ourselves in the Cookie header, and a shared cookie jar would
+    leak the cookies of one keyword into the next"""
+    pool_maxsize = int(
+        os.getenv(f"{name.upper()}_HTTP_POOL_MAXSIZE", default_pool_maxsize)
+    )
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    logger.debug(f"Created the {name} session with {pool_maxsize} pooled connections")
+    return session
+
+
+# One session per website, shared by every keyword and job
+WEBSITE_SESSIONS = {
+    "AliExpress": create_pooled_session("AliExpress"),
+    "Ishtari": create_pooled_session("Ishtari"),
+}
@@ -0,0 +1,173 @@
+import asyncio
+import os
+import sys
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+load_dotenv()
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.logger import logger
+
+# How many product fetch jobs run at the same time. They all write to the same spreadsheet, so more
+# than one worker only makes sense if the jobs don't share a sheet
+PRODUCT_FETCH_WORKERS = int(os.getenv("PRODUCT_FETCH_WORKERS", "1"))
+
+# How many jobs can wait for a worker, the triggers beyond that are turned down
+MAX_QUEUED_PRODUCT_FETCHES = int(os.getenv("MAX_QUEUED_PRODUCT_FETCHES", "10"))
+
+
+class ProductFetchJob:
+    """A product fetch requested through /trigger_product_fetch, with its progress"""
+
+    def __init__(self, keywords: List[str], bypass_cache: bool, result_depth: int):
+        # random, so two triggers in the same second don't get the same ID
+        self.job_id = str(uuid.uuid4())
+        self.keywords = keywords
+        self.bypass_cache = bypass_cache
+        self.result_depth = result_depth
+        # queued -> running -> finished, failed or cancelled
+        self.state = "queued"
+        self.cancel_requested = False
+        self.submitted_at = time.time()
+        # set by the job once its keywords are filtered, and counted up as they're written to the sheet
+        self.keywords_total = len(keywords)
+        self.keywords_done = 0
+
+    def status(self, queue_position: Optional[int] = None) -> dict:
+        return {
+            "state": self.state,
+            "running": self.state == "running",
+            "cancelled": self.cancel_requested,
+            "queue_position": queue_position,
+            "keywords_total": self.keywords_total,
+            "keywords_done": self.keywords_done,
+            "submitted_at": self.submitted_at,
+        }
+
+
+class ProductFetchJobManager:
+    """Runs the product fetch jobs from a bounded FIFO queue with a fixed pool of workers, so a burst
+    of triggers is worked through at a steady pace instead of starting a task per trigger.
+
+    Only the queued and running jobs are kept, a job is forgotten once it's done"""
+
+    def __init__(
+        self,
+        run_job: Callable[[ProductFetchJob], Awaitable[bool]],
+        number_of_workers: int = PRODUCT_FETCH_WORKERS,
+        max_queued_jobs: int = MAX_QUEUED_PRODUCT_FETCHES,
+    ):
+        self.run_job = run_job
+        self.number_of_workers = max(number_of_workers, 1)
+        self.max_queued_jobs = max(max_queued_jobs, 1)
+        # job ID -> job, in submission order
+        self._jobs: Dict[str, ProductFetchJob] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    def start(self):
+        if self._workers:
+            return
+        # created here so that the queue belongs to the running event loop
+        self._queue = asyncio.Queue(maxsize=self.max_queued_jobs)
+        self._workers = [
+            asyncio.create_task(self._work()) for _ in range(self.number_of_workers)
+        ]
+        logger.info(
+            f"Started {self.number_of_workers} product fetch workers, up to {self.max_queued_jobs} jobs can wait"
+        )
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        self._jobs = {}
+
+    def submit(
+        self, keywords: List[str], bypass_cache: bool = False, result_depth: int = 10
+    ) -> ProductFetchJob:
+        self.start()
+        job = ProductFetchJob(keywords, bypass_cache, result_depth)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            logger.warning(
+                f"Turned down a product fetch, {self.max_queued_jobs} jobs are already waiting"
+            )
+            raise HTTPException(
+                status_code=429,
+                detail="Too many product fetches are waiting, try again later",
+            )
+        self._jobs[job.job_id] = job
+        logger.info(f"Queued job {job.job_id} with {len(keywords)} keywords")
+        return job
+
+    def cancel(self, job_id: Optional[str] = None) -> ProductFetchJob:
+        """Cancels the given job, or the most recently submitted one. A running job stops after the
+        keywords it's fetching, a queued one is skipped"""
+        if job_id is None and self._jobs:
+            job_id = list(self._jobs.keys())[-1]
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise HTTPException(
+                status_code=404, detail="No active product fetch to cancel"
+            )
+
+        job.cancel_requested = True
+        if job.state == "queued":
+            # the worker drops it when its turn comes
+            job.state = "cancelled"
+            del self._jobs[job_id]
+        logger.info(f"Cancelling job {job_id}")
+        return job
+
+    def status(self) -> dict:
+        """The queued and running jobs by job ID, empty when there's nothing to do"""
+        statuses = {}
+        queue_position = 0
+        for job in self._jobs.values():
+            if job.state == "queued":
+                queue_position += 1
+                statuses[job.job_id] = job.status(queue_position)
+            else:
+                statuses[job.job_id] = job.status()
+        return statuses
+
+    async def _work(self):
+        queue = self._queue
+        while True:
+            job = await queue.get()
+            try:
+                if job.cancel_requested:
+                    logger.info(f"Skipping job {job.job_id}, it was cancelled")
+                    continue
+
+                job.state = "running"
+                logger.info(
+                    f"Running job {job.job_id} after {time.time() - job.submitted_at:.1f} seconds in the queue"
+                )
+                try:
+                    finished = await self.run_job(job)
+                except Exception as e:
+                    logger.exception(f"Job {job.job_id} failed: {e}")
+                    finished = False
+
+                if finished:
+                    job.state = "finished"
+                elif job.cancel_requested:
+                    job.state = "cancelled"
+                else:
+                    job.state = "failed"
+                logger.info(f"Job {job.job_id} is {job.state}")
+            finally:
+                # Cleanup. Without this the server could run out of memory over time
+                self._jobs.pop(job.job_id, None)
+                queue.task_done()
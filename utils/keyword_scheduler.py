@@ -0,0 +1,65 @@
+import asyncio
+import os
+import sys
+from typing import Awaitable, Callable, List
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.logger import logger
+
+# How many keywords of a job are fetched at the same time. The per-website limits in
+# utils/rate_limiting.py still apply on top of this
+MAX_CONCURRENT_KEYWORDS = int(os.getenv("MAX_CONCURRENT_KEYWORDS", "3"))
+
+# How often we check for a cancellation request while waiting on a keyword
+CANCELLATION_CHECK_INTERVAL_SECONDS = 0.5
+
+
+async def process_keywords_in_order(
+    keywords: List[str],
+    fetch_keyword_products: Callable[[str, int], Awaitable],
+    write_keyword_products: Callable[[object, int, str], None],
+    is_cancelled: Callable[[], bool],
+    max_concurrent_keywords: int = MAX_CONCURRENT_KEYWORDS,
+) -> bool:
+    """Fetches the products of several keywords at once (at most max_concurrent_keywords at a time)
+    while still writing them in keyword order, so the product groups end up in the spreadsheet in the
+    same order as the keywords in the User Input sheet. fetch_keyword_products receives the keyword
+    and its 1-based product order ID, write_keyword_products the fetched products, the product order ID
+    and the keyword.
+    Returns False if the job was cancelled before all the keywords were written"""
+    semaphore = asyncio.Semaphore(max(max_concurrent_keywords, 1))
+
+    async def fetch_with_limit(keyword, product_order_id):
+        async with semaphore:
+            if is_cancelled():
+                return None
+            return await fetch_keyword_products(keyword, product_order_id)
+
+    tasks = [
+        asyncio.create_task(fetch_with_limit(keyword, product_order_id))
+        for product_order_id, keyword in enumerate(keywords, start=1)
+    ]
+    try:
+        for product_order_id, (keyword, task) in enumerate(zip(keywords, tasks)):
+            # waiting on the keyword in short steps so that a cancellation doesn't have to wait for it
+            while not task.done():
+                if is_cancelled():
+                    return False
+                await asyncio.wait({task}, timeout=CANCELLATION_CHECK_INTERVAL_SECONDS)
+            if is_cancelled():
+                return False
+
+            logger.info(f"This is the product ID: {product_order_id+1}")
+            write_keyword_products(task.result(), product_order_id + 1, keyword)
+        return True
+    finally:
+        # Cleanup, the remaining keywords are not needed anymore if we returned early
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
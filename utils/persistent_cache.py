@@ -0,0 +1,114 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.logger import logger
+
+# Where the caches are stored on disk, relative paths are from the project root
+CACHE_DIRECTORY = os.path.join(
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..")),
+    os.getenv("CACHE_DIRECTORY", ".cache"),
+)
+
+
+class PersistentLRUCache:
+    """A small key/value cache stored in a local SQLite file so that it survives server restarts.
+    Values are anything json serializable. Every entry has its own TTL, and once the cache holds more
+    than max_entries the least recently used entries are evicted.
+
+    SQLite calls on a local file take well under a millisecond, so it's used directly from the event loop
+    """
+
+    def __init__(self, path: str, max_entries: int = 5000, table: str = "cache"):
+        self.path = path
+        self.max_entries = max_entries
+        self.table = table
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # the same connection is shared by the event loop and the worker threads, the lock serializes them
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(f"""CREATE TABLE IF NOT EXISTS {table} (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_accessed_at REAL NOT NULL
+                )""")
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_last_accessed_at ON {table} (last_accessed_at)"
+            )
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the cached value, or None if it's missing or expired"""
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at <= now:
+                self._connection.execute(
+                    f"DELETE FROM {self.table} WHERE key = ?", (key,)
+                )
+                return None
+            self._connection.execute(
+                f"UPDATE {self.table} SET last_accessed_at = ? WHERE key = ?",
+                (now, key),
+            )
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, ttl_seconds: float):
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                f"""INSERT INTO {self.table} (key, value, expires_at, last_accessed_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at,
+                last_accessed_at = excluded.last_accessed_at""",
+                (key, json.dumps(value), now + ttl_seconds, now),
+            )
+            self._evict(now)
+
+    def delete(self, key: str):
+        with self._lock, self._connection:
+            self._connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute(f"DELETE FROM {self.table}")
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                f"SELECT COUNT(*) FROM {self.table}"
+            ).fetchone()[0]
+
+    def _evict(self, now: float):
+        """Drops the expired entries, then the least recently used ones above max_entries. Expects the lock"""
+        self._connection.execute(
+            f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,)
+        )
+        number_of_entries = self._connection.execute(
+            f"SELECT COUNT(*) FROM {self.table}"
+        ).fetchone()[0]
+        if number_of_entries > self.max_entries:
+            logger.debug(
+                f"Evicting {number_of_entries - self.max_entries} entries from the {self.table} cache"
+            )
+            self._connection.execute(
+                f"""DELETE FROM {self.table} WHERE key IN (
+                    SELECT key FROM {self.table} ORDER BY last_accessed_at ASC LIMIT ?
+                )""",
+                (number_of_entries - self.max_entries,),
+            )
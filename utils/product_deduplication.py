@@ -0,0 +1,146 @@
+import os
+import re
+import sys
+import zlib
+from typing import FrozenSet, List, Optional
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.similarity_calculation import preprocess_text
+
+# Two titles are the same listing if about this share of their 3 character pieces are the same
+# (the Jaccard similarity of their shingles), and they have the same numbers and model names (see
+# model_tokens). 1 would only collapse identical titles
+DUPLICATE_TITLE_SIMILARITY = float(os.getenv("DUPLICATE_TITLE_SIMILARITY", "0.8"))
+
+# The MinHash signature of a title has NUMBER_OF_PERMUTATIONS values, cut in LSH_BANDS bands. Two titles
+# are only compared if one of their bands is the same, with 16 bands of 4 values titles that are 80%
+# similar are compared 99.9% of the time and the rest of the titles almost never
+NUMBER_OF_PERMUTATIONS = 64
+LSH_BANDS = 16
+SHINGLE_SIZE = 3
+
+# the hashes are computed modulo this prime, small enough for the products to fit in 64 bits
+_MERSENNE_PRIME = (1 << 31) - 1
+# fixed so that the same titles always get the same signatures
+_random_generator = np.random.default_rng(20241101)
+_HASH_MULTIPLIERS = _random_generator.integers(
+    1, _MERSENNE_PRIME, NUMBER_OF_PERMUTATIONS, dtype=np.uint64
+)
+_HASH_OFFSETS = _random_generator.integers(
+    0, _MERSENNE_PRIME, NUMBER_OF_PERMUTATIONS, dtype=np.uint64
+)
+
+PRICE_PATTERN = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+
+def normalize_title(title: str) -> str:
+    # same cleanup as the similarity scores, and the extra spaces don't make two titles different
+    return " ".join(preprocess_text(title).split())
+
+
+def model_tokens(title: str) -> FrozenSet[str]:
+    """The words of a normalized title that contain a digit, like the model or the size. Two titles that
+    differ only there are different products ("iphone 13 case" and "iphone 14 case", "size 42" and
+    "size 44") even though most of their shingles are the same"""
+    return frozenset(
+        word for word in title.split() if any(char.isdigit() for char in word)
+    )
+
+
+def parse_price(price: str) -> Optional[float]:
+    """The amount in a price like 'US $1,299.99', None if there is none (the placeholders have 'US')"""
+    match = PRICE_PATTERN.search(price or "")
+    if match is None:
+        return None
+    return float(match.group().replace(",", ""))
+
+
+def _shingle_hashes(title: str) -> List[int]:
+    if len(title) <= SHINGLE_SIZE:
+        shingles = {title}
+    else:
+        shingles = {
+            title[i : i + SHINGLE_SIZE] for i in range(len(title) - SHINGLE_SIZE + 1)
+        }
+    return [zlib.crc32(shingle.encode()) % _MERSENNE_PRIME for shingle in shingles]
+
+
+def minhash_signatures(titles: List[str]) -> np.ndarray:
+    """The MinHash signatures of the normalized titles, one row per title. The minimums of all the titles
+    are taken at once with np.minimum.reduceat"""
+    shingle_hashes = [_shingle_hashes(title) for title in titles]
+    if not shingle_hashes:
+        return np.zeros((0, NUMBER_OF_PERMUTATIONS), dtype=np.uint64)
+    offsets = np.cumsum([0] + [len(hashes) for hashes in shingle_hashes[:-1]])
+    all_hashes = np.fromiter(
+        (h for hashes in shingle_hashes for h in hashes), dtype=np.uint64
+    )
+    permuted_hashes = (
+        _HASH_MULTIPLIERS[:, None] * all_hashes[None, :] + _HASH_OFFSETS[:, None]
+    ) % _MERSENNE_PRIME
+    return np.minimum.reduceat(permuted_hashes, offsets, axis=1).T
+
+
+class NearDuplicateIndex:
+    """Groups titles that are near-duplicates of each other with locality-sensitive hashing. Every
+    group is represented by the signature of its first title, and a new title is only compared to the
+    groups that share one of its LSH bands, so indexing n titles takes about n steps.
+
+        index = NearDuplicateIndex()
+        group_id = index.find(signature, model_tokens(title))  # None if the title is new
+    """
+
+    def __init__(
+        self,
+        similarity_threshold: float = DUPLICATE_TITLE_SIMILARITY,
+        bands: int = LSH_BANDS,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.bands = bands
+        self._rows_per_band = NUMBER_OF_PERMUTATIONS // bands
+        self._buckets = {}
+        self._signatures = []
+        self._model_tokens = []
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            start = band * self._rows_per_band
+            yield band, signature[start : start + self._rows_per_band].tobytes()
+
+    def find(
+        self, signature: np.ndarray, tokens: FrozenSet[str] = frozenset()
+    ) -> Optional[int]:
+        """The group of the most similar indexed title above the threshold with the same model tokens,
+        or None"""
+        candidates = set()
+        for band_key in self._band_keys(signature):
+            candidates.update(self._buckets.get(band_key, ()))
+        best_group, best_similarity = None, self.similarity_threshold
+        for group_id in sorted(candidates):
+            if self._model_tokens[group_id] != tokens:
+                continue
+            # the share of equal values estimates the Jaccard similarity of the two titles
+            similarity = np.mean(self._signatures[group_id] == signature)
+            if similarity >= best_similarity:
+                best_group, best_similarity = group_id, similarity
+        return best_group
+
+    def add(self, signature: np.ndarray, tokens: FrozenSet[str] = frozenset()) -> int:
+        group_id = len(self._signatures)
+        self._signatures.append(signature)
+        self._model_tokens.append(tokens)
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, []).append(group_id)
+        return group_id
+
+
+def is_cheaper(price: str, other_price: str) -> bool:
+    """A price we can't read is never cheaper than another one"""
+    amount, other_amount = parse_price(price), parse_price(other_price)
+    return amount is not None and (other_amount is None or amount < other_amount)
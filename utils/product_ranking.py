@@ -0,0 +1,188 @@
+import heapq
+import itertools
+import os
+import sys
+from typing import List
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.logger import logger
+from utils.similarity_calculation import score_keywords_against_products
+from utils.product_deduplication import (
+    NearDuplicateIndex,
+    is_cheaper,
+    minhash_signatures,
+    model_tokens,
+    normalize_title,
+)
+from models.products import OutputFetchedProducts, ProductBatch
+
+# How many products of a keyword are written to the sheet, the best ones across all the websites
+TOP_K_PRODUCTS_PER_KEYWORD = int(os.getenv("TOP_K_PRODUCTS_PER_KEYWORD", "30"))
+
+
+def is_no_matched_products(products: OutputFetchedProducts) -> bool:
+    """The placeholder a website returns when it has nothing for the keyword, or no products at all"""
+    return not products.product_names or products.product_names[0].startswith(
+        "No matched products from"
+    )
+
+
+class TopKProductRanker:
+    """Keeps the k products of a keyword that are the most similar to it, across all the websites.
+    The products of a website are scored as soon as they arrive with add(), and only the best k are held
+    in a min-heap, so the product group stays the same size however many websites and pages we fetch.
+
+    With deduplicate, near-duplicate titles (the same listing on several websites, or several times on
+    AliExpress) are collapsed before scoring, see utils/product_deduplication.py. Only the cheapest offer
+    of a listing is kept, a cheaper copy arriving later replaces the one in the heap.
+
+    Products with the same score keep the website order (AliExpress, Ishtari, HiCart, the website_rank
+    given to add()) and their order within the website, so the result doesn't depend on which website
+    answered first"""
+
+    def __init__(
+        self,
+        keyword: str,
+        k: int = TOP_K_PRODUCTS_PER_KEYWORD,
+        deduplicate: bool = True,
+    ):
+        self.keyword = keyword
+        self.k = k
+        # (score, -website_rank, -index, -entry_id, product, group_id), the root is the first to drop
+        self._heap = []
+        self._entry_ids = itertools.count()
+        # entries replaced by a cheaper copy, they are dropped from the heap when they reach the root
+        self._replaced_entry_ids = set()
+        self._number_of_kept_products = 0
+        self._duplicate_index = NearDuplicateIndex() if deduplicate else None
+        # group id -> cheapest price seen, and the entry id of that offer while it's in the heap
+        self._cheapest_prices = {}
+        self._kept_entry_ids = {}
+        # placeholders are only written if no website found anything
+        self._no_matched_products = []
+
+    def _new_offers(self, products: List[tuple]) -> List[tuple]:
+        """The (index, product, group_id) of the products that are not a copy of a cheaper product
+        seen before. A cheaper copy takes the place of the previous offer"""
+        if self._duplicate_index is None:
+            return [(index, product, None) for index, product in enumerate(products)]
+
+        # the copies within the batch are collapsed first, into the cheapest of them at the position of
+        # the first one
+        titles = [normalize_title(product[0]) for product in products]
+        batch_offers = {}
+        for index, (product, title, signature) in enumerate(
+            zip(products, titles, minhash_signatures(titles))
+        ):
+            tokens = model_tokens(title)
+            group_id = self._duplicate_index.find(signature, tokens) if title else None
+            if group_id is None:
+                group_id = self._duplicate_index.add(signature, tokens)
+            if group_id not in batch_offers:
+                batch_offers[group_id] = (index, product)
+            elif is_cheaper(product[2], batch_offers[group_id][1][2]):
+                batch_offers[group_id] = (batch_offers[group_id][0], product)
+
+        # then against the offers of the earlier batches
+        new_offers = []
+        for group_id, (index, product) in batch_offers.items():
+            if group_id in self._cheapest_prices:
+                if not is_cheaper(product[2], self._cheapest_prices[group_id]):
+                    continue
+                replaced_entry_id = self._kept_entry_ids.pop(group_id, None)
+                if replaced_entry_id is not None:
+                    self._replaced_entry_ids.add(replaced_entry_id)
+                    self._number_of_kept_products -= 1
+            self._cheapest_prices[group_id] = product[2]
+            new_offers.append((index, product, group_id))
+        return new_offers
+
+    def _drop_replaced_entries(self):
+        while self._heap and -self._heap[0][3] in self._replaced_entry_ids:
+            self._replaced_entry_ids.discard(-heapq.heappop(self._heap)[3])
+
+    def _keep(self, entry):
+        self._drop_replaced_entries()
+        if self._number_of_kept_products < self.k:
+            heapq.heappush(self._heap, entry)
+            self._number_of_kept_products += 1
+        elif self._heap and entry[:4] > self._heap[0][:4]:
+            dropped_entry = heapq.heapreplace(self._heap, entry)
+            self._kept_entry_ids.pop(dropped_entry[5], None)
+        else:
+            return
+        if entry[5] is not None:
+            self._kept_entry_ids[entry[5]] = -entry[3]
+
+    def add(self, products: OutputFetchedProducts, website_rank: int = 0):
+        if is_no_matched_products(products):
+            self._no_matched_products.append((website_rank, products))
+            return
+
+        new_offers = self._new_offers(
+            list(
+                zip(
+                    products.product_names,
+                    products.product_urls,
+                    products.product_prices,
+                    products.website_source,
+                )
+            )
+        )
+        scores = score_keywords_against_products(
+            [self.keyword], [product[0] for _, product, _ in new_offers]
+        )[0].tolist()
+        for score, (index, product, group_id) in zip(scores, new_offers):
+            self._keep(
+                (
+                    score,
+                    -website_rank,
+                    -index,
+                    -next(self._entry_ids),
+                    product,
+                    group_id,
+                )
+            )
+        logger.debug(
+            f"Ranked {len(new_offers)} of {len(products.product_names)} products for {self.keyword} (the others are copies), keeping {self._number_of_kept_products}"
+        )
+
+    def has_products(self) -> bool:
+        return self._number_of_kept_products > 0
+
+    def ranked_products(self) -> ProductBatch:
+        """The kept products from the most to the least similar, with their similarity scores"""
+        entries = sorted(
+            (
+                entry
+                for entry in self._heap
+                if -entry[3] not in self._replaced_entry_ids
+            ),
+            key=lambda entry: entry[:4],
+            reverse=True,
+        )
+        if not entries:
+            # nothing was found, the placeholders of the websites in website order
+            ranked = ProductBatch([], [], [], [])
+            for _, products in sorted(
+                self._no_matched_products, key=lambda placeholder: placeholder[0]
+            ):
+                ranked = ranked.concatenate(
+                    ProductBatch.from_fetched_products(products)
+                )
+            return ranked
+
+        names, urls, prices, sources = zip(*(entry[4] for entry in entries))
+        return ProductBatch(
+            list(names),
+            list(urls),
+            list(prices),
+            list(sources),
+            similarity_scores=[entry[0] for entry in entries],
+            validate=False,
+        )
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import sys
+import time
+from typing import Awaitable
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.logger import logger
+
+
+class TokenBucket:
+    """Async token bucket. Tokens are refilled continuously at `rate` per second up to `capacity`,
+    and every acquire() takes one token, waiting for the refill if the bucket is empty. A rate of 0
+    (or less) disables the limit"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        # waiters are served one at a time and in arrival order
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._last_refill) * self.rate
+        )
+        self._last_refill = now
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class WebsiteLimiter:
+    """Caps the number of in-flight requests to a website and paces them with a token bucket.
+    Every request we send to the website goes through run():
+
+        response = await WEBSITE_LIMITERS["Ishtari"].run(asyncio.to_thread(session.get, url))
+
+    It can also be used as an async context manager around the request"""
+
+    def __init__(
+        self,
+        website_name: str,
+        max_concurrent_requests: int,
+        requests_per_second: float,
+    ):
+        self.website_name = website_name
+        self._semaphore = asyncio.Semaphore(max(max_concurrent_requests, 1))
+        self._token_bucket = TokenBucket(
+            rate=requests_per_second, capacity=max_concurrent_requests
+        )
+
+    @classmethod
+    def from_env(
+        cls,
+        website_name: str,
+        default_max_concurrent_requests: int,
+        default_requests_per_second: float,
+    ) -> "WebsiteLimiter":
+        """Reads <WEBSITE>_MAX_CONCURRENT_REQUESTS and <WEBSITE>_REQUESTS_PER_SECOND from the
+        environment, for example ISHTARI_MAX_CONCURRENT_REQUESTS"""
+        prefix = website_name.upper()
+        max_concurrent_requests = int(
+            os.getenv(
+                f"{prefix}_MAX_CONCURRENT_REQUESTS", default_max_concurrent_requests
+            )
+        )
+        requests_per_second = float(
+            os.getenv(f"{prefix}_REQUESTS_PER_SECOND", default_requests_per_second)
+        )
+        logger.debug(
+            f"{website_name} limits: {max_concurrent_requests} concurrent requests, {requests_per_second} requests per second"
+        )
+        return cls(website_name, max_concurrent_requests, requests_per_second)
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        try:
+            await self._token_bucket.acquire()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._semaphore.release()
+
+    async def run(self, request: Awaitable):
+        """Awaits the request under the limiter. When the caller is cancelled (the website deadline), the
+        request is left to finish and keeps its slot until then: its worker thread is still talking to
+        the website, so a website that hangs never has more than max_concurrent_requests requests in flight
+        """
+        try:
+            await self.__aenter__()
+        except BaseException:
+            # never started, this avoids the "was never awaited" warning
+            close = getattr(request, "close", None)
+            if close:
+                close()
+            raise
+        request_task = asyncio.ensure_future(request)
+        request_task.add_done_callback(self._release)
+        return await asyncio.shield(request_task)
+
+    def _release(self, request_task: asyncio.Future):
+        self._semaphore.release()
+        if not request_task.cancelled():
+            # retrieved here in case the caller is gone, otherwise asyncio logs it as never retrieved
+            request_task.exception()
+
+
+# One limiter per website, shared by every keyword and job running in this process
+WEBSITE_LIMITERS = {
+    "AliExpress": WebsiteLimiter.from_env("AliExpress", 2, 1),
+    "Ishtari": WebsiteLimiter.from_env("Ishtari", 3, 2),
+    "HiCart": WebsiteLimiter.from_env("HiCart", 2, 1),
+}
@@ -1,151 +1,602 @@
+import asyncio
 import sys
 import os
+import threading
+import time
+from typing import Union
 
 # Get the parent directory of the current file and add it to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 
-from models.products import InputFetchedProducts
+from models.products import InputFetchedProducts, ProductBatch
 from utils.logger import logger
-from utils.similarity_calculation import analyze_product_similarities
+from utils.similarity_calculation import (
+    analyze_product_similarities,
+    format_similarity_score,
+)
 
 import gspread
 from google.oauth2.service_account import Credentials
 from fastapi import HTTPException
 
 
-def _get_google_sheet_workbook():
+def _authorize_google_sheets_client() -> gspread.Client:
     scopes = ["https://www.googleapis.com/auth/spreadsheets"]
     creds = Credentials.from_service_account_file("credentials.json", scopes=scopes)
-    client = gspread.authorize(creds)
+    # gspread sends its requests through an AuthorizedSession, which keeps the HTTP connections alive
+    # between calls and only refreshes the access token when it's about to expire
+    return gspread.authorize(creds)
 
-    # get this from the url of the google sheet. It's between the /d/ and the /edit
-    sheet_id = os.getenv("GOOGLE_SHEET_ID")
-    workbook = client.open_by_key(sheet_id)
 
-    return workbook
+class GoogleSheetClient:
+    """Process-wide Google Sheets client. The credentials, the gspread client, the workbook and the
+    worksheet handles are created once and reused by every keyword and job, instead of re-authorizing
+    and re-fetching the spreadsheet metadata on every sheet update"""
 
+    def __init__(self, client_factory=_authorize_google_sheets_client):
+        self._client_factory = client_factory
+        # the sheet functions are also called from worker threads
+        self._lock = threading.Lock()
+        self._workbook = None
+        self._worksheets = {}
 
-def update_spreadsheet_with_fetched_products(
-    input_product_data: InputFetchedProducts, product_order_id, keyword
+    def workbook(self) -> gspread.Spreadsheet:
+        with self._lock:
+            if self._workbook is None:
+                logger.info("Authorizing the Google Sheets client")
+                client = self._client_factory()
+                # get this from the url of the google sheet. It's between the /d/ and the /edit
+                sheet_id = os.getenv("GOOGLE_SHEET_ID")
+                self._workbook = client.open_by_key(sheet_id)
+            return self._workbook
+
+    def worksheet(self, title: str) -> gspread.Worksheet:
+        workbook = self.workbook()
+        with self._lock:
+            if title not in self._worksheets:
+                self._worksheets[title] = workbook.worksheet(title)
+            return self._worksheets[title]
+
+    def refresh_worksheet(self, title: str) -> gspread.Worksheet:
+        """Fetches the worksheet metadata again (like its grid size) and caches the new handle"""
+        workbook = self.workbook()
+        worksheet = workbook.worksheet(title)
+        with self._lock:
+            self._worksheets[title] = worksheet
+        return worksheet
+
+    def reset(self):
+        """Drops the cached handles, used after a failed update in case they went stale (for example
+        when a worksheet was renamed). The next call authorizes again"""
+        with self._lock:
+            self._workbook = None
+            self._worksheets = {}
+
+
+GOOGLE_SHEET_CLIENT = GoogleSheetClient()
+
+
+def _get_google_sheet_workbook():
+    return GOOGLE_SHEET_CLIENT.workbook()
+
+
+# normalizing the rgb values of white smoke to between 0 and 1 because that's how the Sheets API accepts them
+WHITE_SMOKE_RGB = 230 / 255
+NUMBER_OF_PRODUCT_COLUMNS = 5  # From A to E
+
+
+def _grid_range(
+    sheet_id, start_row, end_row, start_col=0, end_col=NUMBER_OF_PRODUCT_COLUMNS
 ):
-    try:
-        workbook = _get_google_sheet_workbook()
-        sheet1 = workbook.worksheet("User Input")
-        sheet2 = workbook.worksheet("Product Recommendations")
+    """GridRange of the Sheets API from 1-based inclusive rows (like in A1 notation) and 0-based
+    half-open columns"""
+    return {
+        "sheetId": sheet_id,
+        "startRowIndex": start_row - 1,
+        "endRowIndex": end_row,
+        "startColumnIndex": start_col,
+        "endColumnIndex": end_col,
+    }
+
+
+def _string_cell(value, cell_format):
+    cell = {"userEnteredFormat": cell_format}
+    if value:  # empty cells are left without a value
+        cell["userEnteredValue"] = {"stringValue": str(value)}
+    return cell
+
+
+def _hyperlink_cell(url, cell_format):
+    cell = {"userEnteredFormat": cell_format}
+    if url:
+        escaped_url = url.replace('"', '""')
+        cell["userEnteredValue"] = {
+            "formulaValue": f'=HYPERLINK("{escaped_url}", "{escaped_url}")'
+        }
+    return cell
+
+
+def _product_group_requests(sheet_id, start_row, rows):
+    """batchUpdate requests that write a product group (the keyword row followed by the product rows)
+    starting at start_row, together with its formatting, the merge of the keyword row and the URLs as
+    HYPERLINK formulas"""
+    keyword_row_format = {
+        "backgroundColor": {
+            "red": WHITE_SMOKE_RGB,
+            "green": WHITE_SMOKE_RGB,
+            "blue": WHITE_SMOKE_RGB,
+        },
+        "horizontalAlignment": "CENTER",
+        "textFormat": {"bold": True},
+    }
+    product_format = {
+        "backgroundColor": {"red": 1.0, "green": 1.0, "blue": 1.0},
+        "textFormat": {"bold": False},
+    }
+    url_format = dict(product_format, hyperlinkDisplayType="LINKED")
+
+    row_data = [
+        {"values": [_string_cell(value, keyword_row_format) for value in rows[0]]}
+    ]
+    for name, price, url, source, similarity in rows[1:]:
+        row_data.append(
+            {
+                "values": [
+                    _string_cell(name, product_format),
+                    _string_cell(price, product_format),
+                    _hyperlink_cell(url, url_format),  # the URLs go in column C
+                    _string_cell(source, product_format),
+                    _string_cell(similarity, product_format),
+                ]
+            }
+        )
+
+    end_row = start_row + len(rows) - 1
+    keyword_name_range = _grid_range(sheet_id, start_row, start_row)
+    return [
+        {
+            "updateCells": {
+                "range": _grid_range(sheet_id, start_row, end_row),
+                "rows": row_data,
+                "fields": "userEnteredValue,userEnteredFormat(backgroundColor,textFormat,horizontalAlignment,hyperlinkDisplayType)",
+            }
+        },
+        {
+            # to give the keyword name rows a better look
+            "mergeCells": {"range": keyword_name_range, "mergeType": "MERGE_ROWS"}
+        },
+    ]
 
+
+def _status_cell_request(sheet_id, row, status, background_color):
+    """batchUpdate request that writes a status message in column B of the User Input sheet"""
+    return {
+        "updateCells": {
+            "range": _grid_range(sheet_id, row, row, start_col=1, end_col=2),
+            "rows": [
+                {
+                    "values": [
+                        {
+                            "userEnteredValue": {"stringValue": status},
+                            "userEnteredFormat": {"backgroundColor": background_color},
+                        }
+                    ]
+                }
+            ],
+            "fields": "userEnteredValue,userEnteredFormat.backgroundColor",
+        }
+    }
+
+
+def _set_row_count(worksheet: gspread.Worksheet, row_count: int):
+    # gspread keeps the grid size of a worksheet locally and updates it itself when it adds or deletes rows.
+    # We change the grid size through our own batchUpdate requests, so we keep the cached handle in sync
+    worksheet._properties["gridProperties"]["rowCount"] = row_count
+
+
+def _keyword_group_rows(
+    input_product_data: Union[InputFetchedProducts, ProductBatch], keyword
+):
+    """The rows of a keyword group: the name of the keyword on top, then one row per product"""
+    if not isinstance(input_product_data, ProductBatch):
+        input_product_data = ProductBatch.from_fetched_products(input_product_data)
+
+    rows = [(f"Products for keyword: {keyword}", "", "", "", "")]
+    # the ranked products already come with their scores
+    if input_product_data.similarity_scores is not None:
+        rows += [
+            (name, price, url, source, format_similarity_score(score))
+            for name, price, url, source, score in input_product_data.iter_rows()
+        ]
+    else:
         keyword_sim = analyze_product_similarities(
             keyword, input_product_data.product_names
         )
-
-        # adding the name of the keyword of each product group on top of it
-        values = [
-            [f"Products for keyword: {keyword}"] + input_product_data.product_names,
-            [""] + input_product_data.product_prices,
-            [""] + input_product_data.product_urls,
-            [""] + input_product_data.website_source,
-            [""] + keyword_sim,
+        rows += [
+            (name, price, url, source, similarity)
+            for (name, price, url, source, _), similarity in zip(
+                input_product_data.iter_rows(), keyword_sim
+            )
         ]
-        transposed_values = list(zip(*values))
-        # print("Transposed values: ", transposed_values)
+    return rows
 
-        # getting the number of rows in sheet2 so far
-        current_number_of_rows = len(sheet2.col_values(1))
-        num_of_products_to_update = (
-            len(input_product_data.product_names) + 1
-        )  # The +1 is because we are adding the name of the keyword on top of each product group
 
-        if product_order_id == 1 and current_number_of_rows > 1:
-            sheet2.delete_rows(
-                2, current_number_of_rows
-            )  # clearing the cells from previous calls
-            current_number_of_rows = (
-                1  # setting this manually instead of fetching using gspread
-            )
+def _keyword_group_requests(
+    sheet1, sheet2, rows, product_order_id, last_used_row, row_count
+):
+    """batchUpdate requests for one keyword group written right after last_used_row of sheet2, including
+    the rows that have to be added to the grid and the status cell of the keyword in sheet1.
+    Returns the requests, the new last used row and the new number of rows of the grid
+    """
+    requests = []
+
+    # to add an empty row between products for different keywords
+    add_line_between = 1 if product_order_id > 1 else 0
+    start_row = last_used_row + 1 + add_line_between
+    end_row = start_row + len(rows) - 1
 
-        # Ensure enough rows are available to accommodate new data. The .update method can't update non-existant rows
-        required_rows = current_number_of_rows + num_of_products_to_update
-        if required_rows > sheet2.row_count:
-            sheet2.add_rows(required_rows - sheet2.row_count)  # Add missing rows
+    # Ensure enough rows are available to accommodate new data. Cells can't be written to non-existant rows
+    if end_row > row_count:
+        requests.append(
+            {
+                "appendDimension": {
+                    "sheetId": sheet2.id,
+                    "dimension": "ROWS",
+                    "length": end_row - row_count,
+                }
+            }
+        )
+        row_count = end_row
 
-        # to add an empty row between products for different keywords
-        add_line_between = 1 if product_order_id > 1 else 0
-        start_row = current_number_of_rows + 1 + add_line_between
-        end_row = len(transposed_values) + 1 + current_number_of_rows + add_line_between
+    requests += _product_group_requests(sheet2.id, start_row, rows)
 
-        # From A to E because we have 5 columns to fill with values
-        sheet2.update(
-            range_name=f"A{start_row}:E{end_row}",
-            values=transposed_values,
+    # Updating the status cell for this particular keyword in sheet 1
+    requests.append(
+        _status_cell_request(
+            sheet1.id,
+            product_order_id + 1,
+            "Fetched Products Successfully",
+            {"green": 1.0},
         )
+    )
+    return requests, end_row, row_count
 
-        # batching the format operations to save api calls and time
-        white_smoke_rgb = (
-            230 / 255
-        )  # normalizing the rgb values of white smoke to between 0 and 1 because that's how the format method accepts them
-        products_range = f"A{start_row}:E{end_row}"
-        keyword_name_range = f"A{start_row}:E{start_row}"
-        url_range = f"C{start_row + 1}:C{end_row}"  # Skip the keyword row
 
-        formats = [
-            {
-                "range": products_range,
-                "format": {
-                    "textFormat": {
-                        "bold": False,
-                    },
-                    "backgroundColor": {"red": 1.0, "green": 1.0, "blue": 1.0},
-                },
-            },
-            {
-                "range": keyword_name_range,
-                "format": {
-                    "backgroundColor": {
-                        "green": white_smoke_rgb,
-                        "red": white_smoke_rgb,
-                        "blue": white_smoke_rgb,
-                    },
-                    "horizontalAlignment": "CENTER",
-                    "textFormat": {"bold": True},
+def _send_batch_update(requests):
+    try:
+        GOOGLE_SHEET_CLIENT.workbook().batch_update({"requests": requests})
+    except Exception as e:
+        logger.error(f"Something went wrong while updating the sheet: {e}")
+        GOOGLE_SHEET_CLIENT.reset()
+        raise HTTPException(500, f"Something went wrong while updating the sheet: {e}")
+
+
+# A job's write buffer is flushed once it holds this many keyword groups, or when this many seconds
+# passed since its last flush
+SHEET_FLUSH_MAX_GROUPS = int(os.getenv("SHEET_FLUSH_MAX_GROUPS", "5"))
+SHEET_FLUSH_INTERVAL_SECONDS = float(os.getenv("SHEET_FLUSH_INTERVAL_SECONDS", "5"))
+
+
+class SheetWriteBuffer:
+    """Write-behind buffer owned by a product fetch job. It keeps the row cursor of the Product
+    Recommendations sheet in memory instead of reading the sheet before every keyword, collects the
+    finished keyword groups and sends them in a single batchUpdate once enough of them are pending or
+    enough time has passed. flush() has to be called once more at the end of the job.
+
+    The first write of a job clears the results of the previous job, so the sheet is only read once
+    per job (to refresh its grid size) and never during the run.
+
+    With reserve_keyword_blocks(), every keyword gets a fixed block of rows up front, and the products
+    of a keyword can be written to its block as soon as some of the websites answered with
+    add_partial_products(), while the slower websites are still being fetched. Partial writes of the same
+    keyword replace each other in the buffer, only the latest one is sent.
+
+    In a job, start_flusher() flushes the buffer every flush_interval_seconds from a background task, with
+    the batchUpdate sent from a worker thread so the event loop isn't blocked, and close() sends what's
+    left at the end"""
+
+    def __init__(
+        self,
+        max_pending_groups: int = SHEET_FLUSH_MAX_GROUPS,
+        flush_interval_seconds: float = SHEET_FLUSH_INTERVAL_SECONDS,
+    ):
+        self.max_pending_groups = max_pending_groups
+        self.flush_interval_seconds = flush_interval_seconds
+        self._last_used_row = 1  # the header row
+        self._row_count = None  # the grid size of the sheet, known after _start()
+        self._requests = []
+        self._pending_groups = 0
+        self._last_flush_time = time.monotonic()
+        # product order ID -> (first row, number of rows) of the keyword's block
+        self._reserved_blocks = {}
+        # product order ID -> requests of the latest partial write of the keyword
+        self._partial_writes = {}
+        # the buffer is filled from the event loop and flushed from a worker thread
+        self._lock = threading.Lock()
+        # one flush at a time, so the batchUpdates reach the sheet in order
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+        self._flush_requested = None
+        self._closing = False
+
+    def _start(self):
+        sheet2 = GOOGLE_SHEET_CLIENT.refresh_worksheet("Product Recommendations")
+        self._row_count = sheet2.row_count
+        if self._row_count > 1:
+            # clearing the values, formats and merges from previous calls. The rows are cleared and not
+            # deleted because the sheet doesn't allow deleting all the non-frozen rows
+            previous_results_range = _grid_range(sheet2.id, 2, self._row_count)
+            requests = [
+                {"unmergeCells": {"range": previous_results_range}},
+                {
+                    "updateCells": {
+                        "range": previous_results_range,
+                        "fields": "userEnteredValue,userEnteredFormat",
+                    }
                 },
-            },
+            ]
+            with self._lock:
+                self._requests += requests
+
+    def reserve_keyword_blocks(
+        self, number_of_keywords: int, products_per_keyword: int
+    ):
+        """Sets aside a block of rows for each keyword of the job (its keyword row and up to
+        products_per_keyword product rows), in keyword order and one empty row apart"""
+        if self._row_count is None:
+            self._start()
+        for product_order_id in range(1, number_of_keywords + 1):
+            # to add an empty row between products for different keywords
+            add_line_between = 1 if product_order_id > 1 else 0
+            start_row = self._last_used_row + 1 + add_line_between
+            self._reserved_blocks[product_order_id] = (
+                start_row,
+                products_per_keyword + 1,
+            )
+            self._last_used_row = start_row + products_per_keyword
+
+        # Ensure enough rows are available to accommodate new data. Cells can't be written to non-existant rows
+        sheet2 = GOOGLE_SHEET_CLIENT.worksheet("Product Recommendations")
+        requests = []
+        if self._last_used_row > self._row_count:
+            requests.append(
+                {
+                    "appendDimension": {
+                        "sheetId": sheet2.id,
+                        "dimension": "ROWS",
+                        "length": self._last_used_row - self._row_count,
+                    }
+                }
+            )
+            self._row_count = self._last_used_row
+
+        # to give the keyword name rows a better look
+        requests += [
             {
-                "range": url_range,
-                "format": {
-                    "backgroundColor": {
-                        "green": 1.0,
-                        "red": 1.0,
-                        "blue": 1.0,
-                    },
-                    "hyperlinkDisplayType": "LINKED",
-                    "textFormat": {"bold": False},
-                },
-            },
+                "mergeCells": {
+                    "range": _grid_range(sheet2.id, start_row, start_row),
+                    "mergeType": "MERGE_ROWS",
+                }
+            }
+            for start_row, _ in self._reserved_blocks.values()
         ]
-        sheet2.batch_format(formats=formats)
-        sheet2.merge_cells(
-            name=keyword_name_range, merge_type="merge_rows"
-        )  # to give the keyword name rows a better look
-
-        # Update the URLs with hyperlink formulas
-        hyperlinked_updates = []
-        for _, row in enumerate(
-            transposed_values[1:], start=start_row + 1
-        ):  # Skip header row
-            if row[2]:  # Check if URL exists in column C (index 2)
-                url = row[2]
-                hyperlinked_updates.append([f'=HYPERLINK("{url}", "{url}")'])
-
-        update_range = f"C{start_row + 1}:C{start_row + len(hyperlinked_updates)}"
-        sheet2.update(update_range, hyperlinked_updates, raw=False)
-
-        # Updating the status cell for this particular keyword in sheet 1
-        sheet1.update_acell(f"B{product_order_id+1}", "Fetched Products Successfully")
-        sheet1.format(
-            f"B{product_order_id+1}", format={"backgroundColor": {"green": 1.0}}
+        with self._lock:
+            self._requests += requests
+
+    def _reserved_block_requests(self, input_product_data, product_order_id, keyword):
+        """Requests writing the products to the keyword's block. The rows of the block below the
+        products are emptied, they may hold the products of an earlier partial write"""
+        start_row, number_of_rows = self._reserved_blocks[product_order_id]
+        rows = _keyword_group_rows(input_product_data, keyword)
+        if len(rows) > number_of_rows:
+            logger.warning(
+                f"{len(rows) - 1} products for {keyword} don't fit in its {number_of_rows - 1} rows"
+            )
+            rows = rows[:number_of_rows]
+        rows += [("", "", "", "", "")] * (number_of_rows - len(rows))
+
+        sheet2 = GOOGLE_SHEET_CLIENT.worksheet("Product Recommendations")
+        # the keyword row was merged when the block was reserved, only the cells are written
+        return [
+            request
+            for request in _product_group_requests(sheet2.id, start_row, rows)
+            if "mergeCells" not in request
+        ]
+
+    def add_partial_products(
+        self, input_product_data: ProductBatch, product_order_id, keyword
+    ):
+        """Writes the products found so far for a keyword to its reserved block, they are replaced by
+        the next partial write or by add_product_group()"""
+        requests = self._reserved_block_requests(
+            input_product_data, product_order_id, keyword
+        )
+        with self._lock:
+            self._partial_writes[product_order_id] = requests
+        self._flush_if_due()
+
+    def add_product_group(
+        self,
+        input_product_data: Union[InputFetchedProducts, ProductBatch],
+        product_order_id,
+        keyword,
+    ):
+        if self._row_count is None:
+            self._start()
+        sheet1 = GOOGLE_SHEET_CLIENT.worksheet("User Input")
+        sheet2 = GOOGLE_SHEET_CLIENT.worksheet("Product Recommendations")
+
+        if product_order_id in self._reserved_blocks:
+            requests = self._reserved_block_requests(
+                input_product_data, product_order_id, keyword
+            )
+            # Updating the status cell for this particular keyword in sheet 1
+            requests.append(
+                _status_cell_request(
+                    sheet1.id,
+                    product_order_id + 1,
+                    "Fetched Products Successfully",
+                    {"green": 1.0},
+                )
+            )
+        else:
+            requests, self._last_used_row, self._row_count = _keyword_group_requests(
+                sheet1,
+                sheet2,
+                _keyword_group_rows(input_product_data, keyword),
+                product_order_id,
+                self._last_used_row,
+                self._row_count,
+            )
+        with self._lock:
+            self._partial_writes.pop(product_order_id, None)
+            self._requests += requests
+            self._pending_groups += 1
+        self._flush_if_due()
+
+    def _flush_if_due(self):
+        if (
+            self._pending_groups >= self.max_pending_groups
+            or time.monotonic() - self._last_flush_time >= self.flush_interval_seconds
+        ):
+            if self._flusher is not None:
+                # sent by the flusher task, off the event loop
+                self._flush_requested.set()
+            else:
+                self.flush()
+
+    def start_flusher(self):
+        """Starts flushing the buffer in the background, has to be called from the event loop"""
+        self._flush_requested = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(
+                    self._flush_requested.wait(),
+                    timeout=max(self.flush_interval_seconds, 0.1),
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            if self._closing:
+                break
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                # anything gspread or the connection throws, the flusher keeps going for the rest of the job
+                logger.error(
+                    f"Couldn't write the buffer to the sheet, retrying with the next flush: {e}"
+                )
+
+    async def close(self):
+        """Stops the flusher and sends what's left in the buffer"""
+        if self._flusher is not None:
+            # stopped with a flag rather than cancelled, so it can't be interrupted in the middle of a flush
+            self._closing = True
+            self._flush_requested.set()
+            await self._flusher
+            self._flusher = None
+        await asyncio.to_thread(self.flush)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                requests = self._requests
+                partial_writes = self._partial_writes
+                pending_groups = self._pending_groups
+                if not requests and not partial_writes:
+                    return
+                self._requests = []
+                self._partial_writes = {}
+                self._pending_groups = 0
+                self._last_flush_time = time.monotonic()
+            logger.info(
+                f"Writing {pending_groups} keyword groups and {len(partial_writes)} partial groups to the sheet"
+            )
+
+            try:
+                _send_batch_update(
+                    requests
+                    + [
+                        request
+                        for partial_requests in partial_writes.values()
+                        for request in partial_requests
+                    ]
+                )
+            except HTTPException:
+                # The finished groups, and the clearing, the new rows and the merges queued before them,
+                # are sent again with the next flush. The partial writes are only a preview, they're dropped
+                with self._lock:
+                    self._requests = requests + self._requests
+                    self._pending_groups += pending_groups
+                raise
+            _set_row_count(
+                GOOGLE_SHEET_CLIENT.worksheet("Product Recommendations"),
+                self._row_count,
+            )
+
+
+def update_spreadsheet_with_fetched_products(
+    input_product_data: Union[InputFetchedProducts, ProductBatch],
+    product_order_id,
+    keyword,
+    sheet_buffer: SheetWriteBuffer = None,
+):
+    """Writes the product group of a keyword to the Product Recommendations sheet and marks the keyword
+    as done in the User Input sheet. When a job's sheet_buffer is given, the group is only queued in it.
+    Otherwise the next free row is read from the sheet and clearing the previous results, adding the
+    missing rows, the values, the formatting, the merge, the hyperlinks and the status cell are all sent
+    in a single batchUpdate"""
+    try:
+        if sheet_buffer is not None:
+            sheet_buffer.add_product_group(
+                input_product_data, product_order_id, keyword
+            )
+            return
+
+        sheet1 = GOOGLE_SHEET_CLIENT.worksheet("User Input")
+        sheet2 = GOOGLE_SHEET_CLIENT.worksheet("Product Recommendations")
+
+        # getting the number of rows in sheet2 so far
+        current_number_of_rows = len(sheet2.col_values(1))
+        row_count = sheet2.row_count
+        requests = []
+
+        if product_order_id == 1 and current_number_of_rows > 1:
+            # clearing the cells from previous calls
+            requests.append(
+                {
+                    "deleteDimension": {
+                        "range": {
+                            "sheetId": sheet2.id,
+                            "dimension": "ROWS",
+                            "startIndex": 1,
+                            "endIndex": current_number_of_rows,
+                        }
+                    }
+                }
+            )
+            row_count -= current_number_of_rows - 1
+            current_number_of_rows = 1
+
+        group_requests, _, row_count = _keyword_group_requests(
+            sheet1,
+            sheet2,
+            _keyword_group_rows(input_product_data, keyword),
+            product_order_id,
+            current_number_of_rows,
+            row_count,
         )
+        _send_batch_update(requests + group_requests)
+        _set_row_count(sheet2, row_count)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Something went wrong while updating the sheet: {e}")
+        GOOGLE_SHEET_CLIENT.reset()
         raise HTTPException(500, f"Something went wrong while updating the sheet: {e}")
 
 
@@ -162,8 +613,7 @@ def update_spreadsheet_with_fetched_products(
 
 def signal_start_of_product_retrieval():
     try:
-        workbook = _get_google_sheet_workbook()
-        sheet1 = workbook.worksheet("User Input")
+        sheet1 = GOOGLE_SHEET_CLIENT.worksheet("User Input")
 
         # deleting the previous output messages in col B, sheet1 to write new ones
         current_number_of_rows_sheet1 = len(
@@ -199,17 +649,18 @@ def signal_start_of_product_retrieval():
         logger.error(
             f"Something went wrong with updating the B status cells in sheet 1: {e}"
         )
+        GOOGLE_SHEET_CLIENT.reset()
         return False
 
 
 def signal_end_of_product_retrieval():
     try:
-        workbook = _get_google_sheet_workbook()
-        sheet1 = workbook.worksheet("User Input")
+        sheet1 = GOOGLE_SHEET_CLIENT.worksheet("User Input")
         sheet1.update_acell("C2", "Retrieved the Products, See Sheet 2 and Sheet 3")
         return True
     except Exception as e:
         logger.error(
             f"Something went wrong with updating the C2 status cell in sheet 1: {e}"
         )
+        GOOGLE_SHEET_CLIENT.reset()
         return False
@@ -1,4 +1,5 @@
 import re
+import numpy as np
 
 
 def preprocess_text(text):
@@ -8,59 +9,104 @@ def preprocess_text(text):
     return text
 
 
+def score_keywords_against_products(keywords, products) -> np.ndarray:
+    """The similarity score (from 0 to 1) of every product title for every keyword, as a
+    (keywords, products) array. The titles are tokenized once for all the keywords, and the base, phrase
+    and position scores below are computed for all the pairs at once with numpy instead of one title at a
+    time. This way we can score full catalog pages or past runs against many keywords.
+
+    The scores are exactly the ones of the per title computation (down to the last bit, the position
+    scores are summed in title order with np.add.at). This similarity focuses on the search keywords and
+    gives them a higher score if they:
+    - appear earlier in the product name
+    - contain an exact match of the search keyword(s) as the entire sequence
+    - and if they are present as seperate words in the product name (how many keywords are in the title)
+    """
+    proc_keywords = [preprocess_text(keyword) for keyword in keywords]
+    proc_products = [preprocess_text(product) for product in products]
+    keywords_words = [keyword.split() for keyword in proc_keywords]
+    products_words = [product.split() for product in proc_products]
+
+    # a keyword or a title without any word can't be scored, same error as dividing by their length
+    if products and any(len(words) == 0 for words in keywords_words):
+        raise ZeroDivisionError("A keyword has no words to compare")
+    if keywords and any(len(words) == 0 for words in products_words):
+        raise ZeroDivisionError("A product title has no words to compare")
+
+    # only the words found in the keywords matter, each of them gets a column
+    vocabulary = {}
+    for words in keywords_words:
+        for word in words:
+            vocabulary.setdefault(word, len(vocabulary))
+
+    # how many times each word is in each keyword, a repeated keyword word counts twice in the base score
+    keyword_word_counts = np.zeros((len(keywords), len(vocabulary)))
+    for k, words in enumerate(keywords_words):
+        for word in words:
+            keyword_word_counts[k, vocabulary[word]] += 1
+    keyword_lengths = np.array([len(words) for words in keywords_words], dtype=float)
+
+    # the keyword words found in the titles, with the title they're in and their position in it
+    token_products, token_positions, token_words = [], [], []
+    for p, words in enumerate(products_words):
+        for i, word in enumerate(words):
+            word_id = vocabulary.get(word)
+            if word_id is not None:
+                token_products.append(p)
+                token_positions.append(i)
+                token_words.append(word_id)
+    token_products = np.array(token_products, dtype=np.intp)
+    token_positions = np.array(token_positions, dtype=np.intp)
+    token_words = np.array(token_words, dtype=np.intp)
+    product_lengths = np.array([len(words) for words in products_words], dtype=float)
+
+    # simple keyword presence, = (number of matched words) / (number of search keyword words)
+    title_has_word = np.zeros((len(products), len(vocabulary)))
+    title_has_word[token_products, token_words] = 1
+    matched_words = keyword_word_counts @ title_has_word.T
+    base_scores = matched_words / keyword_lengths[:, None]
+
+    # Check for exact phrase match, if so we assign a 50% bonus. for ex: if the keyword phrase is
+    # 'black shoes', the score gets a 50% bonus if 'black shoes' exists as it is in the product name
+    # this helps to differentiate (for example) between 'black shoes' and 'black shirt with shoes'.
+    # A title without any of the keyword words scores 0 anyway, so only the other ones are checked
+    phrase_bonuses = np.ones((len(keywords), len(products)))
+    for k, p in zip(*np.nonzero(matched_words)):
+        if proc_keywords[k] in proc_products[p]:
+            phrase_bonuses[k, p] = 1.5
+
+    # Position bonus - keywords appearing earlier get higher weight. The score is 1/position for each,
+    # this way if the words of 'black shoes' appear earlier in the product's name, the score would be
+    # higher. This creates a smooth decay in the score as the keywords appear later in the title.
+    # np.nonzero goes through the tokens in title order, so the sums are done in the same order as a loop
+    keyword_has_word = keyword_word_counts > 0
+    matched_keywords, matched_tokens = np.nonzero(keyword_has_word[:, token_words])
+    position_scores = np.zeros((len(keywords), len(products)))
+    np.add.at(
+        position_scores,
+        (matched_keywords, token_products[matched_tokens]),
+        1 / (token_positions[matched_tokens] + 1),
+    )
+
+    # The (1 + (position_score/len(product_words))) is to consider the position score as a residual percentage.
+    # like a 20% increase would mean a multiplication 1.2. The division by 1.5 is to get a full 1 score when the
+    # keyword is exact match and normalize the rest of the possible scores accordingly. See the end for more details.
+    final_scores = (
+        base_scores * phrase_bonuses * (1 + (position_scores / product_lengths))
+    ) / 1.5
+    # clipping values above 1 to get the final scores as percentages
+    return np.minimum(final_scores, 1.0)
+
+
+def format_similarity_score(score: float) -> str:
+    # python's round on a python float, np.round rounds some halves differently
+    return "%" + str(round(score, 3) * 100)  # as percentage
+
+
 def analyze_product_similarities(keyword, products):
-    """Compare different similarity metrics for products"""
-    # Preprocess keyword and products
-    proc_keyword = preprocess_text(keyword)
-    proc_products = [preprocess_text(p) for p in products]
-
-    # Calculate weighted keyword presence
-    def keyword_presence(product):
-        """This similarity focuses on the search keywords and gives them a higher
-        score if they:
-        - appear earlier in the product name
-        - contain an exact match of the search keyword(s) as the entire sequence
-        - and if they are present as seperate words in the product name (how many keywords are in the title)
-        """
-
-        keyword_words = proc_keyword.split()
-        product_words = product.split()
-
-        # simple keyword presence, = (number of matched words) / (number of search keyword words)
-        base_score = sum(1 for w in keyword_words if w in product_words) / len(
-            keyword_words
-        )
-
-        # Check for exact phrase match, if so we assign a 50% bonus. for ex: if the keyword phrase is
-        # 'black shoes', the score gets a 50% bonus if 'black shoes' exists as it is in the product name
-        # this helps to differentiate (for example) between 'black shoes' and 'black shirt with shoes'.
-        phrase_bonus = 1.5 if proc_keyword in product else 1.0
-
-        # Position bonus - keywords appearing earlier get higher weight. The score is 1/position for each,
-        # this way if the words of 'black shoes' appear earlier in the product's name, the score would be
-        # higher. This creates a smooth decay in the score as the keywords appear later in the title.
-        position_score = 0
-        for i, word in enumerate(product_words):
-            if word in keyword_words:
-                position_score += 1 / (i + 1)
-        # print(f"this is the base score for {proc_keyword}: {base_score}")
-        # print(f"this is the phrase score for {proc_keyword}: {phrase_bonus}")
-        # print(f"this is the position_score score for {proc_keyword}: {position_score}")
-
-        # The (1 + (position_score/len(product_words))) is to consider the position score as a residual percentage.
-        # like a 20% increase would mean a multiplication 1.2. The division by 1.5 is to get a full 1 score when the
-        # keyword is exact match and normalize the rest of the possible scores accordingly. See the end for more details.
-        final_score = (
-            base_score * phrase_bonus * (1 + (position_score / len(product_words)))
-        ) / 1.5
-        # clipping values above 1 to get the final_score as a percentage
-        if final_score > 1:
-            final_score = 1.0
-
-        return "%" + str(round(final_score, 3) * 100)  # as percentage
-
-    keyword_scores = [keyword_presence(prod) for prod in proc_products]
-    return keyword_scores
+    """Compare different similarity metrics for products, see score_keywords_against_products"""
+    keyword_scores = score_keywords_against_products([keyword], products)[0]
+    return [format_similarity_score(score) for score in keyword_scores.tolist()]
 
 
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
 import sys
 import os
+import asyncio
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,17 +18,61 @@ from utils.logger import logger
 from playwright.async_api import async_playwright
 from time import time
 
-
-async def get_aliexpress_cookie_using_playwright():
-    start_time = time()
-    logger.info("Fetching the AliExpress Cookie using Playwright")
-    async with async_playwright() as p:
-        # Launch chrome browser
-
-        browser = await p.chromium.launch(headless=True)
-
+# Longest we trust a harvested cookie jar for, session cookies have no expiry of their own
+COOKIE_MAX_AGE_SECONDS = float(os.getenv("COOKIE_MAX_AGE_SECONDS", "43200"))
+# Same setting as in api_utils.py, read here as well since api_utils imports this module
+COOKIE_EXPIRY_MARGIN_SECONDS = float(os.getenv("COOKIE_EXPIRY_MARGIN_SECONDS", "300"))
+
+
+def _cookie_jar_expiry(cookies, required_cookie_names=None) -> float:
+    """The timestamp at which the first of the cookies expires (playwright gives -1 for session cookies),
+    capped to COOKIE_MAX_AGE_SECONDS from now. Only the required_cookie_names count when given, and
+    short lived cookies (analytics and the like, expiring within COOKIE_EXPIRY_MARGIN_SECONDS) are
+    ignored, otherwise they would mark a freshly harvested jar as expired"""
+    now = time()
+    expires_at = now + COOKIE_MAX_AGE_SECONDS
+    for cookie in cookies:
+        if required_cookie_names and cookie["name"] not in required_cookie_names:
+            continue
+        if cookie.get("expires", -1) > now + COOKIE_EXPIRY_MARGIN_SECONDS:
+            expires_at = min(expires_at, cookie["expires"])
+    return expires_at
+
+
+class SharedBrowser:
+    """One Playwright runtime and Chromium process for the whole server. Every cookie harvest opens its own
+    isolated context (separate cookies and storage) in it, so the harvests can run at the same time and a
+    refresh doesn't pay for launching the browser again. Closed in the lifespan teardown of main.py
+    """
+
+    def __init__(self):
+        self._playwright = None
+        self._browser = None
+        self._loop = None
+        self._lock = None
+
+    async def get_browser(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # the browser belongs to the event loop it was launched in (the tests run one loop per test)
+            self._playwright = None
+            self._browser = None
+            self._lock = asyncio.Lock()
+            self._loop = loop
+
+        async with self._lock:
+            if self._browser is None or not self._browser.is_connected():
+                start_time = time()
+                if self._playwright is None:
+                    self._playwright = await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch(headless=True)
+                logger.info(f"Launching the browser took: {time()-start_time}")
+            return self._browser
+
+    async def new_context(self):
+        browser = await self.get_browser()
         # Even though I'm setting the location to be US it's not working
-        context = await browser.new_context(
+        return await browser.new_context(
             geolocation={
                 "latitude": 37.7749,
                 "longitude": -122.4194,
@@ -36,6 +81,25 @@ async def get_aliexpress_cookie_using_playwright():
             timezone_id="America/Los_Angeles",  # U.S. Pacific Timezone
         )
 
+    async def close(self):
+        if self._browser is not None:
+            await self._browser.close()
+        if self._playwright is not None:
+            await self._playwright.stop()
+        self._browser = None
+        self._playwright = None
+        logger.info("Closed the browser")
+
+
+SHARED_BROWSER = SharedBrowser()
+
+
+async def get_aliexpress_cookie_using_playwright():
+    """Returns the AliExpress cookie header and the timestamp at which it expires"""
+    start_time = time()
+    logger.info("Fetching the AliExpress Cookie using Playwright")
+    context = await SHARED_BROWSER.new_context()
+    try:
         # Open a new page
         page = await context.new_page()
 
@@ -43,54 +107,43 @@ async def get_aliexpress_cookie_using_playwright():
         await page.goto("https://aliexpress.com", timeout=300000)  # in millisecond
 
         cookie_for_requests = await context.cookies("https://aliexpress.com")
-
-        # Close the browser
-        await browser.close()
-
-        print("Process finished")
-        cookie = ""
-        for item in cookie_for_requests:
-
-            cookie = cookie + f"{item['name']}={item['value']}; "
-
-        # changing the language from Arabic to English and changing the location to the US/international
-        cookie = (
-            cookie.strip()[:-1]
-            .replace("region=LB&site=ara", "site=glo&province=&city=")
-            .replace("aep_usuc_f=site=ara", "aep_usuc_f=site=glo&province=&city=")
-            .replace("x_locale=ar_MA", "x_locale=en_US")
-            .replace("intl_locale=ar_MA", "intl_locale=en_US")
-            .replace("b_locale=ar_MA", "b_locale=en_US")
-            .replace("c_tp=LBP", "c_tp=USD")
-            .replace(
-                "site=glo&c_tp=SGD&region=SG",
-                "site=glo&province=&city=&c_tp=USD&region=LB",
-            )  # this is because playwright is picking up on Singapore when deployed on render
-        )
-        logger.info(
-            f"Getting the AliExpress Cookie using Playwright took: {time()-start_time}"
-        )
-        return cookie
+    finally:
+        # Close the context, the browser stays open for the next harvest
+        await context.close()
+
+    logger.debug("Got the AliExpress cookies from the browser")
+    cookie = ""
+    for item in cookie_for_requests:
+
+        cookie = cookie + f"{item['name']}={item['value']}; "
+
+    # changing the language from Arabic to English and changing the location to the US/international
+    cookie = (
+        cookie.strip()[:-1]
+        .replace("region=LB&site=ara", "site=glo&province=&city=")
+        .replace("aep_usuc_f=site=ara", "aep_usuc_f=site=glo&province=&city=")
+        .replace("x_locale=ar_MA", "x_locale=en_US")
+        .replace("intl_locale=ar_MA", "intl_locale=en_US")
+        .replace("b_locale=ar_MA", "b_locale=en_US")
+        .replace("c_tp=LBP", "c_tp=USD")
+        .replace(
+            "site=glo&c_tp=SGD&region=SG",
+            "site=glo&province=&city=&c_tp=USD&region=LB",
+        )  # this is because playwright is picking up on Singapore when deployed on render
+    )
+    logger.info(
+        f"Getting the AliExpress Cookie using Playwright took: {time()-start_time}"
+    )
+    return cookie, _cookie_jar_expiry(cookie_for_requests)
 
 
 async def get_ishtari_cookie_using_playwright():
+    """Returns the Ishtari cookie header and the timestamp at which it expires"""
     start_time = time()
     logger.info("Fetching the Ishtari Cookie using Playwright")
-    async with async_playwright() as p:
-        # Launch chrome browser
-        browser = await p.chromium.launch(headless=True)
-
-        # Open a new browser context (isolated session).
-        # Even though I'm setting the location to be US, it's not working
-        context = await browser.new_context(
-            geolocation={
-                "latitude": 37.7749,
-                "longitude": -122.4194,
-            },  # San Francisco, USA
-            locale="en-US",  # English locale
-            timezone_id="America/Los_Angeles",  # U.S. Pacific Timezone
-        )
-
+    # an isolated session in the shared browser
+    context = await SHARED_BROWSER.new_context()
+    try:
         # Open a new page
         page = await context.new_page()
 
@@ -102,21 +155,22 @@ async def get_ishtari_cookie_using_playwright():
 
         cookie_for_requests = await context.cookies("https://www.ishtari.com")
         logger.debug(f"These are the cookies from Ishtari.com: {cookie_for_requests}")
-
-        # Close the browser
-        await browser.close()
-
-        logger.info("Process finished")
-        # same process as the AliExpress cookie
-        cookie = ""
-        for item in cookie_for_requests:
-            cookie = cookie + f"{item['name']}={item['value']}; "
-        cookie = cookie.strip()[:-1]
-        logger.info(
-            f"Getting the Ishtari cookie using Playwright took: {time()-start_time}"
-        )
-        logger.debug(f"This is the Ishtari cookie: {cookie}")
-        return cookie
+    finally:
+        # Close the context, the browser stays open for the next harvest
+        await context.close()
+
+    logger.info("Process finished")
+    # same process as the AliExpress cookie
+    cookie = ""
+    for item in cookie_for_requests:
+        cookie = cookie + f"{item['name']}={item['value']}; "
+    cookie = cookie.strip()[:-1]
+    logger.info(
+        f"Getting the Ishtari cookie using Playwright took: {time()-start_time}"
+    )
+    logger.debug(f"This is the Ishtari cookie: {cookie}")
+    # the API only needs the api-token
+    return cookie, _cookie_jar_expiry(cookie_for_requests, ("api-token",))
 
 
 # Run the Playwright function
@@ -1,10 +1,11 @@
-import requests
 import os
-from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
 import re
 import sys
+import json
 import asyncio
 import traceback
+from typing import Optional
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,12 +18,144 @@ USE_ROTATING_IPS_WITH_SCRAPERAPI = bool(
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from utils.logger import logger
-from utils.using_playwright import get_aliexpress_cookie_using_playwright
+from utils.html_parsing import parse_html
 
 from utils.api_utils import ALIEXPRESS_COOKIE
+from utils.rate_limiting import WEBSITE_LIMITERS
+from utils.http_sessions import WEBSITE_REQUEST_TIMEOUT_SECONDS, WEBSITE_SESSIONS
 from models.products import OutputFetchedProducts
 from using_scraper_api import get_request_using_scraperapi
 
+# keeps the connections to AliExpress open across keywords and jobs
+ALIEXPRESS_SESSION = WEBSITE_SESSIONS["AliExpress"]
+
+# The product cards on the search page, each one holds the title, url and price of a product
+PRODUCT_CARD_CLASS = re.compile(
+    r"multi--container--1UZxxHY cards--card--3PJxwBm (cards--list--2rmDt5R )?search-card-item"
+)
+PRODUCT_CARDS_ONLY = SoupStrainer("a", class_=PRODUCT_CARD_CLASS)
+
+
+# The search page carries its product list as json in a script tag, like:
+#   window._dida_config_._init_data_= { data: {"success":true,...,"data":{"root":{"fields":{"mods":{"itemList":{"content":[...]}}}}}} }
+EMBEDDED_DATA_MARKER = "window._dida_config_._init_data_"
+
+
+def _parse_aliexpress_embedded_data(html: str) -> Optional[OutputFetchedProducts]:
+    """Extracts the products from the json embedded in an AliExpress search page. Returns None if the page
+    doesn't have it or if its structure changed, so that we can fall back to the product cards
+    """
+    marker_index = html.find(EMBEDDED_DATA_MARKER)
+    if marker_index == -1:
+        logger.info("No embedded product data in the AliExpress page")
+        return None
+    # the json object starts at the first brace after 'data:'
+    data_index = html.find("data:", marker_index)
+    json_start_index = html.find("{", data_index)
+    if data_index == -1 or json_start_index == -1:
+        return None
+
+    try:
+        # raw_decode stops at the end of the object, so we don't have to find where the script ends
+        embedded_data, _ = json.JSONDecoder().raw_decode(html, json_start_index)
+        items = embedded_data["data"]["root"]["fields"]["mods"]["itemList"]["content"]
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Couldn't decode the embedded AliExpress product data: {e}")
+        return None
+
+    titles = []
+    product_urls = []
+    prices = []
+    for item in items:
+        try:
+            product_id = item["productId"]
+            title = item["title"]["displayTitle"]
+            price = item["prices"]["salePrice"]["formattedPrice"]
+        except (KeyError, TypeError):
+            # ads and other cards mixed in with the products
+            continue
+        titles.append(title.strip())
+        product_urls.append(f"https://www.aliexpress.com/item/{product_id}.html")
+        prices.append(price.strip())
+
+    if not titles:
+        return None
+    logger.info(f"found {len(titles)} products in the embedded AliExpress data")
+
+    return OutputFetchedProducts(
+        product_names=titles,
+        product_urls=product_urls,
+        product_prices=prices,
+        website_source=["AliExpress" for _ in range(len(titles))],
+    )
+
+
+def _parse_aliexpress_product_cards(html: str) -> OutputFetchedProducts:
+    """Extracts the product titles, urls and prices from the product cards of an AliExpress search page"""
+    # only the product cards are parsed into the tree, the rest of the page (scripts, header, footer...) is skipped
+    product_cards = parse_html(html, parse_only=PRODUCT_CARDS_ONLY).find_all(
+        "a", class_=PRODUCT_CARD_CLASS
+    )
+    logger.info(f"found {len(product_cards)} product cards")
+
+    titles = []
+    product_urls = []
+    prices = []
+    # taking the title, url and price from the same card keeps them aligned
+    for product_card in product_cards:
+        title = product_card.find("div", class_="multi--title--G7dOCj3")
+        price = product_card.find("div", class_="multi--price-sale--U-S0jtj")
+        if title is None or price is None or not product_card.get("href"):
+            logger.debug("Skipping an AliExpress product card without a title or price")
+            continue
+        titles.append(title.get_text(strip=True))
+        product_urls.append("https:" + product_card.get("href").strip())
+        prices.append(price.get_text(strip=True))
+        logger.debug(f"Title: {titles[-1]}, price: {prices[-1]}")
+
+    logger.info(f"found {len(titles)} products")
+
+    return OutputFetchedProducts(
+        product_names=titles,
+        product_urls=product_urls,
+        product_prices=prices,
+        website_source=["AliExpress" for _ in range(len(titles))],
+    )
+
+
+def _parse_aliexpress_search_page(html: str) -> OutputFetchedProducts:
+    """Extracts the product titles, urls and prices from the html of an AliExpress search page. The embedded
+    json is a single decode, the product cards are only parsed if it's missing"""
+    products = _parse_aliexpress_embedded_data(html)
+    if products is None:
+        products = _parse_aliexpress_product_cards(html)
+    return products
+
+
+async def _send_request(url, headers):
+    """Sends a GET to AliExpress under the website limiter, through ScraperAPI if it's enabled"""
+    if USE_ROTATING_IPS_WITH_SCRAPERAPI:
+        logger.debug("Sending the request using scraperapi.")
+        request = get_request_using_scraperapi(
+            url,
+            country_code="us",
+            headers=headers,
+            timeout=WEBSITE_REQUEST_TIMEOUT_SECONDS,
+        )
+    else:
+        # requests is blocking, running it in a worker thread keeps the event loop free for other tasks
+        request = asyncio.to_thread(
+            ALIEXPRESS_SESSION.get,
+            url,
+            headers=headers,
+            timeout=WEBSITE_REQUEST_TIMEOUT_SECONDS,
+        )
+    # the limiter caps the concurrent requests to AliExpress and paces them
+    response = await WEBSITE_LIMITERS["AliExpress"].run(request)
+    if USE_ROTATING_IPS_WITH_SCRAPERAPI:
+        logger.debug("Got the response using scraperapi.")
+    return response
+
 
 async def fetch_aliexpress_product_recommendations(
     search_keyword, AliExpress_Cookie_Object
@@ -30,20 +163,16 @@ async def fetch_aliexpress_product_recommendations(
 
     url = f"https://www.aliexpress.com/w/wholesale-{search_keyword}.html"  # ?spm=a2g0o.productlist.search.0"
 
-    if (
-        AliExpress_Cookie_Object.cookie is None
-    ):  # ALiExpress cookie has not been set yet, this statement is only entered at the first use of this fetch function
-        # fetch a new AliExpress cookie
-        AliExpress_Cookie_Object.cookie = await get_aliexpress_cookie_using_playwright()
-    else:
-        logger.info("AliExpress cookie is present, no need to fetch a new one")
+    # only harvests a new cookie if it has not been set yet or it has expired, and if a harvest is already
+    # running (another keyword or the background refresher) it waits for that one
+    aliexpress_cookie = await AliExpress_Cookie_Object.get_fresh_cookie()
 
     headers = {
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
         "Accept-Encoding": "gzip, deflate, br, zstd",
         "Accept-Language": "en-US,en;q=0.9",
         "Cache-Control": "max-age=0",
-        "Cookie": AliExpress_Cookie_Object.cookie,
+        "Cookie": aliexpress_cookie,
         "Priority": "u=0, i",
         "Origin": "https://www.aliexpress.com",
         "Referer": f"https://www.aliexpress.com/w/wholesale-{search_keyword}.html?spm=a2g0o.home.history.1.9d5f76dbxo1lT7",
@@ -58,71 +187,24 @@ async def fetch_aliexpress_product_recommendations(
         "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36",
     }
     try:
-        if USE_ROTATING_IPS_WITH_SCRAPERAPI:
-            logger.debug("Sending the request using scraperapi.")
-            response = get_request_using_scraperapi(
-                url, country_code="us", headers=headers, timeout=180
-            )
-            logger.debug(f"Got the response using scraperapi.")
-        else:
-            response = requests.request("GET", url, headers=headers, timeout=180)
+        response = await _send_request(url, headers)
 
         # Couldn't manage to make the Aliexpress cookie expire, but I've added the following statement just in case it expires
         # Check for expired cookie, in which case the response would be that the api request is unauthorized
         if response.status_code == 401:  # unauthorized
             logger.info("Cookie expired, fetching a new one.")
-            AliExpress_Cookie_Object.cookie = (
-                await get_aliexpress_cookie_using_playwright()
-            )
+            await AliExpress_Cookie_Object.refresh(rejected_cookie=headers["Cookie"])
 
             headers["Cookie"] = (
                 AliExpress_Cookie_Object.cookie
             )  # Update with new cookie
 
             # Retry the initial request with a new cookie
-            if USE_ROTATING_IPS_WITH_SCRAPERAPI:
-                response = get_request_using_scraperapi(
-                    url, country_code="us", headers=headers, timeout=180
-                )
-            else:
-                response = requests.request("GET", url, headers=headers, timeout=180)
+            response = await _send_request(url, headers)
 
         response.raise_for_status()  # to raise an exception when an exception happens, for debugging purposes. Without it, the response may be invalid and we wouldn't know immeadiately
 
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        # fetching the titles
-        titles = soup.find_all("div", class_="multi--title--G7dOCj3")
-        logger.info(f"found {len(titles)} titles")
-        for title in titles:
-            logger.debug(f"Title: {title.get_text(strip=True)}")
-
-        # fetching the urls for the individual products
-        product_urls = soup.find_all(
-            "a",
-            class_=re.compile(
-                r"multi--container--1UZxxHY cards--card--3PJxwBm (cards--list--2rmDt5R )?search-card-item"
-            ),
-        )
-
-        logger.info(f"found {len(product_urls)} product urls")
-        titles = [title.get_text(strip=True) for title in titles]
-        product_urls = [
-            ("https:" + product_url.get("href").strip()) for product_url in product_urls
-        ]
-
-        prices = soup.find_all("div", class_="multi--price-sale--U-S0jtj")
-        logger.info(f"Found {len(prices)} prices")
-        for price in prices:
-            logger.debug(f"These are the prices: {price.get_text(strip=True)}")
-        prices = [price.get_text(strip=True) for price in prices]
-
-        return OutputFetchedProducts(
-            product_names=list(titles),
-            product_urls=list(product_urls),
-            product_prices=list(prices),
-            website_source=["AliExpress" for _ in range(len(titles))],
-        )
+        return _parse_aliexpress_search_page(response.text)
     except Exception as e:
         logger.error(
             f"Something went wrong while fetching products from AliExpress: {e}\n{traceback.format_exc()}"
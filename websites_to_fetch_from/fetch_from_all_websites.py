@@ -0,0 +1,215 @@
+import os
+import sys
+import asyncio
+import traceback
+from typing import Awaitable, Callable, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Get the parent directory of the current file and add it to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.logger import logger
+from utils.persistent_cache import CACHE_DIRECTORY, PersistentLRUCache
+from utils.product_ranking import (
+    TOP_K_PRODUCTS_PER_KEYWORD,
+    TopKProductRanker,
+    is_no_matched_products,
+)
+from models.products import OutputFetchedProducts, ProductBatch
+from websites_to_fetch_from.aliexpress_api import (
+    fetch_aliexpress_product_recommendations,
+)
+from websites_to_fetch_from.ishtari_api import (
+    NUMBER_OF_PRODUCTS_PER_PAGE,
+    fetch_ishtari_product_recommendations,
+)
+from websites_to_fetch_from.hicart_api import fetch_hicart_product_recommendations
+
+# How long we wait for a single website before giving up on it for the current keyword. Every request
+# times out after WEBSITE_REQUEST_TIMEOUT_SECONDS (70 by default), so the default leaves room for the
+# AliExpress request and its retry with a new cookie
+WEBSITE_FETCH_DEADLINE_SECONDS = float(
+    os.getenv("WEBSITE_FETCH_DEADLINE_SECONDS", "190")
+)
+
+# Number of Ishtari products fetched per keyword when the job doesn't ask for a result_depth
+DEFAULT_RESULT_DEPTH = NUMBER_OF_PRODUCTS_PER_PAGE
+
+# How long the products fetched for a keyword are reused before we scrape the website again. Prices on
+# AliExpress move the most so it gets the shortest TTL
+PRODUCT_CACHE_TTL_SECONDS = {
+    "AliExpress": float(os.getenv("ALIEXPRESS_PRODUCT_CACHE_TTL_SECONDS", "21600")),
+    "Ishtari": float(os.getenv("ISHTARI_PRODUCT_CACHE_TTL_SECONDS", "43200")),
+    "HiCart": float(os.getenv("HICART_PRODUCT_CACHE_TTL_SECONDS", "86400")),
+}
+
+# One entry per website and keyword, shared by every job and kept across restarts
+PRODUCT_CACHE = PersistentLRUCache(
+    os.path.join(CACHE_DIRECTORY, "product_cache.sqlite3"),
+    max_entries=int(os.getenv("PRODUCT_CACHE_MAX_ENTRIES", "5000")),
+    table="products",
+)
+
+
+def _product_cache_key(
+    website_name: str, search_keyword: str, result_depth: Optional[int] = None
+) -> str:
+    # "Black  Shoes " and "black shoes" are the same search
+    cache_key = f"{website_name}:{' '.join(search_keyword.lower().split())}"
+    # a deeper fetch of the same keyword is a different entry
+    if result_depth is not None:
+        cache_key += f":{result_depth}"
+    return cache_key
+
+
+def _no_matched_products(website_name: str, website_url: str) -> OutputFetchedProducts:
+    """Same placeholder the fetchers return when they find nothing, used when a website times out
+    or fails so that its slot in the product group is still filled"""
+    return OutputFetchedProducts(
+        product_names=[f"No matched products from {website_name}.com"],
+        product_urls=[f"{website_url}/No-matched-products-from-{website_name}"],
+        product_prices=["US"],
+        website_source=[website_name],
+    )
+
+
+async def _fetch_with_deadline(
+    website_name: str, website_url: str, fetch_coroutine
+) -> Optional[OutputFetchedProducts]:
+    try:
+        return await asyncio.wait_for(
+            fetch_coroutine, timeout=WEBSITE_FETCH_DEADLINE_SECONDS
+        )
+    except asyncio.TimeoutError:
+        logger.error(
+            f"Fetching products from {website_name} took more than {WEBSITE_FETCH_DEADLINE_SECONDS} seconds, skipping it"
+        )
+    except Exception as e:
+        logger.error(
+            f"Something went wrong while fetching products from {website_name}: {e}\n{traceback.format_exc()}"
+        )
+    return None
+
+
+async def _fetch_website_products(
+    website_name: str,
+    website_url: str,
+    search_keyword: str,
+    fetch_products: Callable[[], Awaitable[OutputFetchedProducts]],
+    bypass_cache: bool = False,
+    result_depth: Optional[int] = None,
+    cookie_object=None,
+) -> OutputFetchedProducts:
+    """Returns the cached products of the website for this keyword if there are any, otherwise fetches
+    them (within the deadline) and caches them. With bypass_cache the website is always fetched, and the
+    fresh products replace the cached ones.
+
+    A website that needs a cookie (cookie_object) is only fetched once there's one, a job started right
+    after a restart or after a failed harvest waits for it here"""
+    cache_key = _product_cache_key(website_name, search_keyword, result_depth)
+    if not bypass_cache:
+        cached_products = PRODUCT_CACHE.get(cache_key)
+        if cached_products is not None:
+            logger.info(
+                f"Using the cached {website_name} products for: {search_keyword}"
+            )
+            # the products were validated when they were fetched, they're not checked again on every hit
+            return OutputFetchedProducts.model_construct(**cached_products)
+
+    if cookie_object is not None and not await cookie_object.wait_until_ready():
+        logger.error(f"Skipping {website_name} for {search_keyword}, it has no cookie")
+        return _no_matched_products(website_name, website_url)
+
+    products = await _fetch_with_deadline(website_name, website_url, fetch_products())
+
+    # The AliExpress fetcher returns None when it fails, the others return their own placeholders. Empty
+    # lists (a captcha page, or an Ishtari search without products) count as nothing found too
+    if products is None or not products.product_names:
+        return _no_matched_products(website_name, website_url)
+    # placeholders are not cached, the website might just be down right now
+    if not is_no_matched_products(products):
+        PRODUCT_CACHE.set(
+            cache_key, products.model_dump(), PRODUCT_CACHE_TTL_SECONDS[website_name]
+        )
+    return products
+
+
+async def fetch_products_from_all_websites(
+    search_keyword: str,
+    AliExpress_Cookie_Object,
+    Ishtari_Cookie_Object,
+    bypass_cache: bool = False,
+    result_depth: int = DEFAULT_RESULT_DEPTH,
+    top_k: int = TOP_K_PRODUCTS_PER_KEYWORD,
+    on_partial_products: Optional[Callable[[ProductBatch], None]] = None,
+) -> ProductBatch:
+    """Fans out the product fetch for a single keyword to AliExpress, Ishtari and HiCart at the same
+    time. The products of each website are scored against the keyword as soon as they arrive, and once
+    all of them finish or hit their deadline the top_k most similar products across the websites are
+    returned, best first (see utils/product_ranking.py). This way the time spent on a keyword is bounded
+    by the slowest website instead of the sum of all of them. Websites that were already fetched for this
+    keyword recently are served from the product cache.
+
+    result_depth is the number of Ishtari products to fetch, the only website whose api is paged. AliExpress
+    and HiCart return the products of their first search page.
+
+    on_partial_products is called with the ranked products found so far every time a website (other than
+    the last one) answers with products, so that they can be shown before the slower websites finish
+    """
+    ranker = TopKProductRanker(search_keyword, k=top_k)
+    remaining_websites = 3
+
+    async def fetch_and_rank(website_rank, website_name, website_url, *args, **kwargs):
+        nonlocal remaining_websites
+        products = await _fetch_website_products(
+            website_name, website_url, search_keyword, *args, **kwargs
+        )
+        ranker.add(products, website_rank=website_rank)
+        remaining_websites -= 1
+
+        # the products of the last website come with the return value
+        if on_partial_products is None or not remaining_websites:
+            return
+        if ranker.has_products():
+            try:
+                on_partial_products(ranker.ranked_products())
+            except Exception as e:
+                # the partial products are only a preview, the fetch goes on
+                logger.error(
+                    f"Couldn't hand over the partial products for {search_keyword}: {e}"
+                )
+
+    await asyncio.gather(
+        fetch_and_rank(
+            0,
+            "AliExpress",
+            "https://www.aliexpress.com",
+            lambda: fetch_aliexpress_product_recommendations(
+                search_keyword, AliExpress_Cookie_Object
+            ),
+            bypass_cache,
+            cookie_object=AliExpress_Cookie_Object,
+        ),
+        fetch_and_rank(
+            1,
+            "Ishtari",
+            "https://www.ishtari.com",
+            lambda: fetch_ishtari_product_recommendations(
+                search_keyword, Ishtari_Cookie_Object, result_depth
+            ),
+            bypass_cache,
+            result_depth,
+            cookie_object=Ishtari_Cookie_Object,
+        ),
+        fetch_and_rank(
+            2,
+            "HiCart",
+            "https://www.HiCart.com",
+            lambda: fetch_hicart_product_recommendations(search_keyword),
+            bypass_cache,
+        ),
+    )
+
+    return ranker.ranked_products()
@@ -1,7 +1,8 @@
 import os
-from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
 import sys
 import asyncio
+import threading
 import traceback
 from dotenv import load_dotenv
 
@@ -15,20 +16,170 @@ USE_ROTATING_IPS_WITH_SCRAPERAPI = bool(
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from utils.logger import logger
+from utils.html_parsing import parse_html
 from models.products import OutputFetchedProducts
+from utils.rate_limiting import WEBSITE_LIMITERS
+from utils.http_sessions import WEBSITE_REQUEST_TIMEOUT_SECONDS
 from using_scraper_api import get_request_using_cloudscraper_with_scraperapi
 
 import cloudscraper
+from cloudscraper.exceptions import CloudflareException
 
 # Doesn't require a cookie to fetch the needed product data from HiCart
 
+# Cloudflare answers with one of these when the clearance cookies are missing or no longer accepted
+CHALLENGE_STATUS_CODES = (403, 503)
+
+
+class HiCartScraper:
+    """One long lived cloudscraper session shared by every HiCart request. cloudscraper is designed
+    specifically to bypass cloudflare protection, which is the case with hicart.com. Solving the cloudflare
+    JavaScript challenge takes seconds, and the clearance cookies it gets are kept in the session, so once
+    one request went through the next ones are plain GETs on already open connections.
+
+    Until a request went through, the requests are sent one at a time so that only one of them solves the
+    challenge and the others reuse its cookies. When a challenge shows up again (the clearance expired), the
+    session is thrown away and the request is retried once with a new one.
+
+    get() is blocking like requests, it's meant to be run in a worker thread"""
+
+    def __init__(self):
+        self._scraper = None
+        self._lock = threading.Lock()
+        # held while a request without clearance is in flight
+        self._challenge_lock = threading.Lock()
+        self._cleared = threading.Event()
+
+    def _get_scraper(self) -> cloudscraper.CloudScraper:
+        with self._lock:
+            if self._scraper is None:
+                logger.debug("Creating a new HiCart cloudscraper session")
+                self._scraper = cloudscraper.create_scraper()
+            return self._scraper
+
+    def _discard(self, scraper: cloudscraper.CloudScraper):
+        """Drops the session unless another request already replaced it"""
+        with self._lock:
+            if self._scraper is scraper:
+                self._scraper = None
+                self._cleared.clear()
+                close = getattr(scraper, "close", None)
+                if close:
+                    close()
+
+    def get(self, url: str, **kwargs):
+        for attempt in range(2):
+            scraper = self._get_scraper()
+            try:
+                if self._cleared.is_set():
+                    response = scraper.get(url, **kwargs)
+                else:
+                    with self._challenge_lock:
+                        # another request may have gone through (or reset the session) while this one waited
+                        scraper = self._get_scraper()
+                        response = scraper.get(url, **kwargs)
+            except CloudflareException as e:
+                self._discard(scraper)
+                if attempt == 1:
+                    raise
+                logger.info(f"Couldn't get past the HiCart challenge, retrying: {e}")
+                continue
+            if response.status_code not in CHALLENGE_STATUS_CODES:
+                self._cleared.set()
+                return response
+            logger.info(
+                f"HiCart answered with {response.status_code}, getting a new clearance"
+            )
+            self._discard(scraper)
+        return response
+
+
+HICART_SCRAPER = HiCartScraper()
+
+
+PRODUCT_NAMES_AND_PRICES_ONLY = SoupStrainer(
+    ["h2", "div"], class_=["product-name", "price-box", "price-box-min"]
+)
+
+
+def _parse_hicart_search_page(html: str) -> OutputFetchedProducts:
+    """Extracts the first 10 (or less) product titles, urls and prices from the html of a HiCart search
+    page. Raises an exception if there are no products in the page"""
+    # only the product names and price boxes are parsed into the tree, the rest of the page is skipped
+    soup = parse_html(html, parse_only=PRODUCT_NAMES_AND_PRICES_ONLY)
+
+    # getting the titles
+    product_names = soup.find_all("h2", class_="product-name")
+    # only the first 10 or less
+    if len(product_names) > 10:
+        product_names = product_names[:10]
+    titles = [product.a.get_text(strip=True) for product in product_names]
+
+    # getting the product urls
+    product_urls = [product.a.get("href") for product in product_names]
+
+    logger.debug(f"These are the fetched titles: {titles}\n")
+    logger.debug(f"These are the fetched product urls: {product_urls}\n")
+    logger.debug(f"This is the number of fetched products: {len(product_names)}")
+
+    # getting the product prices.
+    price_boxes_with_discount = soup.find_all("div", class_="price-box")
+    price_boxes_without_discount = soup.find_all("div", class_="price-box-min")
+    logger.debug(
+        f"This is the number of fetched price boxes with discount: {len(price_boxes_with_discount)}"
+    )
+    logger.debug(
+        f"This is the number of fetched price boxes without discount: {len(price_boxes_without_discount)}"
+    )
+
+    # checking if the price is original or if there's a discount, the extraction differs for each case
+    prices_with_discount = [
+        "US "
+        + (
+            price.find("p", class_="special-price")
+            .find("span", class_="price")
+            .get_text(strip=True)  # gets the discounted price
+            if price.find("p", class_="special-price")
+            else price.find("span", class_="regular-price")
+            .find("span", class_="price")
+            .get_text(strip=True)  # gets the regular price
+        )
+        for price in price_boxes_with_discount
+    ]
+
+    prices_without_discount = [
+        "US " + (price.find("p", class_="minimal-price").get_text(strip=True))
+        for price in price_boxes_without_discount
+    ]
+    # concatenating the prices with and without discount together with more emphasis on the ones with discount
+    prices = prices_with_discount + prices_without_discount
+
+    logger.debug(f"These are the prices with discount: {prices_with_discount}")
+    logger.debug(f"These are the prices without discount: {prices_without_discount}")
+    logger.info(f"This is the number of fetched products from HiCart: {len(prices)}")
+
+    # only the first 10 or less
+    if len(prices) > 10:
+        prices = prices[:10]
+
+    # if no products are returned, rout the code to return the default no products found
+    if len(prices) == 0:
+        raise Exception("No products were found in the response from HiCart")
+
+    return OutputFetchedProducts(
+        product_names=list(titles),
+        product_urls=list(product_urls),
+        product_prices=list(prices),
+        website_source=["HiCart" for _ in range(len(titles))],
+    )
+
 
 async def fetch_hicart_product_recommendations(
     search_keyword: str,
 ) -> OutputFetchedProducts:
-    # cloudscraper is designed specifically to bypass cloudflare protection, which is the case with hicart.com. Clouflare picks up on bot behaviour
-    # and cloudscraper tries to mimick browser behaviour like handling JavaScript related tasks
-    scraper = cloudscraper.create_scraper()
+    # Clouflare picks up on bot behaviour and cloudscraper tries to mimick browser behaviour like handling
+    # JavaScript related tasks. The same session (and its clearance) is reused for every keyword
+    scraper = HICART_SCRAPER
 
     # turning multi-word search keywords into %20 notation
     search_keyword = search_keyword.strip().replace(" ", "%20")
@@ -39,93 +190,33 @@ async def fetch_hicart_product_recommendations(
         # no need to define the headers here because cloudscraper defines them automatically. And there's no needed cookie
         # by hicart.com to call this endpoint and fetch product data. I think it mainly relies on cloudflare for protection.
         if USE_ROTATING_IPS_WITH_SCRAPERAPI:
-            response = get_request_using_cloudscraper_with_scraperapi(
-                cloudscraper=scraper, url=url
+            request = get_request_using_cloudscraper_with_scraperapi(
+                cloudscraper=scraper,
+                url=url,
+                timeout=WEBSITE_REQUEST_TIMEOUT_SECONDS,
             )
         else:
-            response = scraper.get(url)
+            # cloudscraper is blocking (it's built on requests), so it runs in a worker thread
+            request = asyncio.to_thread(
+                scraper.get, url, timeout=WEBSITE_REQUEST_TIMEOUT_SECONDS
+            )
+        # the limiter caps the concurrent requests to HiCart and paces them
+        response = await WEBSITE_LIMITERS["HiCart"].run(request)
 
         # with open("hicart_response.txt", "w") as output:
         #     output.write(response.text)
 
         response.raise_for_status()  # to raise an exception when an exception happens, for debugging purposes. Without it, the response may be invalid and we wouldn't know immeadiately
 
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        # getting the titles
-        product_names = soup.find_all("h2", class_="product-name")
-        # only the first 10 or less
-        if len(product_names) > 10:
-            product_names = product_names[:10]
-        titles = [product.a.get_text(strip=True) for product in product_names]
-
-        # getting the product urls
-        product_urls = [product.a.get("href") for product in product_names]
-
-        logger.debug(f"These are the fetched titles: {titles}\n")
-        logger.debug(f"These are the fetched product urls: {product_urls}\n")
-        logger.debug(f"This is the number of fetched products: {len(product_names)}")
-
-        # getting the product prices.
-        price_boxes_with_discount = soup.find_all("div", class_="price-box")
-        price_boxes_without_discount = soup.find_all("div", class_="price-box-min")
-        logger.debug(
-            f"This is the number of fetched price boxes with discount: {len(price_boxes_with_discount)}"
-        )
-        logger.debug(
-            f"This is the number of fetched price boxes without discount: {len(price_boxes_without_discount)}"
-        )
-
-        # checking if the price is original or if there's a discount, the extraction differs for each case
-        prices_with_discount = [
-            "US "
-            + (
-                price.find("p", class_="special-price")
-                .find("span", class_="price")
-                .get_text(strip=True)  # gets the discounted price
-                if price.find("p", class_="special-price")
-                else price.find("span", class_="regular-price")
-                .find("span", class_="price")
-                .get_text(strip=True)  # gets the regular price
-            )
-            for price in price_boxes_with_discount
-        ]
-
-        prices_without_discount = [
-            "US " + (price.find("p", class_="minimal-price").get_text(strip=True))
-            for price in price_boxes_without_discount
-        ]
-        # concatenating the prices with and without discount together with more emphasis on the ones with discount
-        prices = prices_with_discount + prices_without_discount
-
-        logger.debug(f"These are the prices with discount: {prices_with_discount}")
-        logger.debug(
-            f"These are the prices without discount: {prices_without_discount}"
-        )
-        logger.info(
-            f"This is the number of fetched products from HiCart: {len(prices)}"
-        )
-
-        # only the first 10 or less
-        if len(prices) > 10:
-            prices = prices[:10]
-
-        # if no products are returned, rout the code to return the default no products found
-        if len(prices) == 0:
-            raise Exception("No products were found in the response from HiCart")
-
+        return _parse_hicart_search_page(response.text)
     except Exception as e:
         logger.info(f"Returning no products from HiCart: {e}\n{traceback.format_exc()}")
-        titles = ["No matched products from HiCart.com"]
-        product_urls = ["https://www.HiCart.com/No-matched-products-from-HiCart"]
-        prices = ["US"]
-
-    return OutputFetchedProducts(
-        product_names=list(titles),
-        product_urls=list(product_urls),
-        product_prices=list(prices),
-        website_source=["HiCart" for _ in range(len(titles))],
-    )
+        return OutputFetchedProducts(
+            product_names=["No matched products from HiCart.com"],
+            product_urls=["https://www.HiCart.com/No-matched-products-from-HiCart"],
+            product_prices=["US"],
+            website_source=["HiCart"],
+        )
 
 
 # examples:
@@ -7,15 +7,14 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from models.products import OutputFetchedProducts
 from utils.logger import logger
 from utils.api_utils import ISHTARI_COOKIE
+from utils.rate_limiting import WEBSITE_LIMITERS
+from utils.http_sessions import WEBSITE_REQUEST_TIMEOUT_SECONDS, WEBSITE_SESSIONS
+from utils.persistent_cache import CACHE_DIRECTORY, PersistentLRUCache
 from utils.using_playwright import get_ishtari_cookie_using_playwright
-from using_scraper_api import (
-    get_request_from_session_with_scraperapi,
-    get_request_using_scraperapi,
-)
+from using_scraper_api import get_request_from_session_with_scraperapi
 
-import requests
-import time
 import json
+import math
 import traceback
 import asyncio
 from dotenv import load_dotenv
@@ -31,32 +30,201 @@ logger.debug(
 )
 
 
+ISHTARI_SESSION = WEBSITE_SESSIONS["Ishtari"]
+
+# Ishtari answers most searches with a redirect to a category (its type_id) instead of the products. The
+# category of a keyword is remembered for this long, so that the next searches skip the search request
+# and the 2 seconds wait before the category request
+ISHTARI_CATEGORY_TTL_SECONDS = float(
+    os.getenv("ISHTARI_CATEGORY_TTL_SECONDS", "604800")
+)
+
+# Ishtari returns the search and category results in pages of this size
+NUMBER_OF_PRODUCTS_PER_PAGE = 10
+
+# wait between the search request and the category request of a redirect
+REDIRECT_DELAY_SECONDS = 2
+
+# keyword -> type_id, kept across restarts
+ISHTARI_CATEGORY_CACHE = PersistentLRUCache(
+    os.path.join(CACHE_DIRECTORY, "ishtari_categories.sqlite3"),
+    table="ishtari_categories",
+)
+
+
 async def get_ishtari_cookie_using_playwright_async_wrapper():
-    cookie = await get_ishtari_cookie_using_playwright()
+    cookie, _ = await get_ishtari_cookie_using_playwright()
     return cookie
 
 
-async def _fetch_products(search_keyword, Ishtari_Cookie_Object):
+def _category_cache_key(search_keyword: str) -> str:
+    # "Black  Shoes " and "black shoes" land on the same category
+    return " ".join(search_keyword.lower().split())
+
+
+async def _send_request(url, headers):
+    """Sends a GET to the Ishtari api under the website limiter, through ScraperAPI if it's enabled"""
+    # the session is shared by every keyword and job, so the connection to Ishtari stays open
+    session = ISHTARI_SESSION
+    if USE_ROTATING_IPS_WITH_SCRAPERAPI:
+        request = get_request_from_session_with_scraperapi(
+            session=session,
+            url=url,
+            country_code="us",
+            headers=headers,
+            timeout=WEBSITE_REQUEST_TIMEOUT_SECONDS,
+        )
+    else:
+        # requests is blocking, running it in a worker thread keeps the event loop free for other tasks
+        request = asyncio.to_thread(
+            session.get,
+            url,
+            headers=headers,
+            timeout=WEBSITE_REQUEST_TIMEOUT_SECONDS,
+        )
+    # the limiter caps the concurrent requests to Ishtari and paces them
+    response = await WEBSITE_LIMITERS["Ishtari"].run(request)
+    if USE_ROTATING_IPS_WITH_SCRAPERAPI:
+        logger.debug(
+            f"Used ScraperAPI to get the product data, this is the response: {response.text}"
+        )
+    else:
+        logger.debug("Didn't use ScraperAPI to get the product data")
+    return response
+
+
+async def _send_authorized_request(url, headers, Ishtari_Cookie_Object):
+    """Same as _send_request, but retries once with a new cookie if Ishtari rejects the current one"""
+    response = await _send_request(url, headers)
+
+    # Check for expired cookie, in which case the response would be that the api request is unauthorized
+    if response.status_code == 401:
+        logger.info("Cookie expired, fetching a new one.")
+        await Ishtari_Cookie_Object.refresh(rejected_cookie=headers["Cookie"])
+        headers["Cookie"] = Ishtari_Cookie_Object.cookie  # Update with new cookie
+        headers["Authorization"] = f"Bearer {Ishtari_Cookie_Object.get_api_token()}"
+
+        # Retry the request with a new cookie
+        response = await _send_request(url, headers)
+
+    response.raise_for_status()
+    return response
+
+
+def _number_of_pages(result_depth: int) -> int:
+    return max(1, math.ceil(result_depth / NUMBER_OF_PRODUCTS_PER_PAGE))
+
+
+def _page_url(url: str, page: int) -> str:
+    # Ishtari counts the pages from 1 (page=0 is answered with the first page as well)
+    return f"{url}&page={page}"
+
+
+async def _fetch_pages(url, pages, headers, Ishtari_Cookie_Object):
+    """Requests the given pages at the same time, the Ishtari limiter caps how many of them are in flight.
+    Returns the products of every page in page order, a page that failed is logged and has no products
+    """
+    responses = await asyncio.gather(
+        *(
+            _send_authorized_request(
+                _page_url(url, page), dict(headers), Ishtari_Cookie_Object
+            )
+            for page in pages
+        ),
+        return_exceptions=True,
+    )
+    pages_products = []
+    for page, response in zip(pages, responses):
+        try:
+            if isinstance(response, Exception):
+                raise response
+            pages_products.append(response.json().get("data", {}).get("products", []))
+        except Exception as e:
+            logger.error(f"Couldn't fetch the page {page} from Ishtari: {e}")
+            pages_products.append([])
+    return pages_products
+
+
+def _merge_pages(first_page_data, pages_products, result_depth):
+    """Appends the products of the next pages after the ones of the first page and keeps the first
+    result_depth of them. A product can show up on two pages if the catalog changed in between
+    """
+    products = []
+    seen_product_ids = set()
+    for page_products in [first_page_data["data"].get("products", []), *pages_products]:
+        for product in page_products:
+            if product.get("product_id") in seen_product_ids:
+                continue
+            seen_product_ids.add(product.get("product_id"))
+            products.append(product)
+    return {
+        **first_page_data,
+        "data": {**first_page_data["data"], "products": products[:result_depth]},
+    }
+
+
+async def _fetch_category_products(
+    type_id, headers, Ishtari_Cookie_Object, result_depth
+):
+    """Fetches the products of an Ishtari category (the type_id of a search redirect), all of its pages
+    at once. Returns None if the category has no products"""
+    # Construct the new URL for the actual product data. We assign the type id in the url, following how the website handles these redirects
+    category_url = f"https://www.ishtari.com/motor/v2/index.php?route=catalog/category&path={type_id}&source_id=1&limit={NUMBER_OF_PRODUCTS_PER_PAGE}"
+
+    # Add cache-busting parameters. Although the call works without them, I'm keeping them.
+    headers.update(
+        {
+            "Cache-Control": "no-cache, no-store, must-revalidate",
+            "Pragma": "no-cache",
+            "Expires": "0",
+        }
+    )
+    response, pages_products = await asyncio.gather(
+        _send_authorized_request(
+            _page_url(category_url, 1), headers, Ishtari_Cookie_Object
+        ),
+        _fetch_pages(
+            category_url,
+            range(2, _number_of_pages(result_depth) + 1),
+            headers,
+            Ishtari_Cookie_Object,
+        ),
+    )
+
+    logger.debug(f"This is the response: {response.text}")
+    try:
+        product_data = response.json()
+    except json.JSONDecodeError:
+        logger.error("Failed to decode JSON response:")
+        logger.error(response.text)
+        raise
+    products = product_data.get("data", {}).get("products", [])
+    logger.debug(f"This is the products list: {products}")
+    if len(products) == 0:
+        return None
+    return _merge_pages(product_data, pages_products, result_depth)
+
+
+async def _fetch_products(
+    search_keyword, Ishtari_Cookie_Object, result_depth=NUMBER_OF_PRODUCTS_PER_PAGE
+):
     """Function that fetches products from ishtari.com. Due to how the website works (not sure why), not all first
     requests return product data (they would return that we already have the data cached). In which case,
     we do another request taking the type_id from the first response and add it as a query parameter
     'path' in the api url. type_id seems to be referring to discrete product groups which could mean that
     there's a finite number of possible results to be fetched on this website and it's not a dynamic process.
+
+    Since the type_id of a keyword doesn't change often, it's remembered in ISHTARI_CATEGORY_CACHE and the
+    next searches for that keyword go straight to the category.
+
+    Up to result_depth products are returned, when it's more than a page the other pages are requested
+    at the same time once we know where the products are (search or category)
     """
-    NUMBER_OF_PRODUCTS_TO_FETCH = 10
-
-    # First request to get the redirect/cache info
-    initial_url = f"https://www.ishtari.com/motor/v2/index.php?route=catalog/search&key={search_keyword}&limit={NUMBER_OF_PRODUCTS_TO_FETCH}&page=0"
-
-    if (
-        # ISHTARI_COOKIE.cookie is None
-        Ishtari_Cookie_Object.cookie
-        is None
-    ):  # Ishtari cookie has not been set yet, this statement is only entered at the first use of this fetch function
-        # fetch a new Ishtari cookie
-        Ishtari_Cookie_Object.cookie = await get_ishtari_cookie_using_playwright()
-    else:
-        logger.info("Ishtari cookie is present, no need to fetch a new one")
+    search_url = f"https://www.ishtari.com/motor/v2/index.php?route=catalog/search&key={search_keyword}&limit={NUMBER_OF_PRODUCTS_PER_PAGE}"
+
+    # only harvests a new cookie if it has not been set yet or it has expired, and if a harvest is already
+    # running (another keyword or the background refresher) it waits for that one
+    ishtari_cookie = await Ishtari_Cookie_Object.get_fresh_cookie()
 
     headers = {
         "Accept": "application/json, text/plain, */*",
@@ -65,7 +233,7 @@ async def _fetch_products(search_keyword, Ishtari_Cookie_Object):
         "Authorization": f"Bearer {Ishtari_Cookie_Object.get_api_token()}",
         "Cache-Control": "no-cache",
         "Pragma": "no-cache",
-        "Cookie": Ishtari_Cookie_Object.cookie,
+        "Cookie": ishtari_cookie,
         "Referer": f"https://www.ishtari.com/search?keyword={search_keyword}",
         "Sec-Ch-Ua": '"Chromium";v="130", "Google Chrome";v="130", "Not?A_Brand";v="99"',
         "Sec-Ch-Ua-Mobile": "?0",
@@ -77,40 +245,29 @@ async def _fetch_products(search_keyword, Ishtari_Cookie_Object):
     }
 
     try:
-        # using a session maintains cookies across different requests
-        session = requests.Session()
-        # First request to get redirect info
-        if USE_ROTATING_IPS_WITH_SCRAPERAPI:
-            response = get_request_from_session_with_scraperapi(
-                session=session, url=initial_url, country_code="us", headers=headers
-            )
-            logger.debug(
-                f"Used ScraperAPI to get the product data, this is the response: {response.text}"
+        category_cache_key = _category_cache_key(search_keyword)
+        type_id = ISHTARI_CATEGORY_CACHE.get(category_cache_key)
+        if type_id is not None:
+            logger.info(f"Going straight to the Ishtari category {type_id}")
+            product_data = await _fetch_category_products(
+                type_id,
+                dict(headers),
+                Ishtari_Cookie_Object,
+                result_depth,
             )
-        else:
-            response = session.get(initial_url, headers=headers)
-            logger.debug("Didn't use ScraperAPI to get the product data")
-
-        # Check for expired cookie, in which case the response would be that the api request is unauthorized
-        if response.status_code == 401:
-            logger.info("Cookie expired, fetching a new one.")
-            Ishtari_Cookie_Object.cookie = await get_ishtari_cookie_using_playwright()
-            headers["Cookie"] = Ishtari_Cookie_Object.cookie  # Update with new cookie
+            if product_data is not None:
+                return product_data
+            # the category is empty now, the search may redirect somewhere else
+            logger.info(f"The Ishtari category {type_id} is empty, searching again")
+            ISHTARI_CATEGORY_CACHE.delete(category_cache_key)
+            # the cookie may have been refreshed by the category request
+            headers["Cookie"] = Ishtari_Cookie_Object.cookie
             headers["Authorization"] = f"Bearer {Ishtari_Cookie_Object.get_api_token()}"
 
-            # Retry the initial request with a new cookie
-            if USE_ROTATING_IPS_WITH_SCRAPERAPI:
-                response = get_request_from_session_with_scraperapi(
-                    session=session, url=initial_url, country_code="us", headers=headers
-                )
-                logger.debug(
-                    f"Used ScraperAPI to get the product data, this is the response: {response.text}"
-                )
-            else:
-                response = session.get(initial_url, headers=headers)
-                logger.debug("Didn't use ScraperAPI to get the product data")
-
-        response.raise_for_status()
+        # First request to get redirect info
+        response = await _send_authorized_request(
+            _page_url(search_url, 1), headers, Ishtari_Cookie_Object
+        )
         initial_data = response.json()
 
         if not initial_data.get("success"):
@@ -124,48 +281,31 @@ async def _fetch_products(search_keyword, Ishtari_Cookie_Object):
             # a failed first request looks like: {"success":true,"data":{"redirect":"1","type":"category","type_id":"4006","is_cache":true}}
             type_id = initial_data["data"].get("type_id")
 
-            # Construct the new URL for the actual product data. We assign the type id in the url, following how the website handles these redirects
-            product_url = f"https://www.ishtari.com/motor/v2/index.php?route=catalog/category&path={type_id}&source_id=1&limit={NUMBER_OF_PRODUCTS_TO_FETCH}"
-
-            # Add cache-busting parameters. Although the second call works without them, I'm keeping them.
-            headers.update(
-                {
-                    "Cache-Control": "no-cache, no-store, must-revalidate",
-                    "Pragma": "no-cache",
-                    "Expires": "0",
-                }
-            )
-
-            # Small delay to prevent rate limiting
-            time.sleep(2)
+            # Small delay to prevent rate limiting. asyncio.sleep instead of time.sleep so that the
+            # other keywords and endpoints keep running in the meantime
+            await asyncio.sleep(REDIRECT_DELAY_SECONDS)
 
             # Making the second request
-            if USE_ROTATING_IPS_WITH_SCRAPERAPI:
-                response = get_request_using_scraperapi(
-                    url=product_url, country_code="us", headers=headers
-                )
-            else:
-                response = requests.get(product_url, headers=headers)
-
-            response.raise_for_status()
-            logger.debug(f"This is the response: {response.text}")
-            logger.debug(
-                f"This is the products list: {response.json().get('data', {}).get('products', [])}"
+            product_data = await _fetch_category_products(
+                type_id, headers, Ishtari_Cookie_Object, result_depth
             )
             # if there are no products to show at the page, raise an exception so that the except block would catch it and return no products found
-            if len(response.json().get("data", {}).get("products", [])) == 0:
+            if product_data is None:
                 raise Exception("No products found in the response")
 
-            try:
-                product_data = response.json()
-                return product_data
-            except json.JSONDecodeError:
-                logger.error("Failed to decode JSON response:")
-                logger.error(response.text)
-                raise
+            ISHTARI_CATEGORY_CACHE.set(
+                category_cache_key, type_id, ttl_seconds=ISHTARI_CATEGORY_TTL_SECONDS
+            )
+            return product_data
         else:
-            # If no redirect, return the initial data
-            return initial_data
+            # If no redirect, return the initial data along with the products of the next search pages
+            pages_products = await _fetch_pages(
+                search_url,
+                range(2, _number_of_pages(result_depth) + 1),
+                headers,
+                Ishtari_Cookie_Object,
+            )
+            return _merge_pages(initial_data, pages_products, result_depth)
     except Exception as e:
         logger.error(
             f"Returning no products from Ishtari: {e}\n{traceback.format_exc()}"
@@ -184,7 +324,7 @@ async def _fetch_products(search_keyword, Ishtari_Cookie_Object):
         }
 
 
-async def _process_product_data(product_data):
+def _process_product_data(product_data):
     """Process the received product data"""
 
     # logger.debug(f"This is the product_data: {product_data}")
@@ -219,9 +359,11 @@ async def _process_product_data(product_data):
     return output_products
 
 
-async def fetch_ishtari_product_recommendations(search_keyword, Ishtari_Cookie_Object):
-    return await _process_product_data(
-        await _fetch_products(search_keyword, Ishtari_Cookie_Object)
+async def fetch_ishtari_product_recommendations(
+    search_keyword, Ishtari_Cookie_Object, result_depth=NUMBER_OF_PRODUCTS_PER_PAGE
+):
+    return _process_product_data(
+        await _fetch_products(search_keyword, Ishtari_Cookie_Object, result_depth)
     )
 
 